@@ -0,0 +1,102 @@
+"""
+Benchmark for the precompiled, cache-friendly response prompt.
+
+Offline, it times building the per-turn system prompt the old way (an f-string that re-embeds
+the core principles and guidelines every turn) against the precompiled per-stage lookup, and
+checks that every stage prompt shares one byte-identical static prefix.
+
+With --live N it also sends N response calls (varying users and stages) and reports the
+cached-token ratio from the usage data (usage.prompt_tokens_details.cached_tokens).
+Use --base-url to point at an OpenAI-compatible server instead of the real API.
+
+Usage:
+    python bench_prompt_prefix.py
+    python bench_prompt_prefix.py --live 20 [--base-url http://127.0.0.1:8100/v1]
+"""
+import os
+import time
+import argparse
+
+from stage_classifier import STAGES
+from context_builder import count_tokens
+from sqlite_memory_manager import ConversationSnapshot, MessageRecord
+
+
+def legacy_compose(agent, stage: str, conversation_history: str) -> str:
+    """The per-turn prompt construction used before templates were precompiled."""
+    instructions = agent.actionable_instructions(stage)
+    return (
+        f"You are {agent.agent_name}, a reflective and principle-driven agent. Your role is to guide the user through "
+        f"challenging conversations based on the following core principles:\n\n{agent.core_principles}\n\n"
+        f"Current Conversation Stage: {stage}\n"
+        f"Actionable Instructions: {instructions}\n\n"
+        f"Conversation History:\n{conversation_history}\n\n"
+        "Based on the above, respond thoughtfully to the user's latest input."
+        """"### Guidelines for Interaction:
+            - Respond thoughtfully, adhering to the core principles and stage-specific instructions.
+        - Incorporate the user's input and past interactions when formulating your response.
+        - Conclude the interaction when appropriate, ensuring the user feels supported and has actionable next steps.
+        When using Socratic questioning and Core principles:
+        1.    Stay neutral and curious—don’t impose your own beliefs or judgments.
+        2.    Follow up on responses with deeper questions to encourage reflection and exploration.
+        3.    Create a safe and respectful environment where the person feels comfortable sharing and reflecting."""
+    )
+
+
+def bench_build(agent, iterations: int):
+    history = "USER: I keep disagreeing with my manager.\nAGENT: What do you think is underneath it?"
+    start = time.perf_counter()
+    for i in range(iterations):
+        legacy_compose(agent, STAGES[i % len(STAGES)], history)
+    legacy = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        agent._compose_system_prompt(STAGES[i % len(STAGES)])
+    precompiled = (time.perf_counter() - start) / iterations
+
+    prompts = [agent.stage_prompts[stage] for stage in STAGES]
+    shared = os.path.commonprefix(prompts)
+    print(f"prompt build (legacy f-string):   {legacy * 1e6:8.2f} us/turn")
+    print(f"prompt build (precompiled):       {precompiled * 1e6:8.2f} us/turn")
+    print(f"static prefix identical across stages: {shared.startswith(agent.static_prompt_prefix)}")
+    print(f"shared prefix: {len(shared)} chars, ~{count_tokens(shared)} tokens "
+          f"(provider prefix caching needs >= 1024)")
+
+
+def bench_live(agent, calls: int, model: str, client):
+    from partnerable_agent_with_memory import call_llm
+
+    prompt_tokens = cached_tokens = 0
+    for i in range(calls):
+        question = MessageRecord("user", f"Message {i}: how should I approach my team?")
+        turn = ConversationSnapshot(f"bench-user-{i}", "", [question])
+        messages = agent._response_messages(turn, STAGES[i % len(STAGES)])
+        result = call_llm(messages, model=model, client=client)
+        prompt_tokens += result["prompt_tokens"]
+        cached_tokens += result["cached_tokens"]
+    ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+    print(f"live calls: {calls}, prompt tokens: {prompt_tokens}, cached: {cached_tokens} ({ratio:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt assembly and prefix-cache hit ratio.")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--live", type=int, default=0, help="Number of real response calls to send")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--base-url", help="OpenAI-compatible API base URL")
+    args = parser.parse_args()
+
+    from partnerable_agent_with_memory import PartnerableAgent, client
+
+    agent = PartnerableAgent(db_path=":memory:")
+    bench_build(agent, args.iterations)
+    if args.live:
+        if args.base_url:
+            from openai import OpenAI
+            client = OpenAI(api_key=client.api_key or "sk-local", base_url=args.base_url)
+        bench_live(agent, args.live, args.model, client)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark for long-term recall (long_term_memory.py) at a large number of stored vectors.
+
+Measures, for N random unit vectors of size DIM:
+  1. in-memory top-k search: one matrix-vector product plus argpartition over all N vectors;
+  2. bulk insert of the vectors into a scratch SQLite database (memory_vectors table);
+  3. LongTermMemory.recall for a user holding N / USERS of them: the first call reads the user's
+     vectors into a contiguous matrix, later calls reuse it; then two incremental top-ups after
+     a few more vectors are archived.
+Recall timings include embedding the query (HashingEmbedder) and fetching the hits' texts.
+
+Usage:
+    python bench_recall.py --vectors 1000000 --dim 256 --users 1 --queries 100
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from long_term_memory import HashingEmbedder, LongTermMemory, top_k
+from sqlite_memory_manager import SQLiteMemory
+
+INSERT_BATCH = 10000
+
+
+def _percentiles(seconds):
+    ordered = sorted(seconds)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000
+    return f"p50 {pick(50):8.2f} ms   p95 {pick(95):8.2f} ms"
+
+
+def _random_unit(rng, n: int, dim: int):
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def bench_search(args, rng):
+    matrix = _random_unit(rng, args.vectors, args.dim)
+    queries = _random_unit(rng, args.queries, args.dim)
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        top_k(matrix, query, args.k)
+        timings.append(time.perf_counter() - started)
+    mean = sum(timings) / len(timings)
+    print(f"numpy top-{args.k} over {args.vectors:,} x {args.dim} ({matrix.nbytes / 2 ** 20:,.0f} MB): "
+          f"{_percentiles(timings)}   {args.vectors / mean / 1e6:,.0f}M vectors/s")
+
+
+def bench_sqlite(args, rng, db_path: str):
+    sqlite_memory = SQLiteMemory(db_path)  # creates the memory_vectors table
+    pool = sqlite_memory.pool
+    embedder = HashingEmbedder(args.dim)
+    per_user_bytes = -(-args.vectors // args.users) * args.dim * 4
+    memory = LongTermMemory(pool, embedder, top_k=args.k, min_score=-1.0, cache_max_bytes=2 * per_user_bytes)
+
+    started = time.perf_counter()
+    now = int(time.time())
+    for start in range(0, args.vectors, INSERT_BATCH):
+        count = min(INSERT_BATCH, args.vectors - start)
+        vectors = _random_unit(rng, count, args.dim)
+        user_ids = [f"user-{(start + i) % args.users}" for i in range(count)]
+        # One transaction per user and batch, as archive() writes them
+        for user in sorted(set(user_ids)):
+            rows = [i for i, u in enumerate(user_ids) if u == user]
+            items = [("message", "user", start + i, f"archived message {start + i}", now) for i in rows]
+            memory.add_vectors(user, items, vectors[rows])
+    seconds = time.perf_counter() - started
+    print(f"sqlite insert: {args.vectors:,} vectors in {seconds:.1f}s ({args.vectors / seconds:,.0f} vectors/s), "
+          f"database {os.path.getsize(db_path) / 2 ** 20:,.0f} MB")
+
+    user = "user-0"
+    queries = [f"archived message {i}" for i in range(args.queries)]
+    started = time.perf_counter()
+    memory.recall(user, queries[0])
+    print(f"recall, cold (load {args.vectors // args.users:,} vectors from SQLite): "
+          f"{(time.perf_counter() - started) * 1000:,.0f} ms")
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        memory.recall(user, query)
+        timings.append(time.perf_counter() - started)
+    print(f"recall, warm (cached matrix): {_percentiles(timings)}")
+
+    # The first top-up moves the matrix into a buffer with spare capacity; later ones append in place
+    for attempt in ("first", "second"):
+        memory.archive(user, [("message", "user", args.vectors + i, f"new message {i}", now) for i in range(100)])
+        started = time.perf_counter()
+        memory.recall(user, queries[0])
+        print(f"recall after archiving 100 more ({attempt} incremental top-up): "
+              f"{(time.perf_counter() - started) * 1000:,.1f} ms")
+    print(f"loads: {memory.stats['full_loads']} full, {memory.stats['incremental_loads']} incremental")
+    sqlite_memory.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark long-term recall at scale.")
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--users", type=int, default=1, help="Users the vectors are spread over")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-sqlite", action="store_true", help="Only run the in-memory search")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    bench_search(args, rng)
+    if args.skip_sqlite:
+        return
+    workdir = tempfile.mkdtemp(prefix="bench_recall_")
+    try:
+        bench_sqlite(args, rng, os.path.join(workdir, "recall.db"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Throughput scaling benchmark for the multi-worker (stateless) deployment mode.
+
+For each worker count it starts main.py under uvicorn with WEB_CONCURRENCY=N against a fresh
+database and the local mock OpenAI server, drives it with load_test.run_load and reports
+requests/second and the speedup over one worker. Use a short mock latency and enough concurrent
+users so the API (not the mock) is the bottleneck; the speedup is bounded by the CPU cores.
+
+Usage:
+    python bench_workers.py --workers 1 2 4 --users 200 --turns 3 --latency-ms 20
+"""
+import os
+import sys
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from load_test import REPO_DIR, run_load, _wait_until_up
+
+
+async def bench(workers: int, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    env = dict(os.environ, OPENAI_API_KEY="mock", OPENAI_BASE_URL=f"http://127.0.0.1:{args.mock_port}/v1",
+               WEB_CONCURRENCY=str(workers), METRICS_DIR=os.path.join(workdir, "metrics"))
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR, "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        await _wait_until_up(f"{url}/")
+        await asyncio.sleep(1.0)  # let every worker finish starting up
+        result = await run_load(url, args.users, args.turns, args.users, seed=workers)
+        return result.report()
+    finally:
+        api.terminate()
+        api.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def _main(args):
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "mock_openai_server.py"), "--port", str(args.mock_port),
+         "--latency-ms", str(args.latency_ms), "--dist", "fixed", "--completion-tokens", "40"],
+    )
+    try:
+        await _wait_until_up(f"http://127.0.0.1:{args.mock_port}/stats")
+        print(f"cpu cores: {os.cpu_count()}, users: {args.users}, turns/user: {args.turns}, "
+              f"mock latency: {args.latency_ms:g} ms")
+        print(f"{'workers':>8} {'req/s':>9} {'speedup':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        baseline = None
+        for workers in args.workers:
+            report = await bench(workers, args)
+            rps = report["throughput_rps"]
+            baseline = baseline or rps
+            print(f"{workers:>8} {rps:>9.1f} {rps / baseline if baseline else 0:>7.2f}x "
+                  f"{report['latency_ms']['p50']:>9.1f} {report['latency_ms']['p99']:>9.1f} {report['errors']:>7}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure /interact throughput as worker processes are added.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200, help="Concurrent synthetic users")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mock LLM latency")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mock-port", type=int, default=8100)
+    args = parser.parse_args(argv)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from typing import Dict, List, Sequence, Tuple
+
+from sqlite_memory_manager import MessageRecord
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+# Default number of prompt tokens the context builder may spend per LLM call
+DEFAULT_CONTEXT_BUDGET = 6000
+# Approximate per-message framing cost of the chat format (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Introduces the long-term memory snippets in the prompt
+RECALL_HEADER = "Relevant earlier conversation (from long-term memory):"
+
+_encoders = {}
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Count tokens with tiktoken's encoding for the model when it is installed,
+    otherwise estimate at ~4 characters per token.
+    """
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    encoder = _encoders.get(model)
+    if encoder is None:
+        try:
+            encoder = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoder = tiktoken.get_encoding("o200k_base")
+        _encoders[model] = encoder
+    return len(encoder.encode(text))
+
+
+class ContextBuilder:
+    """
+    Assembles the message list for a response call within a token budget.
+    Each piece of context is sent exactly once, filled in priority order:
+      1. the system prompt (core principles + stage instructions), always included;
+      2. the conversation summary, if it fits;
+      3. the newest messages, walking back in time until the budget runs out
+         (the latest message is always included);
+      4. snippets recalled from long-term memory (best match first), in what is left.
+    Recalled snippets are placed before the messages, but never take budget from them.
+    build() also reports what the previous layout would have cost, which embedded the whole
+    history in the system prompt and then sent every message again.
+    """
+
+    def __init__(self, budget: int = DEFAULT_CONTEXT_BUDGET, model: str = "gpt-4o"):
+        """
+        :param budget: Maximum prompt tokens to spend.
+        :param model: Model whose tokenizer is used for counting.
+        """
+        self.budget = budget
+        self.model = model
+
+    def _tokens(self, text: str) -> int:
+        return count_tokens(text, self.model) + MESSAGE_OVERHEAD_TOKENS
+
+    def build(self, system_prompt: str, summary: str, messages: Sequence[MessageRecord],
+              recalled: Sequence[str] = ()) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        :param system_prompt: Static instructions (principles, stage, guidelines) without history.
+        :param summary: The rolling conversation summary ("" if none).
+        :param messages: Message records, oldest first.
+        :param recalled: Rendered long-term memory snippets, best match first.
+        :return: (LLM messages, report with token counts).
+        """
+        system_tokens = self._tokens(system_prompt)
+        used = system_tokens
+        summary_tokens = self._tokens(f"Conversation Summary: {summary}") if summary else 0
+        include_summary = bool(summary) and used + summary_tokens <= self.budget
+        if include_summary:
+            used += summary_tokens
+
+        # Walk back from the newest message; stop at the first one that no longer fits so the
+        # history stays contiguous. History tokens are counted in full for the savings report.
+        kept = 0
+        history_tokens = summary_tokens
+        budget_left = True
+        for message in reversed(messages):
+            tokens = self._tokens(message.text)
+            history_tokens += tokens
+            if budget_left and (kept == 0 or used + tokens <= self.budget):
+                kept += 1
+                used += tokens
+            else:
+                budget_left = False
+        kept_messages = messages[len(messages) - kept:]
+
+        kept_recalled = []
+        for snippet in recalled:
+            line = f"- {snippet}"
+            tokens = self._tokens(line) if kept_recalled else self._tokens(f"{RECALL_HEADER}\n{line}")
+            if used + tokens > self.budget:
+                break
+            kept_recalled.append(line)
+            used += tokens
+
+        llm_messages = [{"role": "system", "content": system_prompt}]
+        if include_summary:
+            llm_messages.append({"role": "system", "content": f"Conversation Summary: {summary}"})
+        if kept_recalled:
+            llm_messages.append({"role": "system", "content": "\n".join([RECALL_HEADER] + kept_recalled)})
+        llm_messages.extend(message.to_llm() for message in kept_messages)
+
+        # Old layout: history rendered into the system prompt, then every item sent again.
+        previous = system_tokens + 2 * history_tokens
+        report = {
+            "prompt_tokens": used,
+            "budget": self.budget,
+            "messages_included": kept,
+            "messages_dropped": len(messages) - kept,
+            "summary_included": int(include_summary),
+            "recalled_included": len(kept_recalled),
+            "previous_layout_tokens": previous,
+            "tokens_saved": previous - used,
+        }
+        return llm_messages, report
@@ -0,0 +1,244 @@
+"""
+Bulk import / export of conversations as JSONL (one JSON object per line).
+
+Import accepts, per line:
+    {"type": "message", "user_id": "alice", "role": "user", "text": "...", "timestamp": 1700000000}
+    {"type": "summary", "user_id": "alice", "text": "..."}
+    {"user_id": "alice", "messages": [["user", "hi"], {"role": "agent", "text": "..."}]}   (a transcript)
+"type" defaults to "message", "assistant" is accepted for "agent", a missing timestamp means now,
+and "seq" is ignored: rows are numbered after the user's existing messages, in file order.
+Lines are parsed as they are read and written in batches, one transaction per batch, without
+triggering summarization per message (queue it once at the end with --summarize, which uses the
+agent's LLM summarizer like live traffic, or let each user's next turn trigger it). An imported
+summary replaces the user's earlier summary and messages. Export streams every user's latest
+summary and stored messages in the first two forms, so an export can be imported again.
+
+Usage:
+    python conversation_io.py import transcripts.jsonl --db memory.db --batch-size 2000
+    python conversation_io.py export --db memory.db -o backup.jsonl [--user alice --user bob]
+Over HTTP (main.py): POST /import with a JSONL body, GET /export[?user_id=...].
+"""
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import AsyncIterable, Iterable, Iterator, List, Optional, Union
+
+from sqlite_memory_manager import SQLiteMemory
+
+DEFAULT_IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 10
+
+_ROLES = {"user": "user", "agent": "agent", "assistant": "agent"}
+
+
+def parse_line(line: str, now: int) -> List[tuple]:
+    """Rows (see SQLiteMemory.import_rows) for one JSONL line; [] for a blank line, ValueError if invalid."""
+    line = line.strip()
+    if not line:
+        return []
+    obj = json.loads(line)
+    if not isinstance(obj, dict) or not isinstance(obj.get("user_id"), str) or not obj["user_id"]:
+        raise ValueError("expected an object with a user_id")
+    user_id = obj["user_id"]
+    if "messages" in obj:
+        rows = []
+        for message in obj["messages"]:
+            if isinstance(message, dict):
+                role, text = message.get("role"), message.get("text", message.get("content"))
+                timestamp = message.get("timestamp", now)
+            else:
+                role, text = message
+                timestamp = now
+            rows.append(_message(user_id, role, text, timestamp))
+        return rows
+    kind = obj.get("type", "message")
+    if kind == "summary":
+        return [("summary", user_id, None, _text(obj.get("text")), int(obj.get("timestamp", now)))]
+    if kind != "message":
+        raise ValueError(f"unknown type {kind!r}")
+    return [_message(user_id, obj.get("role"), obj.get("text"), obj.get("timestamp", now))]
+
+
+def _text(text) -> str:
+    if not isinstance(text, str):
+        raise ValueError("text must be a string")
+    return text
+
+
+def _message(user_id: str, role, text, timestamp) -> tuple:
+    if role not in _ROLES:
+        raise ValueError(f"unknown role {role!r}")
+    return "message", user_id, _ROLES[role], _text(text), int(timestamp)
+
+
+class JSONLImporter:
+    """
+    Turns JSONL lines into batches for SQLiteMemory.import_rows and keeps the counters.
+    feed() returns a full batch when one is ready; the caller writes it (write() directly, or in
+    a worker thread from async code) so parsing and batching stay the same for the CLI and the API.
+    Invalid lines are logged, counted and skipped.
+    """
+
+    def __init__(self, memory: SQLiteMemory, batch_size: int = DEFAULT_IMPORT_BATCH_SIZE):
+        """
+        :param memory: Destination SQLiteMemory.
+        :param batch_size: Rows written per transaction.
+        """
+        self.memory = memory
+        self.batch_size = max(1, batch_size)
+        self.lines = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = []
+        self.error_count = 0
+        self.users = set()
+        self.queued_for_summarization = 0
+        self._batch = []
+        self._started = time.perf_counter()
+        self._seconds = None
+
+    def feed(self, line: Union[str, bytes]) -> Optional[List[tuple]]:
+        self.lines += 1
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")  # a UnicodeDecodeError is counted like any invalid line
+            self._batch.extend(parse_line(line, int(time.time())))
+        except (ValueError, TypeError) as e:
+            self.error_count += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append(f"line {self.lines}: {e}")
+            logging.error(f"Skipping import line {self.lines}: {e}")
+        if len(self._batch) >= self.batch_size:
+            return self.take()
+        return None
+
+    def take(self) -> List[tuple]:
+        batch, self._batch = self._batch, []
+        return batch
+
+    def write(self, batch: List[tuple]):
+        if not batch:
+            return
+        self.users |= self.memory.import_rows(batch)
+        self.rows += len(batch)
+        self.batches += 1
+
+    def finish(self, summarize: bool = False):
+        """Call after the last batch was written; optionally queue summarization for the imported users."""
+        if summarize:
+            self.queued_for_summarization = self.memory.queue_summarization(self.users)
+        self._seconds = time.perf_counter() - self._started
+
+    def report(self) -> dict:
+        seconds = self._seconds if self._seconds is not None else time.perf_counter() - self._started
+        return {
+            "lines": self.lines,
+            "rows": self.rows,
+            "users": len(self.users),
+            "batches": self.batches,
+            "errors": self.error_count,
+            "error_samples": self.errors,
+            "queued_for_summarization": self.queued_for_summarization,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds, 1) if seconds else 0.0,
+        }
+
+
+def import_jsonl(memory: SQLiteMemory, lines: Iterable[str], batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+                 summarize: bool = False) -> JSONLImporter:
+    importer = JSONLImporter(memory, batch_size)
+    for line in lines:
+        importer.write(importer.feed(line))
+    importer.write(importer.take())
+    importer.finish(summarize)
+    return importer
+
+
+async def aimport_jsonl(memory: SQLiteMemory, lines: AsyncIterable[Union[str, bytes]],
+                        batch_size: int = DEFAULT_IMPORT_BATCH_SIZE, summarize: bool = False) -> JSONLImporter:
+    """Async variant of import_jsonl: each batch is written in a worker thread."""
+    importer = JSONLImporter(memory, batch_size)
+    async for line in lines:
+        batch = importer.feed(line)
+        if batch:
+            await asyncio.to_thread(importer.write, batch)
+    await asyncio.to_thread(importer.write, importer.take())
+    await asyncio.to_thread(importer.finish, summarize)
+    return importer
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterable[bytes]:
+    """Split a stream of byte chunks (e.g. a request body) into lines, left undecoded for JSONLImporter.feed."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def export_jsonl(memory: SQLiteMemory, user_ids: Optional[List[str]] = None) -> Iterator[str]:
+    """JSONL lines for SQLiteMemory.export_rows, one row at a time."""
+    for row in memory.export_rows(user_ids):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import / export conversations as JSONL.")
+    parser.add_argument("--db", default="memory.db", help="SQLite database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Import a JSONL file ('-' for stdin)")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_IMPORT_BATCH_SIZE)
+    import_parser.add_argument("--summarize", action="store_true",
+                               help="Summarize users over the memory limit after importing, with the agent's "
+                                    "LLM summarizer (needs OPENAI_API_KEY)")
+    export_parser = commands.add_parser("export", help="Export conversations as JSONL")
+    export_parser.add_argument("-o", "--output", default="-", help="Output file ('-' for stdout)")
+    export_parser.add_argument("--user", action="append", dest="users", help="Only this user (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.command == "import" and args.summarize:
+        # Same summarizer (model and prompt) as live traffic; imported here as it needs an API key
+        from partnerable_agent_with_memory import PartnerableAgent
+        agent = PartnerableAgent(db_path=args.db)
+        memory, close = agent.sqlite_memory, agent.close
+    else:
+        memory = SQLiteMemory(args.db)
+        close = memory.close
+    try:
+        if args.command == "import":
+            source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+            try:
+                importer = import_jsonl(memory, source, args.batch_size, args.summarize)
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+            if args.summarize:
+                while not memory.summarizer.flush():
+                    pass
+            print(json.dumps(importer.report(), indent=2), file=sys.stderr)
+        else:
+            target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+            started, count = time.perf_counter(), 0
+            try:
+                for line in export_jsonl(memory, args.users):
+                    target.write(line)
+                    count += 1
+            finally:
+                if target is not sys.stdout:
+                    target.close()
+            seconds = time.perf_counter() - started
+            print(f"Exported {count} rows in {seconds:.2f}s ({count / seconds if seconds else 0:.0f} rows/s)",
+                  file=sys.stderr)
+    finally:
+        close()
+
+
+if __name__ == "__main__":
+    main()
@@ -53,52 +53,158 @@
 
 
 
-import discord
-import requests
 import os
 import json
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import aiohttp
+import discord
 
 # Load configuration from config.json
 config_path = "config.json"
 if os.path.exists(config_path):
     with open(config_path, "r") as f:
         config = json.load(f)
-    DISCORD_TOKEN = config.get("DISCORD_TOKEN", "")
 else:
-    DISCORD_TOKEN = ""
+    config = {}
+DISCORD_TOKEN = config.get("DISCORD_TOKEN", "")
 
 # URL for the FastAPI endpoint
-FASTAPI_URL = "http://127.0.0.1:8000/interact"
+FASTAPI_URL = os.environ.get("FASTAPI_URL", config.get("FASTAPI_URL", "http://127.0.0.1:8000/interact"))
+# Backend requests in flight at once, across all users and channels
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", config.get("MAX_CONCURRENT_REQUESTS", 16)))
+# Seconds to wait for one /interact call before telling the user it timed out
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", config.get("REQUEST_TIMEOUT_SECONDS", 90)))
+# Messages a single user may have waiting; more are rejected until the backlog drains
+MAX_QUEUED_PER_USER = int(os.environ.get("MAX_QUEUED_PER_USER", config.get("MAX_QUEUED_PER_USER", 5)))
+# Debounce: messages a user sends within DEBOUNCE_SECONDS of each other (in the same channel) are
+# merged into one turn, waiting at most DEBOUNCE_MAX_SECONDS and merging at most DEBOUNCE_MAX_MESSAGES.
+# DEBOUNCE_SECONDS=0 only merges messages that queued up while an earlier turn was running.
+DEBOUNCE_SECONDS = float(os.environ.get("DEBOUNCE_SECONDS", config.get("DEBOUNCE_SECONDS", 1.5)))
+DEBOUNCE_MAX_SECONDS = float(os.environ.get("DEBOUNCE_MAX_SECONDS", config.get("DEBOUNCE_MAX_SECONDS", 6)))
+DEBOUNCE_MAX_MESSAGES = int(os.environ.get("DEBOUNCE_MAX_MESSAGES", config.get("DEBOUNCE_MAX_MESSAGES", 10)))
+
+
+class SocratesBot(discord.Client):
+    """
+    Discord client that forwards messages to the FastAPI agent without blocking the gateway.
+    on_message only enqueues: each user gets a queue drained by its own task (so a user's messages
+    are answered in order), all tasks share one keep-alive aiohttp session, and a semaphore caps
+    the number of /interact calls in flight. Different users are served concurrently.
+    Rapid-fire messages from one user are debounced into a single turn (see DEBOUNCE_SECONDS),
+    so a thought typed as several short messages costs one agent turn instead of several.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = None
+        self.backend_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self.user_queues: Dict[str, asyncio.Queue] = {}
+        self.user_tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {"messages": 0, "turns": 0}
+
+    async def setup_hook(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS),
+        )
+
+    async def close(self):
+        for task in self.user_tasks.values():
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+        await super().close()
+
+    async def on_ready(self):
+        print(f"{self.user} is now connected to Discord!")
+
+    async def on_message(self, message: discord.Message):
+        # Ignore messages from the bot itself
+        if message.author == self.user:
+            return
+        user_id = str(message.author.id)
+        queue = self.user_queues.get(user_id)
+        if queue is None:
+            queue = self.user_queues[user_id] = asyncio.Queue(maxsize=MAX_QUEUED_PER_USER)
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            await message.channel.send("Socrates is still thinking about your earlier messages. Please wait a moment.")
+            return
+        if user_id not in self.user_tasks:
+            self.user_tasks[user_id] = asyncio.create_task(self._drain(user_id, queue))
+
+    async def _drain(self, user_id: str, queue: asyncio.Queue):
+        """Answer one user's queued messages in order; the task ends when the queue is empty."""
+        carry = None
+        try:
+            while carry is not None or not queue.empty():
+                batch = [carry if carry is not None else queue.get_nowait()]
+                carry = await self._collect(queue, batch)
+                await self._answer(user_id, batch)
+        finally:
+            # No await between the last empty() check and here, so no message can slip in unseen
+            del self.user_tasks[user_id]
+            if queue.empty():
+                self.user_queues.pop(user_id, None)
+
+    async def _collect(self, queue: asyncio.Queue, batch: List[discord.Message]) -> Optional[discord.Message]:
+        """
+        Extend batch with the user's follow-up messages until they pause for DEBOUNCE_SECONDS.
+        Returns a message from another channel that ended the batch (to start the next one), or None.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DEBOUNCE_MAX_SECONDS
+        while len(batch) < DEBOUNCE_MAX_MESSAGES:
+            if not queue.empty():
+                message = queue.get_nowait()
+            else:
+                wait = min(DEBOUNCE_SECONDS, deadline - loop.time())
+                if wait <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(queue.get(), wait)
+                except asyncio.TimeoutError:
+                    break
+            if message.channel.id != batch[0].channel.id:
+                return message
+            batch.append(message)
+        return None
+
+    async def _answer(self, user_id: str, batch: List[discord.Message]):
+        message = batch[-1]
+        self.stats["messages"] += len(batch)
+        self.stats["turns"] += 1
+        payload = {
+            "user_id": user_id,
+            "user_input": "\n".join(m.content.strip() for m in batch if m.content.strip()),
+            "memory": "none",  # the bot only posts the reply, so skip the memory in the response
+        }
+        try:
+            async with self.backend_slots, message.channel.typing():
+                async with self.session.post(FASTAPI_URL, json=payload) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        reply = f"Socrates: {data['response']}"
+                    else:
+                        reply = "Socrates encountered an error. Please try again."
+        except asyncio.TimeoutError:
+            reply = "Socrates is taking too long to answer. Please try again."
+        except Exception as e:
+            reply = f"Error contacting Socrates API: {str(e)}"
+        try:
+            await message.channel.send(reply)
+        except Exception as e:
+            # e.g. missing permissions or a deleted channel; keep draining the user's queue
+            logging.error(f"Error sending reply to {user_id}: {e}")
+
 
 intents = discord.Intents.default()
 intents.messages = True
-client = discord.Client(intents=intents)
-
-@client.event
-async def on_ready():
-    print(f"{client.user} is now connected to Discord!")
-
-@client.event
-async def on_message(message):
-    # Ignore messages from the bot itself
-    if message.author == client.user:
-        return
-
-    user_id = str(message.author.id)
-    user_input = message.content.strip()
-
-    payload = {
-        "user_id": user_id,
-        "user_input": user_input
-    }
-    try:
-        response = requests.post(FASTAPI_URL, json=payload)
-        if response.status_code == 200:
-            data = response.json()
-            await message.channel.send(f"Socrates: {data['response']}")
-        else:
-            await message.channel.send("Socrates encountered an error. Please try again.")
-    except Exception as e:
-        await message.channel.send(f"Error contacting Socrates API: {str(e)}")
-
-client.run(DISCORD_TOKEN)
\ No newline at end of file
+client = SocratesBot(intents=intents)
+
+if __name__ == "__main__":
+    client.run(DISCORD_TOKEN)
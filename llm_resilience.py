@@ -0,0 +1,365 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Dict
+
+import openai
+
+import metrics
+
+# Defaults for the resilience layer around call_llm
+DEFAULT_TIMEOUT_SECONDS = 60.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_BASE_SECONDS = 0.5
+DEFAULT_BACKOFF_MAX_SECONDS = 8.0
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 5
+DEFAULT_BREAKER_RESET_SECONDS = 30.0
+LATENCY_WINDOW = 200
+CANNED_REPLY = (
+    "I'm having trouble gathering my thoughts right now. "
+    "Please give me a moment and try again shortly."
+)
+
+# Errors worth retrying: transport problems, timeouts, rate limits and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.ConflictError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker. After failure_threshold consecutive failures it opens and
+    rejects calls for reset_seconds; then it lets a single probe call through (half-open) and
+    closes again if the probe succeeds. A probe that ends without an outcome (cancelled) frees
+    the half-open slot for the next caller via release_probe().
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = DEFAULT_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return self.acquire() is not None
+
+    def acquire(self):
+        """None if the call is rejected, "probe" for the single half-open trial call, else "call"."""
+        with self._lock:
+            if self.state == "closed":
+                return "call"
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return "probe"
+            return None
+
+    def release_probe(self):
+        """Free the half-open slot if the probe ended without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure tripped the breaker open."""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class ResilientCaller:
+    """
+    Wraps one model's chat-completion calls with:
+      - a per-attempt timeout,
+      - exponential-backoff retries (with jitter) on retryable errors,
+      - optional hedging: if an attempt is still running after the recent latency percentile,
+        a second identical request is sent and whichever finishes first wins,
+      - a circuit breaker that fails fast (CircuitOpenError) while the upstream is unhealthy.
+    Every path updates the counters in self.metrics. Stream opens (time to first byte) keep their
+    own latency window, so they don't pull down the percentile used to hedge whole calls.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT_SECONDS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE_SECONDS, backoff_max: float = DEFAULT_BACKOFF_MAX_SECONDS,
+                 hedge: bool = False, hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES, breaker: CircuitBreaker = None):
+        """
+        :param timeout: Seconds allowed per attempt.
+        :param max_retries: Retries after the first attempt (retryable errors only).
+        :param backoff_base: First retry delay; doubles per retry up to backoff_max.
+        :param hedge: Send a hedged second request for slow attempts.
+        :param hedge_percentile: Latency percentile after which to hedge.
+        :param hedge_min_samples: Latency samples needed before hedging starts.
+        :param breaker: CircuitBreaker to use (a default one if omitted).
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stream_latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.metrics = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0,
+            "hedges_sent": 0, "hedges_won": 0, "circuit_rejections": 0, "circuit_trips": 0,
+        }
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.metrics[name] += n
+
+    def _window(self, stream: bool) -> deque:
+        return self._stream_latencies if stream else self._latencies
+
+    def _hedge_delay(self, stream: bool = False):
+        """Seconds to wait before hedging, or None if hedging is off or there is too little data."""
+        if not self.hedge:
+            return None
+        with self._lock:
+            latencies = self._window(stream)
+            if len(latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def _on_success(self, started: float, stream: bool = False):
+        with self._lock:
+            self._window(stream).append(time.monotonic() - started)
+            self.metrics["successes"] += 1
+        self.breaker.record_success()
+
+    def record_failure(self, error: BaseException):
+        """Count a failure that happened outside call()/acall() (e.g. a stream dying mid-way)."""
+        self._count("failures")
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError, openai.APITimeoutError)):
+            self._count("timeouts")
+        # A 4xx (bad request, auth) means the upstream answered, so it counts as alive. Other
+        # non-retryable errors (a bug in our own code) say nothing about upstream health.
+        if isinstance(error, openai.APIStatusError) and error.status_code < 500:
+            self.breaker.record_success()
+        elif not is_retryable(error):
+            return
+        elif self.breaker.record_failure():
+            self._count("circuit_trips")
+            logging.error("LLM circuit breaker opened after repeated failures.")
+
+    def _admit(self) -> bool:
+        """Raise CircuitOpenError if the breaker rejects the call; True if it is the half-open probe."""
+        self._count("calls")
+        admitted = self.breaker.acquire()
+        if admitted is None:
+            self._count("circuit_rejections")
+            raise CircuitOpenError("LLM circuit breaker is open")
+        return admitted == "probe"
+
+    # --- synchronous path -------------------------------------------------------------------
+
+    def call(self, fn: Callable[[float], Any]) -> Any:
+        """
+        Run fn(timeout) with retries, hedging and the breaker. fn performs one request and
+        must honour the timeout it is given (e.g. by passing it to the OpenAI client).
+        """
+        probe = self._admit()
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    result = self._attempt(fn)
+                    self._on_success(started)
+                    return result
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        self.record_failure(e)
+                        raise
+                    self._count("retries")
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+        finally:
+            # Interrupted probes (KeyboardInterrupt, cancellation) must not hold the half-open slot
+            if probe:
+                self.breaker.release_probe()
+
+    def _attempt(self, fn: Callable[[float], Any]) -> Any:
+        delay = self._hedge_delay()
+        if delay is None:
+            return fn(self.timeout)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+        primary = self._executor.submit(fn, self.timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        self._count("hedges_sent")
+        hedged = self._executor.submit(fn, self.timeout)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count("hedges_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # --- asynchronous path ------------------------------------------------------------------
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], stream: bool = False) -> Any:
+        """
+        Async variant of call(); fn(timeout) returns an awaitable for one request.
+        Pass stream=True when fn only opens a stream, so its latency goes to the stream-open window.
+        """
+        probe = self._admit()
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    result = await self._aattempt(fn, stream)
+                    self._on_success(started, stream)
+                    return result
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        self.record_failure(e)
+                        raise
+                    self._count("retries")
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+        finally:
+            # A cancelled probe (CancelledError is a BaseException) must not hold the half-open slot
+            if probe:
+                self.breaker.release_probe()
+
+    async def _aattempt(self, fn: Callable[[float], Awaitable[Any]], stream: bool = False) -> Any:
+        async def one():
+            return await asyncio.wait_for(fn(self.timeout), self.timeout)
+
+        delay = self._hedge_delay(stream)
+        if delay is None:
+            return await one()
+        primary = asyncio.create_task(one())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self._count("hedges_sent")
+        hedged = asyncio.create_task(one())
+        pending = {primary, hedged}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self._count("hedges_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            stream_ordered = sorted(self._stream_latencies)
+            stats = dict(self.metrics)
+        stats["circuit_state"] = self.breaker.state
+        if ordered:
+            stats["latency_p50"] = ordered[len(ordered) // 2]
+            stats["latency_p95"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        if stream_ordered:
+            stats["stream_open_p50"] = stream_ordered[len(stream_ordered) // 2]
+            stats["stream_open_p95"] = stream_ordered[min(len(stream_ordered) - 1, int(len(stream_ordered) * 0.95))]
+        return stats
+
+
+_callers: Dict[str, ResilientCaller] = {}
+_callers_lock = threading.Lock()
+# Settings applied to callers created by get_resilient_caller (see configure())
+_settings: Dict[str, Any] = {}
+
+
+def configure(**settings):
+    """Set ResilientCaller options (timeout, max_retries, hedge, ...) for callers created afterwards."""
+    _settings.update(settings)
+
+
+def get_resilient_caller(model: str) -> ResilientCaller:
+    """One ResilientCaller (and breaker) per model, so a struggling model doesn't trip the others."""
+    with _callers_lock:
+        caller = _callers.get(model)
+        if caller is None:
+            caller = _callers[model] = ResilientCaller(**_settings)
+        return caller
+
+
+def resilience_stats() -> Dict[str, Dict[str, Any]]:
+    with _callers_lock:
+        callers = dict(_callers)
+    return {model: caller.stats() for model, caller in callers.items()}
+
+
+def _resilience_counters():
+    with _callers_lock:
+        callers = dict(_callers)
+    counters = []
+    for model, caller in callers.items():
+        with caller._lock:
+            counts = dict(caller.metrics)
+        for event in metrics.LLM_RESILIENCE_EVENTS:
+            counters.append((metrics.LLM_RESILIENCE, {"model": model, "event": event}, counts[event]))
+    return counters
+
+
+metrics.registry.register_collector(_resilience_counters)
@@ -0,0 +1,226 @@
+"""
+End-to-end load test for main.py's /interact (or /interact/stream).
+
+Many synthetic users talk to the API at once; each user sends its turns one after another, like a
+real chat. Reports throughput, p50/p95/p99 latency, and the DB / LLM time per turn taken from the
+"timings" field /interact returns (or the final "done" event of /interact/stream). With --mock-url
+the mock server's own counters are included.
+
+--spawn starts mock_openai_server.py and main.py in a scratch directory first (fresh memory.db),
+so a full offline run is one command:
+    python load_test.py --spawn --users 50 --turns 4 --latency-ms 300
+
+Against servers you started yourself:
+    python mock_openai_server.py --port 8100
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app --port 8000
+    python load_test.py --url http://127.0.0.1:8000 --mock-url http://127.0.0.1:8100
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import shutil
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+import aiohttp
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+UTTERANCES = [
+    "I keep disagreeing with my manager about priorities.",
+    "I'm not sure what the real problem is on my team.",
+    "How do I get two colleagues to agree on a plan?",
+    "I want to take responsibility for the missed deadline.",
+    "What does good leadership look like in a crisis?",
+    "Can you help me understand why this project stalled?",
+    "We need to find common ground between sales and engineering.",
+    "I committed to fixing the onboarding process, where do I start?",
+    "How can I motivate the team without micromanaging?",
+    "Why do I feel stuck every time we plan the quarter?",
+]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class LoadTestResult:
+    def __init__(self):
+        self.latencies = []
+        self.db_seconds = []
+        self.llm_seconds = []
+        self.errors = 0
+        self.wall_seconds = 0.0
+
+    def record(self, seconds: float, timings: Dict[str, float]):
+        self.latencies.append(seconds)
+        self.db_seconds.append(timings.get("db", 0.0))
+        self.llm_seconds.append(timings.get("llm", 0.0))
+
+    def report(self) -> Dict[str, Any]:
+        ok = len(self.latencies)
+        ms = lambda values, pct: round(_percentile(values, pct) * 1000, 1)
+        return {
+            "requests": ok + self.errors,
+            "errors": self.errors,
+            "wall_seconds": round(self.wall_seconds, 2),
+            "throughput_rps": round(ok / self.wall_seconds, 2) if self.wall_seconds else 0.0,
+            "latency_ms": {"p50": ms(self.latencies, 50), "p95": ms(self.latencies, 95),
+                           "p99": ms(self.latencies, 99), "max": ms(self.latencies, 100)},
+            "db_ms": {"mean": round(sum(self.db_seconds) / ok * 1000, 1) if ok else 0.0,
+                      "p95": ms(self.db_seconds, 95)},
+            "llm_ms": {"mean": round(sum(self.llm_seconds) / ok * 1000, 1) if ok else 0.0,
+                       "p95": ms(self.llm_seconds, 95)},
+        }
+
+
+async def _turn(session: aiohttp.ClientSession, url: str, user_id: str, text: str, stream: bool) -> Dict:
+    payload = {"user_id": user_id, "user_input": text, "use_cache": False}
+    if not stream:
+        async with session.post(f"{url}/interact", json=payload) as response:
+            response.raise_for_status()
+            return (await response.json()).get("timings") or {}
+    async with session.post(f"{url}/interact/stream", json=payload) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if line.startswith(b"data: "):
+                event = json.loads(line[6:])
+                if event["type"] == "error":
+                    raise RuntimeError(event["detail"])
+                if event["type"] == "done":
+                    return event.get("timings") or {}
+    raise RuntimeError("stream ended without a done event")
+
+
+async def _user(session, url: str, user_id: str, turns: int, stream: bool, think_time: float,
+                result: LoadTestResult, rng: random.Random):
+    for _ in range(turns):
+        started = time.perf_counter()
+        try:
+            timings = await _turn(session, url, user_id, rng.choice(UTTERANCES), stream)
+            result.record(time.perf_counter() - started, timings)
+        except Exception as e:
+            result.errors += 1
+            print(f"[load_test] {user_id}: {e}", file=sys.stderr)
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+
+async def run_load(url: str, users: int, turns: int, concurrency: int, stream: bool = False,
+                   think_time: float = 0.0, ramp_seconds: float = 0.0, seed: int = 0) -> LoadTestResult:
+    """Drive `users` synthetic users (at most `concurrency` active at once) through `turns` turns each."""
+    result = LoadTestResult()
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    gate = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def one(i: int):
+            if ramp_seconds:
+                await asyncio.sleep(ramp_seconds * i / users)
+            async with gate:
+                await _user(session, url, f"load-{run_id}-{i}", turns, stream, think_time, result,
+                            random.Random(rng.random()))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(users)))
+        result.wall_seconds = time.perf_counter() - started
+    return result
+
+
+async def _get_json(url: str, method: str = "GET") -> Any:
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, url) as response:
+            return await response.json()
+
+
+async def _wait_until_up(url: str, seconds: float = 30.0):
+    deadline = time.monotonic() + seconds
+    while True:
+        try:
+            await _get_json(url)
+            return
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up")
+            await asyncio.sleep(0.2)
+
+
+def spawn_servers(args, workdir: str) -> List[subprocess.Popen]:
+    """Start the mock OpenAI server and main.py (in a scratch directory, so memory.db starts empty)."""
+    env = dict(os.environ, OPENAI_API_KEY="mock", OPENAI_BASE_URL=f"{args.mock_url}/v1")
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "mock_openai_server.py"), "--port", str(args.mock_port),
+         "--latency-ms", str(args.latency_ms), "--dist", args.dist, "--seed", str(args.seed)],
+        cwd=workdir, env=env,
+    )
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR, "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    print(f"[load_test] spawned mock server and API in {workdir}")
+    return [mock, api]
+
+
+async def _main(args):
+    workdir = tempfile.mkdtemp(prefix="load_test_") if args.spawn else None
+    processes = spawn_servers(args, workdir) if args.spawn else []
+    try:
+        if args.spawn:
+            await _wait_until_up(f"{args.mock_url}/stats")
+            await _wait_until_up(f"{args.url}/")
+        if args.mock_url:
+            await _get_json(f"{args.mock_url}/stats/reset", method="POST")
+        result = await run_load(args.url, args.users, args.turns, args.concurrency or args.users,
+                                args.stream, args.think_time, args.ramp, args.seed)
+        report = result.report()
+        if args.mock_url:
+            report["mock_llm"] = await _get_json(f"{args.mock_url}/stats")
+        print(json.dumps(report, indent=2))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /interact with concurrent synthetic users.")
+    parser.add_argument("--url", help="API base URL (default http://127.0.0.1:PORT)")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3, help="Turns per user (sent sequentially)")
+    parser.add_argument("--concurrency", type=int, default=0, help="Max users active at once (default: all)")
+    parser.add_argument("--stream", action="store_true", help="Use /interact/stream")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause between a user's turns")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which users start")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mock-url", help="Mock OpenAI server base URL, to include its stats")
+    parser.add_argument("--spawn", action="store_true", help="Start the mock server and the API locally")
+    parser.add_argument("--port", type=int, default=8000, help="API port with --spawn")
+    parser.add_argument("--mock-port", type=int, default=8100, help="Mock server port with --spawn")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Mock median latency with --spawn")
+    parser.add_argument("--dist", default="lognormal", help="Mock latency distribution with --spawn")
+    args = parser.parse_args(argv)
+
+    args.url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+    if args.spawn and not args.mock_url:
+        args.mock_url = f"http://127.0.0.1:{args.mock_port}"
+    if args.mock_url:
+        args.mock_url = args.mock_url.rstrip("/")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Long-term recall over summarized history.
+
+When the summarizer folds older messages into the rolling summary they are deleted, and the
+summary it replaces is gone too. LongTermMemory keeps an embedding of each of them in the
+memory_vectors table (unit-length float32 vectors stored as raw bytes) and, when a reply is
+built, returns the archived snippets most similar to the user's latest message; ContextBuilder
+adds them to the prompt after the summary.
+
+Search is exact brute force: a user's vectors are read into one contiguous (n, dim) float32
+matrix, scored with a single matrix-vector product (the dot product of unit vectors is their
+cosine similarity) and the top k picked with argpartition. Matrices stay in a small in-process
+LRU and are topped up with rows added since they were loaded (by vector_id, never reused), so
+vectors written by other worker processes are picked up without a full reload; new rows go into
+spare capacity at the end of the matrix rather than into a fresh copy of it. See bench_recall.py for numbers
+at 1M vectors.
+
+Embedders are pluggable: any object with `name`, `dim` and embed(texts) -> (n, dim) float32
+array of unit vectors. HashingEmbedder is deterministic and offline (tests, replays);
+OpenAIEmbedder calls the embeddings API. Vectors are stored with the embedder's name, so
+switching embedders never mixes vector spaces.
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional: long-term recall is disabled without it
+    np = None
+
+from stage_classifier import STOPWORDS, tokenize
+from llm_resilience import get_resilient_caller
+
+DEFAULT_RECALL_TOP_K = 3
+DEFAULT_RECALL_MIN_SCORE = 0.2
+DEFAULT_HASHING_DIM = 256
+DEFAULT_EMBED_BATCH_SIZE = 128
+DEFAULT_MATRIX_CACHE_BYTES = 256 * 1024 * 1024
+MAX_EMBED_CHARS = 8000  # well below the embeddings API input limit
+
+SQL_INSERT_VECTOR = """
+    INSERT INTO memory_vectors (user_id, embedder, kind, role, seq, text, timestamp, vector)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Separate subqueries so each is a single index seek (ids are never reused: AUTOINCREMENT)
+SQL_VECTOR_ID_RANGE = """
+    SELECT (SELECT MIN(vector_id) FROM memory_vectors WHERE user_id = ?1 AND embedder = ?2),
+           (SELECT MAX(vector_id) FROM memory_vectors WHERE user_id = ?1 AND embedder = ?2)
+"""
+SQL_SELECT_VECTORS_AFTER = """
+    SELECT vector_id, vector
+    FROM memory_vectors
+    WHERE user_id = ? AND embedder = ? AND vector_id > ?
+    ORDER BY vector_id
+"""
+SQL_SELECT_VECTOR_TEXT = "SELECT kind, role, seq, text, timestamp FROM memory_vectors WHERE vector_id = ?"
+SQL_CLEAR_VECTORS = "DELETE FROM memory_vectors"
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("long-term recall needs numpy (pip install numpy)")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def top_k(matrix, query, k: int):
+    """Indices and scores of the k rows of `matrix` with the highest dot product with `query`, best first."""
+    scores = matrix @ query
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    if k < len(scores):
+        candidates = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    else:
+        candidates = np.arange(len(scores))
+    best = candidates[np.argsort(-scores[candidates])]
+    return best, scores[best]
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder (signed feature hashing of words and bigrams, stopwords
+    dropped). No model and no network, so it suits tests and offline runs; it matches on shared
+    vocabulary rather than meaning.
+    """
+
+    def __init__(self, dim: int = DEFAULT_HASHING_DIM):
+        """
+        :param dim: Vector size.
+        """
+        _require_numpy()
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        return [token for token in tokenize(text)
+                if not all(word in STOPWORDS for word in token.split(" "))]
+
+    def embed(self, texts: Sequence[str]):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dim] += 1.0 if h >> 63 else -1.0
+        return _normalize(vectors)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, called through the same retry / circuit-breaker policy as chat calls."""
+
+    def __init__(self, client=None, model: str = "text-embedding-3-small", dim: int = 1536):
+        """
+        :param client: OpenAI client (created from the environment if omitted).
+        :param model: Embedding model.
+        :param dim: Requested vector size (text-embedding-3 models can shorten their vectors).
+        """
+        _require_numpy()
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(max_retries=0)
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}-{dim}"
+
+    def embed(self, texts: Sequence[str]):
+        response = get_resilient_caller(self.model).call(
+            lambda timeout: self.client.embeddings.create(
+                model=self.model, input=list(texts), dimensions=self.dim, timeout=timeout
+            )
+        )
+        return _normalize(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+
+class _UserMatrix:
+    """
+    One user's vector ids and vectors, in buffers with spare capacity so rows archived later are
+    appended in place (amortized growth) instead of copying the whole matrix each time.
+    """
+
+    __slots__ = ("ids", "vectors", "size")
+
+    def __init__(self, ids, vectors):
+        self.ids = ids
+        self.vectors = vectors
+        self.size = len(ids)
+
+    @property
+    def first_id(self) -> int:
+        return int(self.ids[0])
+
+    @property
+    def last_id(self) -> int:
+        return int(self.ids[self.size - 1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes
+
+    def view(self):
+        return self.ids[:self.size], self.vectors[:self.size]
+
+    def append(self, ids, vectors):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, len(self.ids) * 3 // 2 + 16)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_ids[:self.size] = self.ids[:self.size]
+            grown = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.ids, self.vectors = grown_ids, grown
+        # Rows past `size` are not part of any view handed out, so readers are unaffected.
+        self.ids[self.size:needed] = ids
+        self.vectors[self.size:needed] = vectors
+        self.size = needed
+
+
+class RecallHit:
+    """One archived message or summary returned by LongTermMemory.recall."""
+
+    __slots__ = ("score", "kind", "role", "seq", "text", "timestamp")
+
+    def __init__(self, score: float, kind: str, role: Optional[str], seq: int, text: str, timestamp: int):
+        self.score = score
+        self.kind = kind
+        self.role = role
+        self.seq = seq
+        self.text = text
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        return f"RecallHit({self.score:.3f}, {self.kind!r}, {self.text!r})"
+
+    def render(self) -> str:
+        date = time.strftime("%Y-%m-%d", time.gmtime(self.timestamp))
+        label = "SUMMARY" if self.kind == "summary" else (self.role or "").upper()
+        return f"[{date}] {label}: {self.text}"
+
+
+class LongTermMemory:
+    """
+    Embeddings of archived messages and summaries in SQLite, with top-k similarity recall per user.
+    archive_jobs() is meant to be SQLiteMemory.archive_fn, so archiving happens on the
+    summarization worker thread, after the summarized messages were deleted.
+    """
+
+    def __init__(self, pool, embedder, top_k: int = DEFAULT_RECALL_TOP_K,
+                 min_score: float = DEFAULT_RECALL_MIN_SCORE, cache_max_bytes: int = DEFAULT_MATRIX_CACHE_BYTES,
+                 embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE):
+        """
+        :param pool: SQLiteMemory's connection pool (its SCHEMA creates the memory_vectors table).
+        :param embedder: HashingEmbedder, OpenAIEmbedder or anything with name, dim and embed(texts).
+        :param top_k: Archived snippets returned per recall.
+        :param min_score: Minimum cosine similarity for a snippet to be returned.
+        :param cache_max_bytes: Memory budget for cached per-user matrices (0 disables the cache).
+        :param embed_batch_size: Texts per embed() call when archiving.
+        """
+        _require_numpy()
+        self.pool = pool
+        self.embedder = embedder
+        self.top_k = top_k
+        self.min_score = min_score
+        self.cache_max_bytes = cache_max_bytes
+        self.embed_batch_size = max(1, embed_batch_size)
+        self._matrices = OrderedDict()  # user_id -> _UserMatrix, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"archived": 0, "recalls": 0, "hits": 0, "full_loads": 0, "incremental_loads": 0,
+                      "archive_errors": 0}
+
+    # --- writing ----------------------------------------------------------------------------
+
+    def add_vectors(self, user_id: str, items: Sequence[tuple], vectors):
+        """
+        Store already-embedded items, (kind, role, seq, text, timestamp) each, with their row of
+        `vectors` ((n, dim) float32, unit length) in one transaction.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        name = self.embedder.name
+        with self.pool.transaction() as conn:
+            conn.executemany(SQL_INSERT_VECTOR, (
+                (user_id, name, kind, role, seq, text, timestamp, vector.tobytes())
+                for (kind, role, seq, text, timestamp), vector in zip(items, vectors)
+            ))
+        self.stats["archived"] += len(items)
+
+    def archive(self, user_id: str, items: Sequence[tuple]):
+        """Embed and store items, (kind, role, seq, text, timestamp) each."""
+        items = [item for item in items if item[3].strip()]
+        for start in range(0, len(items), self.embed_batch_size):
+            batch = items[start:start + self.embed_batch_size]
+            self.add_vectors(user_id, batch, self.embedder.embed([item[3][:MAX_EMBED_CHARS] for item in batch]))
+
+    def archive_jobs(self, jobs):
+        """Archive what applied SummarizationJobs removed: the replaced summary and the folded messages."""
+        now = int(time.time())
+        for job in jobs:
+            items = [("message", m.role, m.seq, m.text, m.timestamp) for m in job.messages]
+            if job.existing_summary:
+                items.insert(0, ("summary", None, job.existing_summary_seq, job.existing_summary, now))
+            try:
+                self.archive(job.user_id, items)
+            except Exception as e:
+                self.stats["archive_errors"] += 1
+                logging.error(f"Error archiving long-term memory for {job.user_id}: {e}")
+
+    def clear(self):
+        """Forget every archived vector."""
+        with self.pool.connection() as conn:
+            conn.execute(SQL_CLEAR_VECTORS)
+        self.clear_local()
+
+    def clear_local(self):
+        """Drop the cached matrices only (SQLiteMemory.reset() empties the table)."""
+        with self._lock:
+            self._matrices.clear()
+            self._bytes = 0
+
+    # --- reading ----------------------------------------------------------------------------
+
+    def _load_rows(self, conn, user_id: str, after: int):
+        rows = conn.execute(SQL_SELECT_VECTORS_AFTER, (user_id, self.embedder.name, after)).fetchall()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32)
+        return ids, matrix.reshape(len(rows), self.embedder.dim)
+
+    def _cache(self, user_id: str, entry: Optional[_UserMatrix]):
+        """Store (or with None, drop) a user's matrix; caller holds self._lock."""
+        old = self._matrices.pop(user_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        if entry is None or not self.cache_max_bytes:
+            return
+        self._matrices[user_id] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.cache_max_bytes and self._matrices:
+            _, evicted = self._matrices.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _matrix(self, conn, user_id: str):
+        """(vector ids, matrix) of the user's archived vectors, or None if there are none."""
+        first_id, last_id = conn.execute(SQL_VECTOR_ID_RANGE, (user_id, self.embedder.name)).fetchone()
+        with self._lock:
+            entry = self._matrices.get(user_id)
+            if entry is not None:
+                self._matrices.move_to_end(user_id)
+            if first_id is None:
+                self._cache(user_id, None)
+                return None
+            if entry is not None and entry.first_id == first_id and entry.last_id == last_id:
+                return entry.view()
+        if entry is not None and entry.first_id == first_id and last_id > entry.last_id:
+            # Only appends since the load (archived rows are never deleted one by one): top it up.
+            after = entry.last_id
+            ids, vectors = self._load_rows(conn, user_id, after)
+            with self._lock:
+                if entry.last_id == after:
+                    entry.append(ids, vectors)
+                    self._cache(user_id, entry)
+                    self.stats["incremental_loads"] += 1
+                    return entry.view()
+        self.stats["full_loads"] += 1
+        ids, vectors = self._load_rows(conn, user_id, 0)
+        entry = _UserMatrix(ids, vectors)
+        with self._lock:
+            self._cache(user_id, entry)
+        return entry.view()
+
+    def recall(self, user_id: str, query: str, k: int = None) -> List[RecallHit]:
+        """The archived snippets most similar to `query`, best first (at most k, above min_score)."""
+        self.stats["recalls"] += 1
+        with self.pool.connection() as conn:
+            loaded = self._matrix(conn, user_id)
+        if loaded is None:
+            return []
+        ids, matrix = loaded
+        # Embedding may be a network call, so it runs without holding a pooled connection.
+        query_vector = self.embedder.embed([query[:MAX_EMBED_CHARS]])[0]
+        best, scores = top_k(matrix, query_vector, k or self.top_k)
+        keep = scores >= self.min_score
+        hits = []
+        if keep.any():
+            with self.pool.connection() as conn:
+                for index, score in zip(best[keep], scores[keep]):
+                    row = conn.execute(SQL_SELECT_VECTOR_TEXT, (int(ids[index]),)).fetchone()
+                    if row is not None:
+                        hits.append(RecallHit(float(score), *row))
+        self.stats["hits"] += len(hits)
+        return hits
+
+    def cache_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "cached_users": len(self._matrices), "cached_bytes": self._bytes}
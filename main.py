@@ -97,14 +97,60 @@
 # if __name__ == "__main__":
 #     uvicorn.run(app, host="0.0.0.0", port=8000)
 
-from fastapi import FastAPI, HTTPException
+import os
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Literal
 import uvicorn
 from partnerable_agent_with_memory import PartnerableAgent
+from llm_resilience import resilience_stats
+from long_term_memory import HashingEmbedder, OpenAIEmbedder
+from sqlite_memory_manager import DEFAULT_HISTORY_PAGE_SIZE
+from conversation_io import DEFAULT_IMPORT_BATCH_SIZE, aimport_jsonl, aiter_lines, export_jsonl
+import metrics
 
-app = FastAPI()
+# Deployment settings (environment variables):
+#   MEMORY_DB        SQLite file shared by every worker (default memory.db)
+#   WEB_CONCURRENCY  number of worker processes; uvicorn also uses it as the default for --workers
+#   STATELESS        "1"/"0" to force stateless mode on/off; it is on by default when WEB_CONCURRENCY > 1
+#                    (set STATELESS=1 yourself if you pass --workers on the command line instead)
+#   METRICS_DIR      directory shared by the workers so /metrics reports server-wide totals
+#   RECALL_EMBEDDER  "hashing" or "openai" to enable long-term recall of summarized history (default off)
+# In stateless mode a worker keeps no conversation state in memory: everything is read from and
+# written to MEMORY_DB, and a user's turns are serialized across workers by a lease in the database.
+# Each worker handles many users concurrently (async I/O), so use about one worker per CPU core:
+#   WEB_CONCURRENCY=4 METRICS_DIR=/tmp/partnerable-metrics uvicorn main:app --host 0.0.0.0 --port 8000
+MEMORY_DB = os.environ.get("MEMORY_DB", "memory.db")
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+STATELESS = os.environ.get("STATELESS", "1" if WORKERS > 1 else "0") == "1"
+RECALL_EMBEDDER = os.environ.get("RECALL_EMBEDDER", "")
+
+# Largest page /history/{user_id} returns
+MAX_HISTORY_PAGE_SIZE = 500
+
+# The Socrates agent (with SQLite memory); created per worker process by lifespan()
+agent: Optional[PartnerableAgent] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's resources (connection pool, summarization thread) and close them on shutdown."""
+    global agent
+    embedders = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+    recall_embedder = embedders[RECALL_EMBEDDER]() if RECALL_EMBEDDER else None
+    agent = PartnerableAgent(db_path=MEMORY_DB, verbose=True, speculative=True, stateless=STATELESS,
+                             recall_embedder=recall_embedder)
+    try:
+        yield
+    finally:
+        agent.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for all origins, methods, and headers
 app.add_middleware(
@@ -115,14 +161,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize the Socrates agent with SQLite memory (memory.db in the current directory)
-agent = PartnerableAgent(db_path="memory.db", verbose=True)
+def _conversation_cache_counters():
+    if agent is None:
+        return []
+    stats = agent.sqlite_memory.cache_stats()
+    return [
+        (metrics.CACHE_REQUESTS, {"cache": "conversation", "result": "hit"}, stats["hits"]),
+        (metrics.CACHE_REQUESTS, {"cache": "conversation", "result": "miss"}, stats["misses"]),
+    ]
+
+
+metrics.registry.register_collector(_conversation_cache_counters)
 
 
 class UserMessage(BaseModel):
     user_id: str
     user_input: str
     context: Optional[Dict] = None  # Optional additional context
+    use_cache: bool = True  # Set to False to bypass the response cache for this request
+    # What /interact returns as memory: "full" (the whole rolling memory as text), "delta" (only the
+    # messages after the `since` cursor) or "none". Every response carries the new cursor.
+    memory: Literal["none", "delta", "full"] = "full"
+    since: int = 0
 
 
 @app.get("/")
@@ -148,36 +208,146 @@ def read_root():
 @app.post("/interact")
 async def interact_with_agent(user_message: UserMessage):
     try:
-        agent.human_step(user_message.user_id, user_message.user_input)
-        response_text = agent.generate_response(user_message.user_id)
-        conversation_text = agent.sqlite_memory.retrieve_memory(user_message.user_id)
-        return {
+        # The turn runs under the user's lock: a user's messages are handled one at a time, in order,
+        # while other users' turns proceed concurrently. All per-turn state lives on the returned snapshot.
+        response_text, turn = await agent.arun_turn(
+            user_message.user_id, user_message.user_input, user_message.use_cache
+        )
+        result = {
             "response": response_text,
-            "memory": conversation_text
+            "cursor": turn.cursor,  # pass back as `since` with memory="delta"
+            "timings": turn.timings,  # seconds spent in SQLite ("db") and waiting on the model ("llm")
         }
+        if user_message.memory == "full":
+            result["memory"] = turn.render()
+        elif user_message.memory == "delta":
+            result["messages"] = [message.to_dict() for message in turn.messages_since(user_message.since)]
+            # Messages after the cursor that have since been folded into the summary are only in the summary.
+            result["summary"] = turn.summary if user_message.since < turn.summary_seq else None
+        return result
     except Exception as e:
         print("Exception:", str(e))
+        metrics.registry.inc(metrics.ERRORS, source="api")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/interact/stream")
+async def interact_with_agent_stream(user_message: UserMessage):
+    """
+    Same turn as /interact, but the reply is sent as server-sent events while the model generates it:
+      data: {"type": "token", "text": "..."}   (one per delta)
+      data: {"type": "done", "response": "...", "timings": {...}} (after the reply has been stored)
+    The whole turn runs inside the stream (holding the user's lock until it ends), so failures
+    are reported as an {"type": "error"} event.
+    """
+
+    async def event_stream():
+        parts = []
+        timings = {}
+        try:
+            async for delta in agent.astream_turn(user_message.user_id, user_message.user_input, timings):
+                parts.append(delta)
+                yield f"data: {json.dumps({'type': 'token', 'text': delta})}\n\n"
+            done = {"type": "done", "response": "".join(parts).strip(), "timings": timings}
+            yield f"data: {json.dumps(done)}\n\n"
+        except Exception as e:
+            print("Exception:", str(e))
+            metrics.registry.inc(metrics.ERRORS, source="api")
+            yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/history/{user_id}")
+def conversation_history(user_id: str, before: Optional[int] = None,
+                         limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE)):
+    """
+    A user's stored messages, one page at a time, newest page first (messages within a page are
+    oldest first). Pass the returned next_before as `before` to get the next older page; it is
+    null on the last page. Messages already folded into the summary are not stored any more.
+    """
+    records, next_before = agent.sqlite_memory.history_page(user_id, before, limit)
+    return {"messages": [message.to_dict() for message in records], "next_before": next_before}
+
+
+@app.post("/import")
+async def import_conversations(request: Request, batch_size: int = Query(DEFAULT_IMPORT_BATCH_SIZE, ge=1),
+                               summarize: bool = False):
+    """
+    Bulk-import a JSONL body (formats in conversation_io.py). The body is parsed as it arrives and
+    written in batches of batch_size rows, one transaction each. Summarization is deferred: with
+    summarize=true imported users over the memory limit are queued once at the end, otherwise
+    their next turn triggers it. Returns row counts, skipped lines and rows per second.
+    """
+    importer = await aimport_jsonl(agent.sqlite_memory, aiter_lines(request.stream()), batch_size, summarize)
+    return importer.report()
+
+
+@app.get("/export")
+def export_conversations(user_id: Optional[List[str]] = Query(None)):
+    """Stream every user's (or the given users') latest summary and messages as JSONL."""
+    return StreamingResponse(export_jsonl(agent.sqlite_memory, user_id), media_type="application/x-ndjson")
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    """Hit/miss counters for the in-process conversation cache."""
+    return agent.sqlite_memory.cache_stats()
+
+
+@app.get("/stats/agent")
+def agent_stats():
+    """
+    Stage resolution counters, speculative-generation hit rate / latency saved, response-cache savings,
+    per-user turn queueing and long-term recall counters.
+    """
+    speculation = agent.speculation_stats
+    return {
+        "stage": agent.stage_stats,
+        "response_cache": agent.response_cache.stats() if agent.response_cache else None,
+        "speculation": {
+            **speculation,
+            "hit_ratio": speculation["hits"] / speculation["attempts"] if speculation["attempts"] else 0.0,
+        },
+        "user_locks": agent.user_locks.snapshot(),
+        "long_term_memory": agent.long_term_memory.cache_stats() if agent.long_term_memory else None,
+    }
+
+
+@app.get("/stats/llm")
+def llm_stats():
+    """Per-model retry / timeout / hedging / circuit-breaker counters and recent latency percentiles."""
+    return resilience_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Prometheus text format: per-phase latency histograms (memory read, stage classification,
+    prompt build, LLM call, memory write, response cache, summarization, recall) and counters for tokens,
+    cost, LLM outcomes, cache hits and errors. Set METRICS_DIR to aggregate across workers.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/reset")
 def reset_agent():
     """
-    This endpoint resets the local conversation memory of the agent.
-    (Note: This does not delete the SQLite file. You may need to manually remove it.)
+    This endpoint resets the conversation memory of the agent.
+    The tables are cleared in one transaction instead of deleting the SQLite file, so it is safe
+    while other worker processes have the database open.
     """
     try:
-        # For a simple reset, remove the memory file (or clear the tables)
-        import os
-        if os.path.exists("memory.db"):
-            os.remove("memory.db")
-        # Reinitialize the memory manager in the agent
-        agent.sqlite_memory = agent.sqlite_memory.__class__(db_path="memory.db")
-        agent.stage = "Introduction"
+        agent.reset_memory()
         return {"message": "Agent memory reset."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # With more than one worker uvicorn needs the app as an import string.
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
@@ -0,0 +1,249 @@
+"""
+In-process metrics (counters and latency histograms) rendered in the Prometheus text format.
+
+Recording is a dict update under a lock: histograms keep per-bucket counts (found by bisect) plus
+sum and count, and the cumulative bucket series are only built when /metrics is scraped.
+
+With several worker processes (uvicorn --workers N) each process only sees its own numbers. Set
+METRICS_DIR to a directory shared by the workers: every process then writes its snapshot there
+every few seconds (and whenever it is scraped), and rendering merges all snapshot files, so any
+worker can answer the scrape with totals for the whole server. Counters of workers that exited
+are kept, so totals never go backwards; clear the directory when redeploying.
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# Seconds; chosen to cover SQLite reads (~1 ms) through slow LLM calls (~1 min)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+
+# Phases of a turn recorded in PHASE_SECONDS
+PHASES = ("memory_read", "stage_classification", "prompt_build", "llm_call", "memory_write",
+          "response_cache", "summarization", "recall")
+
+PHASE_SECONDS = "partnerable_phase_seconds"
+LLM_TOKENS = "partnerable_llm_tokens_total"
+LLM_COST = "partnerable_llm_cost_dollars_total"
+LLM_REQUESTS = "partnerable_llm_requests_total"
+CACHE_REQUESTS = "partnerable_cache_requests_total"
+ERRORS = "partnerable_errors_total"
+LLM_RESILIENCE = "partnerable_llm_resilience_events_total"
+
+# ResilientCaller counters exported under LLM_RESILIENCE
+LLM_RESILIENCE_EVENTS = ("retries", "timeouts", "hedges_sent", "hedges_won", "circuit_rejections", "circuit_trips")
+
+HELP = {
+    PHASE_SECONDS: "Time spent per phase of a turn.",
+    LLM_TOKENS: "LLM tokens used, by model and type (prompt, completion, cached).",
+    LLM_COST: "LLM spend in dollars (calculate_cost), by model.",
+    LLM_REQUESTS: "LLM calls by model and outcome (ok, error, degraded).",
+    CACHE_REQUESTS: "Cache lookups by cache and result (hit, miss).",
+    ERRORS: "Errors by source.",
+    LLM_RESILIENCE: "LLM retries, timeouts, hedges and circuit breaker events, by model and event.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms for one process, optionally shared with sibling
+    worker processes through snapshot files in shared_dir.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, shared_dir: str = None,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS):
+        """
+        :param buckets: Histogram upper bounds in seconds (+Inf is implicit).
+        :param shared_dir: Directory for cross-worker snapshot files (None = this process only).
+        :param flush_interval: Seconds between snapshot writes when shared_dir is set.
+        """
+        self.buckets = tuple(buckets)
+        self.shared_dir = shared_dir
+        self.flush_interval = flush_interval
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count], sum
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._flush_lock = threading.Lock()
+        self._snapshot_path = None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._snapshot_path = os.path.join(shared_dir, f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+        self._ensure_flusher()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += seconds
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall time of the with-block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_collector(self, collector: Callable[[], List[Tuple[str, Dict[str, str], float]]]):
+        """
+        Add a callback returning [(counter name, labels, absolute value), ...], read at snapshot
+        time; used for counters that are already kept elsewhere (e.g. the conversation cache).
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict:
+        """This process's metrics as JSON-serializable lists."""
+        with self._lock:
+            counters = [[name, list(map(list, labels)), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(map(list, labels)), list(entry[0]), entry[1]]
+                          for (name, labels), entry in self._histograms.items()]
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    counters.append([name, list(map(list, _labels(labels))), value])
+            except Exception as e:
+                logging.error(f"Error in metrics collector: {e}")
+        return {"buckets": list(self.buckets), "counters": counters, "histograms": histograms}
+
+    # --- cross-worker sharing ---------------------------------------------------------------
+
+    def _ensure_flusher(self):
+        if self._snapshot_path and self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot to shared_dir (atomically, via rename)."""
+        if not self._snapshot_path:
+            return
+        tmp_path = self._snapshot_path + ".tmp"
+        with self._flush_lock:
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(tmp_path, self._snapshot_path)
+            except OSError as e:
+                logging.error(f"Error writing metrics snapshot: {e}")
+
+    def _snapshots(self) -> List[Dict]:
+        if not self.shared_dir:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for file_name in os.listdir(self.shared_dir):
+            if not (file_name.startswith("metrics-") and file_name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, file_name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # being replaced by its writer; picked up on the next scrape
+        return snapshots
+
+    # --- exposition -------------------------------------------------------------------------
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4) of the merged metrics of all workers."""
+        counters, histograms = {}, {}
+        for snap in self._snapshots():
+            if tuple(snap["buckets"]) != self.buckets:
+                continue
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0.0) + value
+            for name, labels, bucket_counts, total in snap["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(bucket_counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], bucket_counts)]
+                merged[1] += total
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (bucket_counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    le_label = f'le="{le}"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, le_label)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the agent, the memory layer and main.py
+registry = MetricsRegistry(shared_dir=os.environ.get("METRICS_DIR") or None)
+
+
+def phase_timer(phase: str):
+    """Context manager timing one phase of a turn into PHASE_SECONDS."""
+    return registry.timer(PHASE_SECONDS, phase=phase)
+
+
+def observe_phase(phase: str, seconds: float):
+    registry.observe(PHASE_SECONDS, seconds, phase=phase)
+
+
+def record_llm_usage(model: str, result: Dict):
+    """Count tokens, cost and the outcome of one call_llm-style result dict."""
+    if result.get("degraded"):
+        registry.inc(LLM_REQUESTS, model=model, outcome="degraded")
+        return
+    if result.get("response_text") is None:
+        registry.inc(LLM_REQUESTS, model=model, outcome="error")
+        registry.inc(ERRORS, source="llm")
+        return
+    registry.inc(LLM_REQUESTS, model=model, outcome="ok")
+    registry.inc(LLM_TOKENS, result.get("prompt_tokens", 0), model=model, type="prompt")
+    registry.inc(LLM_TOKENS, result.get("completion_tokens", 0), model=model, type="completion")
+    registry.inc(LLM_TOKENS, result.get("cached_tokens", 0), model=model, type="cached")
+    registry.inc(LLM_COST, result.get("cost", 0.0), model=model)
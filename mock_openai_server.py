@@ -0,0 +1,239 @@
+"""
+Local stand-in for the OpenAI chat-completions API, for benchmarking without paying for real calls.
+
+Serves POST /v1/chat/completions (plain and streamed, including the final usage chunk when
+stream_options.include_usage is set) with a configurable latency distribution and reply length.
+Stage-analyzer prompts get a stage name back so the agent's stage logic behaves normally.
+Prompt-prefix caching is imitated: a prompt that shares >= 1024 tokens of prefix with a recent
+one reports the shared part (in 128-token steps) as cached_tokens.
+
+GET /stats returns request / error / latency counters (POST /stats/reset clears them).
+
+Usage:
+    python mock_openai_server.py --port 8100 --latency-ms 800 --dist lognormal --sigma 0.4
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from stage_classifier import STAGES, KeywordStageClassifier
+from context_builder import count_tokens
+
+WORDS = (
+    "what do you think matters most here and how might the people involved see it differently "
+    "perhaps we could look at the assumptions underneath this choice together before deciding"
+).split()
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_STEP = 128
+RECENT_PROMPTS = 64
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    # Binary search on slice equality: C-speed comparisons instead of a per-character loop.
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class MockSettings:
+    """Latency / reply-size knobs; every request samples from these."""
+
+    def __init__(self, latency_ms: float = 500.0, dist: str = "lognormal", sigma: float = 0.35,
+                 token_delay_ms: float = 10.0, completion_tokens: int = 60, error_rate: float = 0.0,
+                 seed: int = None):
+        """
+        :param latency_ms: Median time to the full reply (time to first token when streaming).
+        :param dist: "fixed", "uniform" (+/- sigma * latency) or "lognormal" (shape sigma).
+        :param token_delay_ms: Delay between streamed chunks.
+        :param completion_tokens: Mean reply length in tokens (words).
+        :param error_rate: Fraction of requests answered with HTTP 500.
+        """
+        self.latency_ms = latency_ms
+        self.dist = dist
+        self.sigma = sigma
+        self.token_delay_ms = token_delay_ms
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        base = self.latency_ms / 1000
+        if self.dist == "fixed":
+            return base
+        if self.dist == "uniform":
+            return max(0.0, self.random.uniform(base * (1 - self.sigma), base * (1 + self.sigma)))
+        return self.random.lognormvariate(0.0, self.sigma) * base
+
+    def sample_length(self) -> int:
+        return max(1, int(self.random.gauss(self.completion_tokens, self.completion_tokens / 4)))
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.streamed = self.errors = 0
+            self.prompt_tokens = self.completion_tokens = self.cached_tokens = 0
+            self.service_seconds = 0.0
+            self.latencies = deque(maxlen=10000)
+
+    def record(self, seconds: float, prompt_tokens: int, completion_tokens: int, cached_tokens: int):
+        with self._lock:
+            self.service_seconds += seconds
+            self.latencies.append(seconds)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.latencies)
+            served = len(ordered)
+            return {
+                "requests": self.requests,
+                "streamed": self.streamed,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+                "service_seconds": self.service_seconds,
+                "latency_mean": self.service_seconds / served if served else 0.0,
+                "latency_p50": ordered[served // 2] if served else 0.0,
+                "latency_p99": ordered[min(served - 1, int(served * 0.99))] if served else 0.0,
+            }
+
+
+def create_app(settings: MockSettings = None) -> FastAPI:
+    settings = settings or MockSettings()
+    stats = MockStats()
+    recent_prompts = deque(maxlen=RECENT_PROMPTS)
+    classifier = KeywordStageClassifier()
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.stats = stats
+
+    def cached_prefix_tokens(prompt: str) -> int:
+        best = max((_common_prefix_len(prompt, previous) for previous in recent_prompts), default=0)
+        recent_prompts.append(prompt)
+        if best == 0:
+            return 0
+        tokens = count_tokens(prompt[:best])
+        return tokens - tokens % PREFIX_CACHE_STEP if tokens >= PREFIX_CACHE_MIN_TOKENS else 0
+
+    def reply_for(messages) -> str:
+        last = messages[-1]["content"] if messages else ""
+        if "Return only the stage name." in last:
+            stage, _ = classifier.classify([("user", last.split("Conversation History:")[-1])])
+            return stage if stage in STAGES else "Exploration"
+        return " ".join(settings.random.choice(WORDS) for _ in range(settings.sample_length())).capitalize() + "?"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        if settings.error_rate and settings.random.random() < settings.error_rate:
+            stats.errors += 1
+            return JSONResponse({"error": {"message": "mock upstream error", "type": "server_error"}}, 500)
+
+        started = time.perf_counter()
+        model = body.get("model", "gpt-4o")
+        messages = body.get("messages", [])
+        prompt = "".join(m.get("content") or "" for m in messages)
+        prompt_tokens = count_tokens(prompt)
+        cached_tokens = cached_prefix_tokens(prompt)
+        text = reply_for(messages)
+        completion_tokens = count_tokens(text)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        await asyncio.sleep(settings.sample_latency())
+
+        if not body.get("stream"):
+            stats.record(time.perf_counter() - started, prompt_tokens, completion_tokens, cached_tokens)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        stats.streamed += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta, finish_reason=None, with_usage=False):
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(text.split(" ")):
+                yield chunk({"content": word if i == 0 else " " + word})
+                await asyncio.sleep(settings.token_delay_ms / 1000)
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, with_usage=True)
+            yield "data: [DONE]\n\n"
+            stats.record(time.perf_counter() - started, prompt_tokens, completion_tokens, cached_tokens)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def get_stats():
+        return stats.snapshot()
+
+    @app.post("/stats/reset")
+    def reset_stats():
+        stats.reset()
+        return {"message": "Stats reset."}
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Median reply latency")
+    parser.add_argument("--dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.35, help="Spread of the latency distribution")
+    parser.add_argument("--token-delay-ms", type=float, default=10.0, help="Delay between streamed chunks")
+    parser.add_argument("--completion-tokens", type=int, default=60, help="Mean reply length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(args.latency_ms, args.dist, args.sigma, args.token_delay_ms,
+                            args.completion_tokens, args.error_rate, args.seed)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 import os
 import json
+import time
+import asyncio
 import logging
-from typing import Dict, Any, List
-from openai import OpenAI
-from sqlite_memory_manager import SQLiteMemory
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+from openai import OpenAI, AsyncOpenAI
+from sqlite_memory_manager import SQLiteMemory, ConversationSnapshot, StageState
+from stage_classifier import STAGES, KeywordStageClassifier, StageReevaluationPolicy, topic_terms
+from context_builder import ContextBuilder, DEFAULT_CONTEXT_BUDGET, MESSAGE_OVERHEAD_TOKENS, count_tokens
+from response_cache import ResponseCache
+from user_locks import UserLocks, SQLiteTurnLease
+from llm_resilience import CANNED_REPLY, CircuitOpenError, get_resilient_caller
+from long_term_memory import LongTermMemory
+import metrics
 
 # Configure logging (set to WARNING to suppress debug logs)
 logging.basicConfig(level=logging.WARNING)
@@ -15,16 +26,24 @@ if os.path.exists(config_path):
         config = json.load(f)
     openai_api_key = config.get("OPENAI_API_KEY", "")
 else:
-    openai_api_key = ""
+    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
+# Turn phases that touch SQLite; their time is also added to the turn's "db" timing
+DB_PHASES = ("memory_read", "memory_write", "response_cache")
+
+# Initialize OpenAI clients (the async client is used by the async agent methods).
+# Retries are handled by llm_resilience, so the SDK's own retry loop is turned off.
+client = OpenAI(api_key=openai_api_key, max_retries=0)
+async_client = AsyncOpenAI(api_key=openai_api_key, max_retries=0)
 
 
 def calculate_cost(input_tokens: int, output_tokens: int, model: str) -> float:
     if model == "gpt-4o":
         input_cost_per_1k = 0.03
         output_cost_per_1k = 0.06
+    elif model == "gpt-4o-mini":
+        input_cost_per_1k = 0.00015
+        output_cost_per_1k = 0.0006
     elif model == "gpt-3.5-turbo":
         input_cost_per_1k = 0.0015
         output_cost_per_1k = 0.002
@@ -37,30 +56,144 @@ def call_llm(messages: List[Dict[str, str]], model="gpt-4o", client=client) -> D
     """
     Call the OpenAI chat completion API with a list of messages.
     Each message is a dict with "role" and "content".
+    Calls go through the model's ResilientCaller (timeout, retries, hedging, circuit breaker);
+    while the breaker is open a canned reply marked "degraded" is returned without calling the API.
+    Latency, tokens, cost and the outcome are recorded in metrics.
     """
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(model=model, messages=messages)
-        response_text = response.choices[0].message.content.strip()
-        prompt_tokens = response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
-        total_cost = calculate_cost(prompt_tokens, completion_tokens, model)
-        return {
-            "response_text": response_text,
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "total_tokens": total_tokens,
-            "cost": total_cost
-        }
+        response = get_resilient_caller(model).call(
+            lambda timeout: client.chat.completions.create(model=model, messages=messages, timeout=timeout)
+        )
+        result = _completion_result(response, model)
+    except CircuitOpenError:
+        result = _degraded_result()
     except Exception as e:
         logging.error(f"Error during chat completion: {e}")
-        return {
-            "response_text": None,
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-            "cost": 0.0
-        }
+        result = _error_result(e)
+    metrics.observe_phase("llm_call", time.perf_counter() - started)
+    metrics.record_llm_usage(model, result)
+    return result
+
+
+async def acall_llm(messages: List[Dict[str, str]], model="gpt-4o", client=async_client) -> Dict[str, Any]:
+    """
+    Async variant of call_llm built on AsyncOpenAI, so waiting on the model
+    doesn't block the event loop. Returns the same dict shape as call_llm.
+    """
+    started = time.perf_counter()
+    try:
+        response = await get_resilient_caller(model).acall(
+            lambda timeout: client.chat.completions.create(model=model, messages=messages, timeout=timeout)
+        )
+        result = _completion_result(response, model)
+    except CircuitOpenError:
+        result = _degraded_result()
+    except Exception as e:
+        logging.error(f"Error during chat completion: {e}")
+        result = _error_result(e)
+    metrics.observe_phase("llm_call", time.perf_counter() - started)
+    metrics.record_llm_usage(model, result)
+    return result
+
+
+async def astream_llm(messages: List[Dict[str, str]], model="gpt-4o", client=async_client,
+                      usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of acall_llm: yields response text deltas as they arrive.
+    If a `usage` dict is passed it is filled with the same token/cost fields call_llm
+    returns once the stream finishes (the final chunk carries the usage data).
+    Opening the stream is retried like acall_llm; tokens already sent can't be retried, so a
+    failure mid-stream only counts against the circuit breaker. While the breaker is open the
+    canned reply is yielded instead.
+    """
+    usage = usage if usage is not None else {}
+    usage.update(_empty_result())
+    caller = get_resilient_caller(model)
+    opened = failed = False
+    started = time.perf_counter()
+    try:
+        stream = await caller.acall(
+            lambda timeout: client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True},
+                timeout=timeout,
+            ),
+            stream=True,
+        )
+        opened = True
+        async for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+            if chunk.usage is not None:
+                usage.update({
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens,
+                    "cached_tokens": _cached_tokens(chunk.usage),
+                    "cost": calculate_cost(chunk.usage.prompt_tokens, chunk.usage.completion_tokens, model),
+                })
+    except CircuitOpenError:
+        usage.update(_degraded_result())
+        yield CANNED_REPLY
+    except Exception as e:
+        failed = True
+        usage["error"] = str(e) or type(e).__name__
+        if opened:
+            caller.record_failure(e)
+        logging.error(f"Error during streaming chat completion: {e}")
+    finally:
+        metrics.observe_phase("llm_call", time.perf_counter() - started)
+        metrics.record_llm_usage(model, dict(usage, response_text=None if failed else usage["response_text"] or ""))
+
+
+def _completion_result(response, model: str) -> Dict[str, Any]:
+    response_text = response.choices[0].message.content.strip()
+    prompt_tokens = response.usage.prompt_tokens
+    completion_tokens = response.usage.completion_tokens
+    total_tokens = response.usage.total_tokens
+    total_cost = calculate_cost(prompt_tokens, completion_tokens, model)
+    return {
+        "response_text": response_text,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "cached_tokens": _cached_tokens(response.usage),
+        "cost": total_cost
+    }
+
+
+def _cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prefix cache (0 if not reported)."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+def _empty_result() -> Dict[str, Any]:
+    return {
+        "response_text": None,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+        "cost": 0.0
+    }
+
+
+def _error_result(error: BaseException) -> Dict[str, Any]:
+    """Result of a call that failed after retries; "error" lets callers tell it from a reply."""
+    result = _empty_result()
+    result["error"] = str(error) or type(error).__name__
+    return result
+
+
+def _degraded_result() -> Dict[str, Any]:
+    """Fail-fast result used while the circuit breaker is open (never cached)."""
+    result = _empty_result()
+    result["response_text"] = CANNED_REPLY
+    result["degraded"] = True
+    return result
 
 
 class PartnerableAgent:
@@ -68,6 +201,16 @@ class PartnerableAgent:
     An AI agent built on 'Partnerable' principles that uses SQLite for persistent conversation memory.
     It retrieves the rolling memory (latest summary + last n-1 interactions) and uses that as context
     to determine the current conversation stage and generate responses.
+
+    A turn is driven by a ConversationSnapshot (see begin_turn): the memory is read once and every
+    step of the turn reuses it, with new messages appended to the snapshot as they are stored.
+    Steps called without a snapshot load their own, which keeps the old one-call API working.
+
+    Each turn step also has an async twin (abegin_turn, ahuman_step, ...) that awaits the LLM via
+    AsyncOpenAI and runs SQLite work in worker threads, for use from async web handlers.
+    arun_turn / astream_turn run a whole turn under a per-user lock, so one agent can serve many
+    users concurrently: a user's turns run in order and all per-turn state (including the stage)
+    lives on the turn snapshot rather than on the agent.
     """
 
     def __init__(self, db_path="memory.db", verbose: bool = False, **kwargs):
@@ -75,9 +218,67 @@ class PartnerableAgent:
         self.agent_name = kwargs.get("agent_name", "Socrates")
         self.agent_role = kwargs.get("agent_role", "Representative Philosopher")
         self.tools = kwargs.get("tools", {})
-        self.stage = "Introduction"
-        self.sqlite_memory = SQLiteMemory(db_path=db_path)
+        # Local stage classifier; the LLM is only asked when its confidence is below the threshold.
+        # Pass stage_classifier=None to always use the LLM.
+        self.stage_classifier = kwargs.get("stage_classifier", KeywordStageClassifier())
+        self.stage_confidence_threshold = kwargs.get("stage_confidence_threshold", 0.6)
+        # Stages are persisted per user and only recomputed when this policy says they may be stale.
+        self.stage_policy = kwargs.get("stage_policy", StageReevaluationPolicy())
+        self.stage_stats = {"reused": 0, "local": 0, "llm_fallback": 0}
+        # Speculative mode (async path only): when the stage needs an LLM call, generate the reply
+        # with the user's previous stage at the same time and keep it if the stage didn't change.
+        self.speculative = kwargs.get("speculative", False)
+        self.speculation_stats = {"attempts": 0, "hits": 0, "misses": 0, "saved_seconds": 0.0}
+        # Builds the response call's messages within a token budget, sending each history item once.
+        self.context_builder = ContextBuilder(budget=kwargs.get("context_token_budget", DEFAULT_CONTEXT_BUDGET))
+        # Older messages are summarized in the background with this (cheaper) model.
+        self.summary_model = kwargs.get("summary_model", "gpt-4o-mini")
+        # Summarizer calls happen outside any turn, so their usage is totalled here instead.
+        self.summary_usage = {"llm_calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                              "cached_tokens": 0, "cost": 0.0}
+        self._summary_usage_lock = threading.Lock()
+        # Cache LLM results for near-duplicate turns with (almost) no history; response_cache=False disables it.
+        self.use_response_cache = kwargs.get("response_cache", True)
+        # Stateless mode (for several worker processes sharing db_path): no conversation state is
+        # cached in the process and a user's turns are serialized through a lease in the database.
+        self.stateless = kwargs.get("stateless", False)
+        # Long-term recall: with an embedder (e.g. HashingEmbedder(), OpenAIEmbedder()) messages and
+        # summaries removed by summarization are embedded and the closest ones are added to the prompt.
+        self.recall_embedder = kwargs.get("recall_embedder")
+        self.recall_top_k = kwargs.get("recall_top_k", 3)
+        self.db_path = db_path
+        self.reopen_memory()
+        # Serializes each user's turns (see arun_turn); different users still run in parallel.
+        self.user_locks = UserLocks(lease=SQLiteTurnLease(self.sqlite_memory) if self.stateless else None)
         self.core_principles = self.initialize_core_principles()
+        self._build_prompt_templates()
+
+    def reopen_memory(self):
+        """(Re)create the SQLite memory and the response cache persisted alongside it."""
+        memory_kwargs = {"cache_max_users": 0} if self.stateless else {}
+        self.sqlite_memory = SQLiteMemory(db_path=self.db_path, summarize_fn=self.summarize_conversation,
+                                          **memory_kwargs)
+        self.response_cache = (
+            ResponseCache(self.sqlite_memory.pool, calculate_cost, memory_cache=not self.stateless)
+            if self.use_response_cache else None
+        )
+        self.long_term_memory = None
+        if self.recall_embedder is not None:
+            self.long_term_memory = LongTermMemory(self.sqlite_memory.pool, self.recall_embedder,
+                                                   top_k=self.recall_top_k)
+            self.sqlite_memory.archive_fn = self.long_term_memory.archive_jobs
+
+    def reset_memory(self):
+        """Forget every conversation and cached response (safe while other workers use the database)."""
+        self.sqlite_memory.reset()  # also empties the response_cache and memory_vectors tables
+        if self.response_cache is not None:
+            self.response_cache.clear_local()
+        if self.long_term_memory is not None:
+            self.long_term_memory.clear_local()
+
+    def close(self):
+        """Stop background work and close the database connections."""
+        self.sqlite_memory.close()
 
     def initialize_core_principles(self) -> str:
         return """
@@ -118,37 +319,276 @@ Just as cells work in unison to form an organ, our individual efforts, when orga
 By embedding these routines and practices into daily interactions, we build a “partnerable” approach that prioritizes accountability, empathy, and proactive management of both visible and less visible interests. This method cultivates trust and ensures that the representation of interests is continuously maintained, even when individuals are not directly present.
         """
 
-    def seed_agent(self, user_id: str) -> str:
+    def begin_turn(self, user_id: str) -> ConversationSnapshot:
         """
-        Optionally seeds the conversation with an introductory message.
+        Load the user's rolling memory once for the turn that is about to run.
         """
-        intro = (
-            f"Hello! I am {self.agent_name}, your reflective guide. "
-            "Let's explore your challenges and find solutions together. How can I help you today?"
+        with self._phase("memory_read"):
+            return self.sqlite_memory.load_snapshot(user_id)
+
+    async def abegin_turn(self, user_id: str) -> ConversationSnapshot:
+        """Async variant of begin_turn (the read runs off the event loop)."""
+        started = time.perf_counter()
+        turn = await self.sqlite_memory.aload_snapshot(user_id)
+        seconds = time.perf_counter() - started
+        metrics.observe_phase("memory_read", seconds)
+        turn.add_time("db", seconds)
+        return turn
+
+    @contextmanager
+    def _phase(self, phase: str, turn: Optional[ConversationSnapshot] = None):
+        """Time one phase of a turn into the metrics histogram (and the turn's "db" timing for SQLite phases)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.observe_phase(phase, seconds)
+            if turn is not None and phase in DB_PHASES:
+                turn.add_time("db", seconds)
+
+    def _turn(self, user_id: str, turn: Optional[ConversationSnapshot]) -> ConversationSnapshot:
+        return turn if turn is not None else self.begin_turn(user_id)
+
+    def _store(self, user_id: str, text: str, role: str, turn: Optional[ConversationSnapshot] = None):
+        """Write a message to SQLite and mirror it into the turn snapshot."""
+        with self._phase("memory_write", turn):
+            message = self.sqlite_memory.store_message(user_id, text, role=role)
+        if turn is not None:
+            turn.append(message)
+
+    async def _astore(self, user_id: str, text: str, role: str, turn: Optional[ConversationSnapshot] = None):
+        with self._phase("memory_write", turn):
+            message = await self.sqlite_memory.astore_message(user_id, text, role=role)
+        if turn is not None:
+            turn.append(message)
+
+    def summarize_conversation(self, existing_summary: str, messages) -> Optional[str]:
+        """
+        Summarizer used by the background SummarizationWorker: folds older messages into the
+        existing summary with an LLM call on self.summary_model. Returns None on failure,
+        in which case the messages are kept and summarization is retried later.
+        """
+        transcript = "\n".join(f"{role.upper()}: {text}" for role, text in messages)
+        prompt = (
+            "Update the running summary of a conversation between a user and a reflective guide. "
+            "Keep the user's situation, goals, commitments, people involved and any decisions made. "
+            "Write at most 150 words in the third person.\n\n"
+            f"Existing Summary:\n{existing_summary or '(none)'}\n\n"
+            f"New Messages:\n{transcript}\n\n"
+            "Return only the updated summary."
         )
-        self.sqlite_memory.store_message(user_id, intro, role="agent")
+        llm_messages = [
+            {"role": "system", "content": "You summarize conversations accurately and concisely."},
+            {"role": "user", "content": prompt}
+        ]
+        response = call_llm(llm_messages, model=self.summary_model)
+        with self._summary_usage_lock:
+            self.summary_usage["llm_calls"] += 1
+            self.summary_usage["errors"] += 1 if response.get("error") else 0
+            for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+                self.summary_usage[field] += response.get(field) or 0
+        if self.verbose and response["response_text"]:
+            print(f"[{self.agent_name}] Summarized {len(messages)} messages (${response['cost']:.5f})")
+        return response["response_text"]
+
+    def seed_agent(self, user_id: str, turn: Optional[ConversationSnapshot] = None) -> str:
+        """
+        Optionally seeds the conversation with an introductory message.
+        """
+        intro = self._intro_message()
+        self._store(user_id, intro, "agent", turn)
         if self.verbose:
             print(f"[{self.agent_name}] Seeded conversation for {user_id}.")
         return intro
 
-    def human_step(self, user_id: str, user_input: str):
+    def _intro_message(self) -> str:
+        return (
+            f"Hello! I am {self.agent_name}, your reflective guide. "
+            "Let's explore your challenges and find solutions together. How can I help you today?"
+        )
+
+    def human_step(self, user_id: str, user_input: str, turn: Optional[ConversationSnapshot] = None):
         """
         Stores the user's input in SQLite. If no conversation history exists, seeds the conversation.
         Also triggers a stage determination.
         """
+        turn = self._turn(user_id, turn)
         # If conversation is empty, seed the agent.
-        if not self.sqlite_memory.retrieve_memory(user_id).strip():
-            self.seed_agent(user_id)
-        self.sqlite_memory.store_message(user_id, user_input, role="user")
+        if turn.is_empty():
+            self.seed_agent(user_id, turn)
+        self._store(user_id, user_input, "user", turn)
         # Update conversation stage based on current history.
         # self.determine_conversation_stage(user_id)
 
-    def determine_conversation_stage(self, user_id: str) -> str:
+    async def ahuman_step(self, user_id: str, user_input: str, turn: Optional[ConversationSnapshot] = None):
+        """Async variant of human_step."""
+        turn = turn if turn is not None else await self.abegin_turn(user_id)
+        if turn.is_empty():
+            await self._astore(user_id, self._intro_message(), "agent", turn)
+            if self.verbose:
+                print(f"[{self.agent_name}] Seeded conversation for {user_id}.")
+        await self._astore(user_id, user_input, "user", turn)
+
+    def determine_conversation_stage(self, user_id: str, turn: Optional[ConversationSnapshot] = None,
+                                     use_cache: bool = True) -> str:
         """
-        Retrieves the current conversation context from SQLite and uses the LLM to determine
-        the conversation stage. Expected stages: Exploration, Alignment, Ownership, or Leadership.
+        Retrieves the current conversation context from SQLite and determines the conversation
+        stage, using the local stage classifier when it is confident and the LLM otherwise.
+        The stage is persisted per user; turns the re-evaluation policy considers unchanged
+        reuse the stored stage without classifying at all.
+        Expected stages: Exploration, Alignment, Ownership, or Leadership.
         """
-        conversation_text = self.sqlite_memory.retrieve_memory(user_id)
+        turn = self._turn(user_id, turn)
+        with self._phase("stage_classification"):
+            stage = self._stage_without_llm(turn)
+            if not stage:
+                key = self._cache_key("stage", "", turn, use_cache)
+                messages = self._stage_messages(turn.render())
+                stage = self._parse_stage(self._call_llm_cached(key, messages))
+                self._record_new_stage(turn, stage)
+        with self._phase("memory_write"):
+            self.sqlite_memory.save_stage_state(user_id, turn.stage_state)
+        return self._set_stage(stage)
+
+    async def adetermine_conversation_stage(self, user_id: str, turn: Optional[ConversationSnapshot] = None,
+                                            use_cache: bool = True) -> str:
+        """Async variant of determine_conversation_stage."""
+        turn = turn if turn is not None else await self.abegin_turn(user_id)
+        with self._phase("stage_classification"):
+            stage = self._stage_without_llm(turn)
+            if not stage:
+                stage = await self._allm_stage(turn, use_cache)
+        with self._phase("memory_write", turn):
+            await self.sqlite_memory.asave_stage_state(user_id, turn.stage_state)
+        return self._set_stage(stage)
+
+    def _stage_without_llm(self, turn: ConversationSnapshot) -> Optional[str]:
+        """
+        Resolve the stage from the stored stage or the local classifier.
+        Returns None when only the LLM can decide.
+        """
+        if not self._stage_needs_reevaluation(turn):
+            return self._reuse_stage(turn)
+        stage = self._classify_locally(turn)
+        if stage:
+            self._record_new_stage(turn, stage)
+        return stage
+
+    async def _allm_stage(self, turn: ConversationSnapshot, use_cache: bool = True) -> str:
+        key = self._cache_key("stage", "", turn, use_cache)
+        messages = self._stage_messages(turn.render())
+        stage = self._parse_stage(await self._acall_llm_cached(turn, key, messages))
+        self._record_new_stage(turn, stage)
+        return stage
+
+    def _cache_key(self, kind: str, stage: str, turn: ConversationSnapshot, use_cache: bool,
+                   model: str = "gpt-4o") -> Optional[str]:
+        if not use_cache or self.response_cache is None:
+            return None
+        return self.response_cache.key_for(kind, model, stage, turn.summary, turn.messages)
+
+    def _call_llm_cached(self, key: Optional[str], messages: List[Dict[str, str]],
+                         model: str = "gpt-4o") -> Dict[str, Any]:
+        """call_llm behind the response cache (key=None bypasses the cache)."""
+        if key:
+            with self._phase("response_cache"):
+                cached = self.response_cache.get(key)
+            if self._cache_lookup_result(cached):
+                return cached
+        result = call_llm(messages, model=model)
+        if key:
+            with self._phase("response_cache"):
+                self.response_cache.put(key, model, result)
+        return result
+
+    def _cache_lookup_result(self, cached: Optional[Dict[str, Any]]) -> bool:
+        """Count a response-cache lookup; True on a hit."""
+        metrics.registry.inc(metrics.CACHE_REQUESTS, cache="response", result="hit" if cached else "miss")
+        if cached and self.verbose:
+            print(f"[{self.agent_name}] Response cache hit")
+        return bool(cached)
+
+    async def _acall_llm_cached(self, turn: ConversationSnapshot, key: Optional[str],
+                                messages: List[Dict[str, str]], model: str = "gpt-4o") -> Dict[str, Any]:
+        """
+        Async variant of _call_llm_cached; cache reads/writes run off the event loop.
+        Time spent is added to the turn's "db" (cache) and "llm" timings, tokens and cost to its usage.
+        """
+        if key:
+            with self._phase("response_cache", turn):
+                cached = await asyncio.to_thread(self.response_cache.get, key)
+            if self._cache_lookup_result(cached):
+                turn.add_usage(cached, cache_hit=True)
+                return cached
+        with turn.timed("llm"):
+            try:
+                result = await acall_llm(messages, model=model)
+            except asyncio.CancelledError:
+                # The request may already have been billed (e.g. a discarded speculative reply)
+                turn.add_usage(self._cancelled_result(messages, model))
+                raise
+        turn.add_usage(result)
+        if key:
+            with self._phase("response_cache", turn):
+                await asyncio.to_thread(self.response_cache.put, key, model, result)
+        return result
+
+    @staticmethod
+    def _cancelled_result(messages: List[Dict[str, str]], model: str) -> Dict[str, Any]:
+        """Usage for a call abandoned mid-flight: its prompt tokens are estimated, the reply unknown."""
+        prompt_tokens = sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens,
+                "cost": calculate_cost(prompt_tokens, 0, model), "cancelled": True}
+
+    def _respond(self, turn: ConversationSnapshot, stage: str, use_cache: bool) -> Dict[str, Any]:
+        key = self._cache_key("response", stage, turn, use_cache)
+        return self._call_llm_cached(key, self._response_messages(turn, stage))
+
+    async def _arespond(self, turn: ConversationSnapshot, stage: str, use_cache: bool) -> Dict[str, Any]:
+        key = self._cache_key("response", stage, turn, use_cache)
+        return await self._acall_llm_cached(turn, key, self._response_messages(turn, stage))
+
+    @staticmethod
+    def _latest_user_input(turn: ConversationSnapshot) -> str:
+        for role, text in reversed(turn.messages):
+            if role == "user":
+                return text
+        return ""
+
+    def _stage_needs_reevaluation(self, turn: ConversationSnapshot) -> bool:
+        if self.stage_policy is None:
+            return True
+        reason = self.stage_policy.reason_to_reevaluate(turn.stage_state, self._latest_user_input(turn))
+        if reason and self.verbose:
+            print(f"[{self.agent_name}] Re-evaluating stage for {turn.user_id}: {reason}")
+        return bool(reason)
+
+    def _reuse_stage(self, turn: ConversationSnapshot) -> str:
+        turn.stage_state.turns_since_eval += 1
+        self.stage_stats["reused"] += 1
+        return turn.stage_state.stage
+
+    @staticmethod
+    def _record_new_stage(turn: ConversationSnapshot, stage: str):
+        user_text = " ".join(text for role, text in turn.messages if role == "user")
+        turn.stage_state = StageState(stage, 0, " ".join(topic_terms(user_text)))
+
+    def _classify_locally(self, turn: ConversationSnapshot) -> Optional[str]:
+        """Return the local classifier's stage if it is confident enough, else None (use the LLM)."""
+        if self.stage_classifier is None:
+            return None
+        stage, confidence = self.stage_classifier.classify(turn.messages)
+        if self.verbose:
+            print(f"[{self.agent_name}] Local stage guess: {stage} (confidence {confidence:.2f})")
+        if confidence >= self.stage_confidence_threshold:
+            self.stage_stats["local"] += 1
+            return stage
+        self.stage_stats["llm_fallback"] += 1
+        return None
+
+    @staticmethod
+    def _stage_messages(conversation_text: str) -> List[Dict[str, str]]:
         prompt = (
             "You are a conversation stage analyzer for an AI agent. "
             "Based on the following conversation history, determine the current conversation stage. "
@@ -160,19 +600,23 @@ By embedding these routines and practices into daily interactions, we build a 
             f"Conversation History:\n{conversation_text}\n\n"
             "Return only the stage name."
         )
-        messages = [
+        return [
             {"role": "system", "content": "You are a conversation stage analyzer."},
             {"role": "user", "content": prompt}
         ]
-        response = call_llm(messages, model="gpt-4o")
+
+    @staticmethod
+    def _parse_stage(response: Dict[str, Any]) -> str:
         suggested_stage = (response["response_text"] or "").strip()
-        valid_stages = ["Exploration", "Alignment", "Ownership", "Leadership"]
-        if suggested_stage not in valid_stages:
+        if suggested_stage not in STAGES:
             suggested_stage = "Exploration"
-        self.stage = suggested_stage
+        return suggested_stage
+
+    def _set_stage(self, stage: str) -> str:
+        # The stage is per user (turn.stage_state), so it is only reported here, never kept on the agent.
         if self.verbose:
-            print(f"[{self.agent_name}] Determined stage: {self.stage}")
-        return self.stage
+            print(f"[{self.agent_name}] Determined stage: {stage}")
+        return stage
 
     def actionable_instructions(self, stage: str) -> str:
         """
@@ -198,56 +642,98 @@ By embedding these routines and practices into daily interactions, we build a 
         }
         return instructions.get(stage, "")
 
-    def create_system_prompt(self, user_id: str) -> str:
+    def create_system_prompt(self, user_id: str, turn: Optional[ConversationSnapshot] = None) -> str:
         """
         Create a detailed system prompt for the LLM that includes:
           - The agent's core principles.
           - The current conversation stage.
           - Actionable instructions for that stage.
-          - The persistent conversation history.
+        The conversation history is not part of it; ContextBuilder adds the summary and
+        messages after the system prompt, once each.
         """
-        current_stage = self.determine_conversation_stage(user_id)
-        instructions = self.actionable_instructions(current_stage)
-        conversation_history = self.sqlite_memory.retrieve_memory(user_id)
-        system_prompt = (
+        turn = self._turn(user_id, turn)
+        current_stage = self.determine_conversation_stage(user_id, turn)
+        return self._compose_system_prompt(current_stage)
+
+    async def acreate_system_prompt(self, user_id: str, turn: Optional[ConversationSnapshot] = None) -> str:
+        """Async variant of create_system_prompt."""
+        turn = turn if turn is not None else await self.abegin_turn(user_id)
+        current_stage = await self.adetermine_conversation_stage(user_id, turn)
+        return self._compose_system_prompt(current_stage)
+
+    def _build_prompt_templates(self):
+        """
+        Precompute the response system prompt for every stage, once at startup.
+        All static material (identity, core principles, guidelines) comes first and is
+        byte-identical for every stage and user, so provider-side prefix caching can reuse it;
+        the stage section follows it, and per-user context is sent after the system prompt.
+        """
+        self.static_prompt_prefix = (
             f"You are {self.agent_name}, a reflective and principle-driven agent. Your role is to guide the user through "
             f"challenging conversations based on the following core principles:\n\n{self.core_principles}\n\n"
-            f"Current Conversation Stage: {current_stage}\n"
-            f"Actionable Instructions: {instructions}\n\n"
-            f"Conversation History:\n{conversation_history}\n\n"
-            "Based on the above, respond thoughtfully to the user's latest input."
-            """"### Guidelines for Interaction:
-            - Respond thoughtfully, adhering to the core principles and stage-specific instructions.
+            """### Guidelines for Interaction:
+        - Respond thoughtfully, adhering to the core principles and stage-specific instructions.
         - Incorporate the user's input and past interactions when formulating your response.
         - Conclude the interaction when appropriate, ensuring the user feels supported and has actionable next steps.
         When using Socratic questioning and Core principles:
         1.    Stay neutral and curious—don’t impose your own beliefs or judgments.
         2.    Follow up on responses with deeper questions to encourage reflection and exploration.
         3.    Create a safe and respectful environment where the person feels comfortable sharing and reflecting."""
+            "\n\n"
         )
-        return system_prompt
+        self.stage_prompts = {stage: self.static_prompt_prefix + self._stage_section(stage) for stage in STAGES}
+
+    def _stage_section(self, stage: str) -> str:
+        return (
+            f"Current Conversation Stage: {stage}\n"
+            f"Actionable Instructions: {self.actionable_instructions(stage)}\n\n"
+            "Based on the above and the conversation that follows, respond thoughtfully to the user's latest input."
+        )
+
+    def _compose_system_prompt(self, current_stage: str) -> str:
+        prompt = self.stage_prompts.get(current_stage)
+        if prompt is None:
+            prompt = self.static_prompt_prefix + self._stage_section(current_stage)
+        return prompt
 
-    def _build_messages_for_llm(self, conversation_text: str, system_prompt: str) -> List[Dict[str, str]]:
+    def _recall(self, turn: ConversationSnapshot):
+        """Look up long-term memory for the latest user input (sets turn.recalled)."""
+        query = self._latest_user_input(turn)
+        if self.long_term_memory is None or not query:
+            return
+        with self._phase("recall"):
+            turn.recalled = self.long_term_memory.recall(turn.user_id, query)
+
+    async def _arecall(self, turn: ConversationSnapshot):
+        if self.long_term_memory is not None:
+            await asyncio.to_thread(self._recall, turn)
+
+    def _response_messages(self, turn: ConversationSnapshot, stage: str) -> List[Dict[str, str]]:
+        """Messages for the response call: system prompt, then summary and newest messages within budget."""
+        with self._phase("prompt_build"):
+            messages, report = self.context_builder.build(
+                self._compose_system_prompt(stage), turn.summary, turn.messages,
+                [hit.render() for hit in turn.recalled]
+            )
+        if self.verbose:
+            print(
+                f"[{self.agent_name}] Context for {turn.user_id}: {report['prompt_tokens']} tokens, "
+                f"{report['messages_included']} messages ({report['messages_dropped']} dropped), "
+                f"{report['recalled_included']} recalled, "
+                f"{report['tokens_saved']} tokens saved vs. previous layout"
+            )
+        return messages
+
+    def _build_messages_for_llm(self, turn: ConversationSnapshot, system_prompt: str) -> List[Dict[str, str]]:
         """
-        Converts the conversation history (including summary and unsummarized messages) into a list
-        of message dictionaries suitable for the LLM API. It also prepends the detailed system prompt.
+        Converts the conversation history (summary and unsummarized message records) into a list
+        of message dictionaries suitable for the LLM API, after the detailed system prompt.
+        Unlike _response_messages this applies no token budget.
         """
         messages = [{"role": "system", "content": system_prompt}]
-        for line in conversation_text.split("\n"):
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith("SUMMARY:"):
-                content = line[len("SUMMARY:"):].strip()
-                messages.append({"role": "system", "content": f"Conversation Summary: {content}"})
-            elif line.startswith("USER:"):
-                content = line[len("USER:"):].strip()
-                messages.append({"role": "user", "content": content})
-            elif line.startswith("AGENT:"):
-                content = line[len("AGENT:"):].strip()
-                messages.append({"role": "assistant", "content": content})
-            else:
-                messages.append({"role": "system", "content": line})
+        if turn.summary:
+            messages.append({"role": "system", "content": f"Conversation Summary: {turn.summary}"})
+        messages.extend(message.to_llm() for message in turn.messages)
         return messages
 
     # def generate_response(self, user_id: str, user_input: str) -> str:
@@ -272,22 +758,158 @@ By embedding these routines and practices into daily interactions, we build a 
     #         print(f"[{self.agent_name}] Generated response for {user_id}: {agent_text}")
     #     return agent_text
 
-    def generate_response(self, user_id: str) -> str:
+    def generate_response(self, user_id: str, turn: Optional[ConversationSnapshot] = None,
+                          use_cache: bool = True) -> str:
         """
         Generates a response based on the persistent conversation history.
         It uses the system prompt (including current stage and instructions) and the conversation history.
-        The agent's response is stored in SQLite and returned.
+        The agent's response is stored in SQLite (and appended to the turn snapshot) and returned;
+        the canned reply sent while the circuit breaker is open is returned but not stored.
+        Pass use_cache=False to bypass the response cache for this request.
         """
-        system_prompt = self.create_system_prompt(user_id)
-        conversation_text = self.sqlite_memory.retrieve_memory(user_id)
-        messages = self._build_messages_for_llm(conversation_text, system_prompt)
-        llm_response = call_llm(messages, model="gpt-4o")
+        turn = self._turn(user_id, turn)
+        self._recall(turn)
+        stage = self.determine_conversation_stage(user_id, turn, use_cache)
+        llm_response = self._respond(turn, stage, use_cache)
         agent_text = llm_response["response_text"] or "I'm sorry, I have no response."
-        self.sqlite_memory.store_message(user_id, agent_text, role="agent")
+        # The circuit breaker's canned reply is not an agent turn: keep it out of history and summaries
+        if not llm_response.get("degraded"):
+            self._store(user_id, agent_text, "agent", turn)
         if self.verbose:
             print(f"[{self.agent_name}] Generated response for {user_id}: {agent_text}")
         return agent_text
 
+    async def agenerate_response(self, user_id: str, turn: Optional[ConversationSnapshot] = None,
+                                 use_cache: bool = True) -> str:
+        """Async variant of generate_response (speculative when self.speculative is set)."""
+        turn = turn if turn is not None else await self.abegin_turn(user_id)
+        await self._arecall(turn)
+        if self.speculative:
+            llm_response = await self._aspeculative_response(user_id, turn, use_cache)
+        else:
+            stage = await self.adetermine_conversation_stage(user_id, turn, use_cache)
+            llm_response = await self._arespond(turn, stage, use_cache)
+        agent_text = llm_response["response_text"] or "I'm sorry, I have no response."
+        if not llm_response.get("degraded"):
+            await self._astore(user_id, agent_text, "agent", turn)
+        if self.verbose:
+            print(f"[{self.agent_name}] Generated response for {user_id}: {agent_text}")
+        return agent_text
+
+    async def _aspeculative_response(self, user_id: str, turn: ConversationSnapshot,
+                                     use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Resolve the stage and produce the reply, overlapping the two LLM calls when possible.
+        If the stage can be settled without the LLM (reused or confidently classified) there is
+        nothing to overlap. Otherwise the reply is generated with the user's previous stage while
+        the stage call runs; it is kept if the stage comes back unchanged and regenerated if not.
+        """
+        guess = turn.stage_state.stage
+        stage_started = time.perf_counter()
+        stage = self._stage_without_llm(turn)
+        if stage or not guess:
+            if not stage:
+                stage = await self._allm_stage(turn, use_cache)
+            metrics.observe_phase("stage_classification", time.perf_counter() - stage_started)
+            with self._phase("memory_write", turn):
+                await self.sqlite_memory.asave_stage_state(user_id, turn.stage_state)
+            self._set_stage(stage)
+            return await self._arespond(turn, stage, use_cache)
+
+        self.speculation_stats["attempts"] += 1
+
+        async def timed_response():
+            started = time.perf_counter()
+            result = await self._arespond(turn, guess, use_cache)
+            return result, time.perf_counter() - started
+
+        speculative_task = asyncio.create_task(timed_response())
+        try:
+            stage = await self._allm_stage(turn, use_cache)
+        except BaseException:
+            speculative_task.cancel()
+            raise
+        stage_seconds = time.perf_counter() - stage_started
+        metrics.observe_phase("stage_classification", stage_seconds)
+        with self._phase("memory_write", turn):
+            await self.sqlite_memory.asave_stage_state(user_id, turn.stage_state)
+        self._set_stage(stage)
+
+        if stage == guess:
+            llm_response, response_seconds = await speculative_task
+            self.speculation_stats["hits"] += 1
+            # Sequential would have cost stage + response; overlapped costs the max of the two.
+            self.speculation_stats["saved_seconds"] += min(stage_seconds, response_seconds)
+            if self.verbose:
+                print(f"[{self.agent_name}] Speculation hit for {user_id} (stage {stage})")
+            return llm_response
+
+        speculative_task.cancel()
+        await asyncio.wait({speculative_task})  # let it record its (partial) usage on the turn
+        self.speculation_stats["misses"] += 1
+        if self.verbose:
+            print(f"[{self.agent_name}] Speculation miss for {user_id}: {guess} -> {stage}, regenerating")
+        return await self._arespond(turn, stage, use_cache)
+
+    async def astream_response(self, user_id: str,
+                               turn: Optional[ConversationSnapshot] = None) -> AsyncIterator[str]:
+        """
+        Streaming variant of agenerate_response: yields the reply as text deltas.
+        The complete reply is stored once the stream ends (or is cut short by the client), unless it
+        is the circuit breaker's canned reply.
+        """
+        turn = turn if turn is not None else await self.abegin_turn(user_id)
+        await self._arecall(turn)
+        stage = await self.adetermine_conversation_stage(user_id, turn)
+        messages = self._response_messages(turn, stage)
+        parts = []
+        usage = {}
+        waiting_since = time.perf_counter()
+        try:
+            async for delta in astream_llm(messages, model="gpt-4o", usage=usage):
+                # Time spent waiting on the model, not on the client reading the deltas
+                turn.add_time("llm", time.perf_counter() - waiting_since)
+                parts.append(delta)
+                yield delta
+                waiting_since = time.perf_counter()
+            turn.add_time("llm", time.perf_counter() - waiting_since)
+        finally:
+            turn.add_usage(usage)
+            agent_text = "".join(parts).strip() or "I'm sorry, I have no response."
+            if not usage.get("degraded"):
+                await self._astore(user_id, agent_text, "agent", turn)
+            if self.verbose:
+                print(f"[{self.agent_name}] Streamed response for {user_id}: {agent_text}")
+        if not parts:
+            yield agent_text
+
+    async def arun_turn(self, user_id: str, user_input: str,
+                        use_cache: bool = True) -> Tuple[str, ConversationSnapshot]:
+        """
+        Run a whole turn (load memory, store the input, respond) while holding the user's lock,
+        so concurrent requests from the same user can't interleave their reads and writes.
+        Returns the reply and the finished turn snapshot.
+        """
+        async with self.user_locks.hold(user_id):
+            turn = await self.abegin_turn(user_id)
+            await self.ahuman_step(user_id, user_input, turn)
+            response_text = await self.agenerate_response(user_id, turn, use_cache)
+        return response_text, turn
+
+    async def astream_turn(self, user_id: str, user_input: str,
+                           timings: Optional[Dict[str, float]] = None) -> AsyncIterator[str]:
+        """
+        Streaming variant of arun_turn; the user's lock is held until the stream ends or is closed.
+        If a `timings` dict is passed it is filled with the turn's timings once the stream ends.
+        """
+        async with self.user_locks.hold(user_id):
+            turn = await self.abegin_turn(user_id)
+            await self.ahuman_step(user_id, user_input, turn)
+            async for delta in self.astream_response(user_id, turn):
+                yield delta
+        if timings is not None:
+            timings.update(turn.timings)
+
     def use_tool(self, user_id: str, tool_name: str, tool_input: str) -> str:
         """
         Use a specified tool (if available) and store the usage in memory.
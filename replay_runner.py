@@ -0,0 +1,352 @@
+"""
+Offline replay of recorded conversations through PartnerableAgent, e.g. to compare a prompt or
+model change on thousands of conversations without going through the HTTP API.
+
+Input (JSONL), one conversation per line; the user's inputs are replayed as turns, in order:
+    {"id": "c1", "turns": ["first user message", "second user message"]}
+    {"id": "c2", "messages": [["user", "..."], ["agent", "..."], ...]}   (agent lines are ignored)
+    {"request_id": "r1", "title": "...", "body": "..."}                 (requests.jsonl: one turn)
+Lines without an id are identified by their line number.
+
+Conversations run concurrently on a bounded pool of workers (a conversation's turns run one
+after another), against a separate database (--db, default replay.db) with a fresh user per
+conversation and attempt. The response cache is off unless --response-cache is given, so every
+turn really reaches the model. Optional rate limits cap LLM requests and tokens per minute.
+
+Output (JSONL, streamed): one line per turn with the reply, stage, latency, timings and token /
+cost usage, written when its conversation finishes. A turn whose LLM call failed or got the
+circuit breaker's canned reply is written with an "error" and ends its conversation. Tokens and
+cost also cover background summarization calls (charged to the rate limits as they happen) and
+speculative replies cancelled mid-flight (prompt tokens estimated). Finished conversation ids are appended to
+the checkpoint file (--checkpoint, default <output>.checkpoint); rerunning the same command skips
+them and appends to the output, so an interrupted run resumes where it stopped. Conversations
+that failed are not checkpointed and are retried on the next run.
+
+Usage:
+    python replay_runner.py conversations.jsonl -o results.jsonl --workers 32 --rpm 500 --tpm 200000
+    python replay_runner.py requests.jsonl -o results.jsonl --mock --mock-latency-ms 200
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_conversation(line: str, line_number: int) -> Optional[Tuple[str, List[str]]]:
+    """(conversation id, user inputs) for one JSONL line; None for a blank line, ValueError if invalid."""
+    line = line.strip()
+    if not line:
+        return None
+    obj = json.loads(line)
+    if not isinstance(obj, dict):
+        raise ValueError("expected an object")
+    conversation_id = str(obj.get("id") or obj.get("request_id") or f"line-{line_number}")
+    if "turns" in obj:
+        turns = obj["turns"]
+    elif "messages" in obj:
+        turns = []
+        for message in obj["messages"]:
+            if isinstance(message, dict):
+                role, text = message.get("role"), message.get("text", message.get("content"))
+            else:
+                role, text = message
+            if role == "user":
+                turns.append(text)
+    elif "body" in obj:
+        turns = ["\n\n".join(part for part in (obj.get("title"), obj["body"]) if part)]
+    else:
+        raise ValueError("expected turns, messages or body")
+    if not turns or not all(isinstance(turn, str) and turn for turn in turns):
+        raise ValueError("no user turns")
+    return conversation_id, turns
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets shared by all workers (0 = unlimited).
+    Both refill continuously. wait() blocks until a request can start and reserves one request;
+    record() charges what a turn actually used, which may push a budget into debt so later turns
+    wait longer. Token use is only known afterwards, so the token budget is enforced on average.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        """
+        :param requests_per_minute: LLM requests allowed per minute (0 = no limit).
+        :param tokens_per_minute: Prompt + completion tokens allowed per minute (0 = no limit).
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def wait(self):
+        started = time.monotonic()
+        while True:
+            self._refill()
+            delay = 0.0
+            if self.requests_per_minute and self._requests < 1:
+                delay = (1 - self._requests) * 60 / self.requests_per_minute
+            if self.tokens_per_minute and self._tokens <= 0:
+                delay = max(delay, (1 - self._tokens) * 60 / self.tokens_per_minute)
+            if delay == 0.0:
+                break
+            await asyncio.sleep(delay)
+        if self.requests_per_minute:
+            self._requests -= 1
+        self.waited_seconds += time.monotonic() - started
+
+    def record(self, requests: int, tokens: int):
+        """Charge a finished turn (the one request reserved by wait() is already paid)."""
+        self.charge(max(0, requests - 1), tokens)
+
+    def charge(self, requests: int, tokens: int):
+        """Charge requests made without wait(), e.g. background summarization calls."""
+        self._refill()
+        if self.requests_per_minute:
+            self._requests -= requests
+        if self.tokens_per_minute:
+            self._tokens -= tokens
+
+
+class ReplayRunner:
+    """Replays conversations through an agent with a bounded pool of async workers."""
+
+    def __init__(self, agent, output_path: str, checkpoint_path: str, workers: int = 16,
+                 limiter: Optional[RateLimiter] = None, use_cache: bool = False):
+        """
+        :param agent: The PartnerableAgent to drive (its memory should be a scratch database).
+        :param output_path: JSONL file results are appended to.
+        :param checkpoint_path: File of finished conversation ids, one per line.
+        :param workers: Conversations replayed at once.
+        :param limiter: Optional RateLimiter applied before every turn.
+        :param use_cache: Let turns use the agent's response cache.
+        """
+        self.agent = agent
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path
+        self.workers = max(1, workers)
+        self.limiter = limiter
+        self.use_cache = use_cache
+        self.run_id = uuid.uuid4().hex[:8]  # fresh users per attempt, so a resumed run starts clean
+        self.done = self._load_checkpoint()
+        self.stats = {"conversations": 0, "skipped": 0, "failed": 0, "invalid": 0, "turns": 0,
+                      "llm_calls": 0, "cancelled_calls": 0, "summary_calls": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0}
+        self.latencies = []
+        # Summarization runs in the agent's background worker; its usage is charged as it shows up
+        self._summary_seen = dict(getattr(agent, "summary_usage", None) or {})
+
+    def _load_checkpoint(self) -> set:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    async def _replay(self, conversation_id: str, turns: List[str]) -> Tuple[List[Dict[str, Any]], bool]:
+        user_id = f"replay-{self.run_id}-{conversation_id}"
+        results = []
+        for index, user_input in enumerate(turns):
+            if self.limiter is not None:
+                await self.limiter.wait()
+            started = time.perf_counter()
+            result = {"conversation_id": conversation_id, "turn": index, "user_input": user_input}
+            try:
+                response_text, turn = await self.agent.arun_turn(user_id, user_input, self.use_cache)
+            except Exception as e:
+                if self.limiter is not None:
+                    self.limiter.record(1, 0)
+                result["error"] = str(e)
+                results.append(result)
+                return results, False  # later turns would run without this one's context
+            seconds = time.perf_counter() - started
+            usage = turn.usage
+            if self.limiter is not None:
+                self.limiter.record(usage["llm_calls"], usage["prompt_tokens"] + usage["completion_tokens"])
+            self._charge_summaries()
+            self.stats["llm_calls"] += usage["llm_calls"]
+            self.stats["cancelled_calls"] += usage["cancelled"]
+            for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+                self.stats[field] += usage[field]
+            result.update({
+                "response": response_text,
+                "stage": turn.stage_state.stage,
+                "latency_ms": round(seconds * 1000, 1),
+                "timings": turn.timings,
+                "usage": usage,
+            })
+            # acall_llm doesn't raise: a failed call comes back as an error or canned (degraded) reply
+            if usage["errors"] or usage["degraded"]:
+                result["error"] = ("LLM call failed" if usage["errors"]
+                                   else "circuit breaker open (canned reply)")
+                results.append(result)
+                return results, False
+            results.append(result)
+            self.latencies.append(seconds)
+            self.stats["turns"] += 1
+        return results, True
+
+    def _charge_summaries(self):
+        """Add summarizer usage since the last call to the stats and the rate limiter."""
+        usage = getattr(self.agent, "summary_usage", None)
+        if not usage:
+            return
+        current = dict(usage)
+        delta = {field: value - self._summary_seen.get(field, 0) for field, value in current.items()}
+        self._summary_seen = current
+        if self.limiter is not None and delta["llm_calls"]:
+            self.limiter.charge(delta["llm_calls"], delta["prompt_tokens"] + delta["completion_tokens"])
+        self.stats["summary_calls"] += delta["llm_calls"]
+        self.stats["llm_calls"] += delta["llm_calls"]
+        for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+            self.stats[field] += delta[field]
+
+    async def _worker(self, queue: asyncio.Queue, output, checkpoint):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            conversation_id, turns = item
+            results, ok = await self._replay(conversation_id, turns)
+            output.write("".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results))
+            output.flush()
+            if ok:
+                # Results first, then the checkpoint: a crash in between only repeats this conversation.
+                checkpoint.write(conversation_id + "\n")
+                checkpoint.flush()
+                self.stats["conversations"] += 1
+            else:
+                self.stats["failed"] += 1
+
+    async def run(self, lines) -> Dict[str, Any]:
+        """Replay every conversation in `lines` (an iterable of JSONL lines) not yet checkpointed."""
+        queue = asyncio.Queue(maxsize=self.workers * 2)  # bounded: the input is read as workers free up
+        started = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as output, \
+                open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint:
+            workers = [asyncio.ensure_future(self._worker(queue, output, checkpoint)) for _ in range(self.workers)]
+            try:
+                for line_number, line in enumerate(lines, 1):
+                    try:
+                        conversation = parse_conversation(line, line_number)
+                    except (ValueError, TypeError, KeyError, IndexError) as e:
+                        self.stats["invalid"] += 1
+                        print(f"[replay] Skipping line {line_number}: {e}", file=sys.stderr)
+                        continue
+                    if conversation is None:
+                        continue
+                    if conversation[0] in self.done:
+                        self.stats["skipped"] += 1
+                        continue
+                    await queue.put(conversation)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                # Summaries queued by the last turns still count towards the run's usage
+                await asyncio.to_thread(self._flush_summaries)
+                self._charge_summaries()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+        return self.report(time.perf_counter() - started)
+
+    def _flush_summaries(self):
+        memory = getattr(self.agent, "sqlite_memory", None)
+        if memory is not None:
+            memory.summarizer.flush()
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        ms = lambda pct: round(_percentile(self.latencies, pct) * 1000, 1)
+        return {
+            **self.stats,
+            "cost": round(self.stats["cost"], 6),
+            "wall_seconds": round(wall_seconds, 2),
+            "turns_per_second": round(self.stats["turns"] / wall_seconds, 2) if wall_seconds else 0.0,
+            "latency_ms": {"p50": ms(50), "p95": ms(95), "p99": ms(99), "max": ms(100)},
+            "rate_limit_wait_seconds": round(self.limiter.waited_seconds, 2) if self.limiter else 0.0,
+        }
+
+
+def spawn_mock(port: int, latency_ms: float) -> subprocess.Popen:
+    """Start mock_openai_server.py and point the OpenAI client (created on import of the agent) at it."""
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "mock_openai_server.py"), "--port", str(port),
+         "--latency-ms", str(latency_ms)],
+    )
+
+
+async def _main(args) -> Dict[str, Any]:
+    mock = spawn_mock(args.mock_port, args.mock_latency_ms) if args.mock else None
+    try:
+        if mock is not None:
+            from load_test import _wait_until_up
+            await _wait_until_up(f"http://127.0.0.1:{args.mock_port}/stats")
+        # Imported here so --mock can set the OpenAI environment variables first.
+        from partnerable_agent_with_memory import PartnerableAgent
+        from long_term_memory import HashingEmbedder, OpenAIEmbedder
+        embedders = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+        recall_embedder = embedders[args.recall]() if args.recall else None
+        agent = PartnerableAgent(db_path=args.db, verbose=args.verbose, speculative=args.speculative,
+                                 response_cache=args.response_cache, recall_embedder=recall_embedder)
+        try:
+            runner = ReplayRunner(agent, args.output, args.checkpoint or args.output + ".checkpoint",
+                                  args.workers, RateLimiter(args.rpm, args.tpm) if args.rpm or args.tpm else None,
+                                  use_cache=args.response_cache)
+            with open(args.input, encoding="utf-8") as lines:
+                return await runner.run(lines)
+        finally:
+            agent.close()
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded conversations through PartnerableAgent.")
+    parser.add_argument("input", help="JSONL file of conversations")
+    parser.add_argument("-o", "--output", default="replay_results.jsonl", help="JSONL results (appended)")
+    parser.add_argument("--checkpoint", help="Finished conversation ids (default: OUTPUT.checkpoint)")
+    parser.add_argument("--db", default="replay.db", help="Scratch SQLite database for the replayed users")
+    parser.add_argument("--workers", type=int, default=16, help="Conversations replayed concurrently")
+    parser.add_argument("--rpm", type=float, default=0, help="Max LLM requests per minute (0 = no limit)")
+    parser.add_argument("--tpm", type=float, default=0, help="Max LLM tokens per minute (0 = no limit)")
+    parser.add_argument("--speculative", action="store_true", help="Use speculative stage/response generation")
+    parser.add_argument("--response-cache", action="store_true", help="Allow response-cache hits")
+    parser.add_argument("--recall", choices=["hashing", "openai"], help="Enable long-term recall with this embedder")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--mock", action="store_true", help="Start the local mock OpenAI server and use it")
+    parser.add_argument("--mock-port", type=int, default=8100)
+    parser.add_argument("--mock-latency-ms", type=float, default=200.0)
+    args = parser.parse_args(argv)
+    report = asyncio.run(_main(args))
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Defaults for the LLM response cache
+DEFAULT_RESPONSE_CACHE_ENTRIES = 2048
+DEFAULT_RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Only turns with at most this many earlier messages (and no summary) are cached;
+# longer conversations are effectively unique and would just churn the cache.
+DEFAULT_MAX_CONTEXT_MESSAGES = 2
+PRUNE_EVERY_N_PUTS = 100
+
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+SQL_SELECT_RESPONSE = """
+    SELECT model, response_text, prompt_tokens, completion_tokens, created_at
+    FROM response_cache
+    WHERE cache_key = ?
+"""
+SQL_UPSERT_RESPONSE = """
+    INSERT OR REPLACE INTO response_cache
+        (cache_key, model, response_text, prompt_tokens, completion_tokens, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+SQL_DELETE_RESPONSE = "DELETE FROM response_cache WHERE cache_key = ?"
+SQL_CLEAR_RESPONSES = "DELETE FROM response_cache"
+SQL_PRUNE_EXPIRED = "DELETE FROM response_cache WHERE created_at < ?"
+SQL_PRUNE_OLDEST = """
+    DELETE FROM response_cache WHERE cache_key IN (
+        SELECT cache_key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+    )
+"""
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace, so "Hello!" and "hello" share an entry."""
+    return _SPACE_RE.sub(" ", _NON_WORD_RE.sub(" ", text.lower())).strip()
+
+
+class ResponseCache:
+    """
+    Caches LLM results for deterministic, near-duplicate turns (e.g. "hi" with an empty history).
+    Keys are a hash of (kind, model, stage, context fingerprint, normalized input), where the
+    fingerprint covers everything before the new user message. Entries live in an in-process LRU
+    backed by a response_cache table, expire after ttl_seconds and are capped at max_entries.
+    With memory_cache=False every lookup goes to the table, so processes sharing the database
+    always agree (e.g. after a reset by another worker).
+    The cache keeps hit/miss counters and the dollar cost of the calls it avoided.
+    """
+
+    def __init__(self, pool, cost_fn, max_entries: int = DEFAULT_RESPONSE_CACHE_ENTRIES,
+                 ttl_seconds: float = DEFAULT_RESPONSE_CACHE_TTL_SECONDS,
+                 max_context_messages: int = DEFAULT_MAX_CONTEXT_MESSAGES, memory_cache: bool = True):
+        """
+        :param pool: SQLiteMemory's connection pool (its SCHEMA creates the response_cache table).
+        :param cost_fn: calculate_cost(input_tokens, output_tokens, model), for the savings counter.
+        :param max_entries: Maximum entries kept in memory and on disk.
+        :param ttl_seconds: Age after which an entry is no longer served.
+        :param max_context_messages: Largest earlier history that is still considered cacheable.
+        :param memory_cache: Keep recently used entries in process memory as well.
+        """
+        self.pool = pool
+        self.cost_fn = cost_fn
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_context_messages = max_context_messages
+        self.memory_cache = memory_cache
+        self._entries = OrderedDict()  # key -> (model, text, prompt_tokens, completion_tokens, created_at)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.dollars_saved = 0.0
+
+    def key_for(self, kind: str, model: str, stage: str, summary: str,
+                messages: Sequence[Tuple[str, str]]) -> Optional[str]:
+        """
+        Cache key for a call, or None if the turn isn't cacheable.
+        :param messages: The turn's messages, ending with the new user input.
+        """
+        if not messages:
+            return None
+        last_role, last_text = messages[-1]
+        if last_role != "user":
+            return None
+        context = messages[:-1]
+        if summary or len(context) > self.max_context_messages:
+            return None
+        fingerprint = "\x1e".join(f"{role}\x1f{text}" for role, text in context)
+        raw = "\x1d".join((kind, model, stage, fingerprint, normalize_input(last_text)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a call_llm-shaped result for a cached entry (zero tokens/cost), or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            with self.pool.connection() as conn:
+                entry = conn.execute(SQL_SELECT_RESPONSE, (key,)).fetchone()
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, tuple(entry))
+        if entry is not None and now - entry[4] > self.ttl_seconds:
+            self._forget(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            model, text, prompt_tokens, completion_tokens, _ = entry
+            try:
+                self.dollars_saved += self.cost_fn(prompt_tokens, completion_tokens, model)
+            except ValueError:
+                pass
+        return {
+            "response_text": text,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "cached_tokens": 0,
+            "cost": 0.0,
+            "cache_hit": True,
+        }
+
+    def put(self, key: str, model: str, result: Dict[str, Any]):
+        """Store a successful call_llm result (degraded fallback replies are never cached)."""
+        if not result.get("response_text") or result.get("degraded"):
+            return
+        entry = (model, result["response_text"], result["prompt_tokens"], result["completion_tokens"], time.time())
+        with self._lock:
+            self._remember(key, entry)
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY_N_PUTS == 0
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(SQL_UPSERT_RESPONSE, (key, *entry))
+                if prune:
+                    conn.execute(SQL_PRUNE_EXPIRED, (time.time() - self.ttl_seconds,))
+                    conn.execute(SQL_PRUNE_OLDEST, (self.max_entries,))
+        except Exception as e:
+            logging.error(f"Error persisting response cache entry: {e}")
+
+    def _remember(self, key: str, entry: tuple):
+        if not self.memory_cache:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        with self.pool.connection() as conn:
+            conn.execute(SQL_DELETE_RESPONSE, (key,))
+
+    def clear(self):
+        """Drop every entry, in memory and in the table."""
+        self.clear_local()
+        with self.pool.connection() as conn:
+            conn.execute(SQL_CLEAR_RESPONSES)
+
+    def clear_local(self):
+        """Drop the in-memory entries only (SQLiteMemory.reset() empties the table)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "dollars_saved": round(self.dollars_saved, 6),
+                "entries": len(self._entries),
+            }
@@ -2,12 +2,607 @@ import sqlite3
 import os
 import time
 import uuid
+import queue
 import asyncio
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional
+from summarization_worker import SummarizationWorker, SummarizationJob, SummarizeFn, extractive_summary
 
 # Define the threshold at which summarization is triggered
 MEMORY_LIMIT = 5
 
+# Stored in PRAGMA user_version. v1 = original unindexed tables ordered by timestamp,
+# v2 = per-user monotonic seq column with composite (user_id, seq) indexes,
+# v3 = adds the per-user user_stage table,
+# v4 = adds the turn_leases table used to serialize a user's turns across processes,
+# v5 = adds the response_cache table (see response_cache.py),
+# v6 = adds the memory_vectors table of archived embeddings (see long_term_memory.py).
+SCHEMA_VERSION = 6
+
+# Default connection pool / pragma settings (override per SQLiteMemory instance)
+DEFAULT_POOL_SIZE = 8
+DEFAULT_SYNCHRONOUS = "NORMAL"      # OFF | NORMAL | FULL | EXTRA
+DEFAULT_CACHE_SIZE = -16000         # negative = KiB, so ~16 MB of page cache per connection
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 64
+
+# Default limits for the in-process cache of active conversation windows
+DEFAULT_CACHE_MAX_USERS = 1024
+DEFAULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_CACHE_TTL_SECONDS = 15 * 60
+
+# Page size for SQLiteMemory.history_page
+DEFAULT_HISTORY_PAGE_SIZE = 50
+
+# SQL used on the hot path. Keeping these as module constants means every call passes the
+# exact same string, so sqlite3's per-connection statement cache reuses the prepared statement.
+SQL_NEXT_SEQ = """
+    INSERT INTO user_seq (user_id, last_seq) VALUES (?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET last_seq = last_seq + 1
+"""
+SQL_CURRENT_SEQ = "SELECT last_seq FROM user_seq WHERE user_id = ?"
+SQL_INSERT_MESSAGE = """
+    INSERT INTO messages (msg_id, user_id, seq, role, text, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+SQL_COUNT_MESSAGES = "SELECT COUNT(*) FROM messages WHERE user_id = ?"
+# Bulk import: reserve a block of seq values for a user in one statement
+SQL_ADVANCE_SEQ = """
+    INSERT INTO user_seq (user_id, last_seq) VALUES (?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET last_seq = last_seq + excluded.last_seq
+"""
+# Bulk export: ordered scans of the (user_id, seq) indexes
+SQL_EXPORT_MESSAGES = "SELECT user_id, role, text, timestamp, seq FROM messages ORDER BY user_id, seq"
+SQL_EXPORT_SUMMARIES = """
+    SELECT user_id, text, timestamp, seq
+    FROM summaries s
+    WHERE seq = (SELECT MAX(seq) FROM summaries WHERE user_id = s.user_id)
+    ORDER BY user_id
+"""
+SQL_SELECT_MESSAGES = """
+    SELECT msg_id, role, text, timestamp, seq
+    FROM messages
+    WHERE user_id = ?
+    ORDER BY seq ASC
+"""
+SQL_SELECT_MESSAGES_BEFORE = """
+    SELECT msg_id, role, text, timestamp, seq
+    FROM messages
+    WHERE user_id = ? AND seq < ?
+    ORDER BY seq DESC
+    LIMIT ?
+"""
+SQL_SELECT_LATEST_SUMMARY = """
+    SELECT summary_id, text, timestamp, seq
+    FROM summaries
+    WHERE user_id = ?
+    ORDER BY seq DESC
+    LIMIT 1
+"""
+SQL_DELETE_SUMMARIES = "DELETE FROM summaries WHERE user_id = ?"
+SQL_INSERT_SUMMARY = """
+    INSERT INTO summaries (summary_id, user_id, seq, text, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_DELETE_MESSAGES_UPTO = "DELETE FROM messages WHERE user_id = ? AND seq <= ?"
+SQL_DELETE_SUMMARIES_BEFORE = "DELETE FROM summaries WHERE user_id = ? AND seq < ?"
+SQL_MESSAGE_EXISTS = "SELECT 1 FROM messages WHERE user_id = ? AND seq = ?"
+SQL_SELECT_STAGE = """
+    SELECT stage, turns_since_eval, topic
+    FROM user_stage
+    WHERE user_id = ?
+"""
+SQL_UPSERT_STAGE = """
+    INSERT INTO user_stage (user_id, stage, turns_since_eval, topic, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        stage = excluded.stage,
+        turns_since_eval = excluded.turns_since_eval,
+        topic = excluded.topic,
+        updated_at = excluded.updated_at
+"""
+# Take the lease if it is free, expired or already ours (changes() tells whether it was taken)
+SQL_ACQUIRE_LEASE = """
+    INSERT INTO turn_leases (user_id, owner, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+    WHERE turn_leases.expires_at < ? OR turn_leases.owner = excluded.owner
+"""
+SQL_RELEASE_LEASE = "DELETE FROM turn_leases WHERE user_id = ? AND owner = ?"
+# Conversation state removed by SQLiteMemory.reset(). user_seq is kept so seq values never repeat,
+# which lets summarization jobs planned before a reset detect that their messages are gone.
+SQL_RESET = (
+    "DELETE FROM messages",
+    "DELETE FROM summaries",
+    "DELETE FROM user_stage",
+    "DELETE FROM memory_vectors",
+    "DELETE FROM response_cache",
+)
+
+# Every statement is idempotent, so running the list brings any older schema up to date
+# (after _migrate_v1_to_v2 has added the columns CREATE TABLE IF NOT EXISTS can't).
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        msg_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        role TEXT,
+        text TEXT,
+        timestamp INTEGER,
+        seq INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        summary_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        text TEXT,
+        timestamp INTEGER,
+        seq INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_seq (
+        user_id TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_stage (
+        user_id TEXT PRIMARY KEY,
+        stage TEXT NOT NULL,
+        turns_since_eval INTEGER NOT NULL DEFAULT 0,
+        topic TEXT NOT NULL DEFAULT '',
+        updated_at INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS turn_leases (
+        user_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response_text TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS memory_vectors (
+        vector_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        embedder TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        role TEXT,
+        seq INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        vector BLOB NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_user_seq ON messages (user_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_summaries_user_seq ON summaries (user_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_memory_vectors_user ON memory_vectors (user_id, embedder, vector_id)",
+)
+
+
+class SQLiteConnectionPool:
+    """
+    A small thread-safe pool of persistent SQLite connections.
+    Connections are opened lazily (up to pool_size), configured once with WAL journaling and the
+    requested pragmas, and then handed out and returned instead of being reopened on every call.
+    Because each connection stays open, sqlite3's statement cache keeps prepared statements alive.
+    """
+
+    def __init__(self, db_path: str, pool_size: int = DEFAULT_POOL_SIZE, wal: bool = True,
+                 synchronous: str = DEFAULT_SYNCHRONOUS, cache_size: int = DEFAULT_CACHE_SIZE,
+                 mmap_size: int = DEFAULT_MMAP_SIZE, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS):
+        if synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Unsupported synchronous mode: {synchronous}")
+        self.db_path = db_path
+        # An in-memory database is private to its connection, so it can only be shared through one.
+        self.pool_size = 1 if db_path == ":memory:" else max(1, pool_size)
+        self.wal = wal
+        self.synchronous = synchronous.upper()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,  # connections are handed between threads, never shared concurrently
+            isolation_level=None,     # autocommit; multi-statement work uses explicit BEGIN/COMMIT
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        if self.wal:
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.pool_size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        # Pool exhausted: wait for another caller to hand a connection back.
+        return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+
+    def release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and run the with-block inside BEGIN IMMEDIATE ... COMMIT."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self):
+        """Close every connection owned by the pool."""
+        with self._lock:
+            self._closed = True
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class MessageRecord:
+    """
+    One stored message, kept as typed fields from the row to the LLM request so history never
+    goes through a "ROLE: text" string and back (which split multi-line messages apart).
+    __slots__ keeps the per-message overhead small for the conversation cache. Iterating
+    yields (role, text), so code written against (role, text) pairs accepts records as they are.
+    """
+
+    __slots__ = ("role", "text", "seq", "timestamp")
+
+    # Stored roles -> chat API roles
+    LLM_ROLES = {"user": "user", "agent": "assistant"}
+
+    def __init__(self, role: str, text: str, seq: int = 0, timestamp: int = 0):
+        self.role = role
+        self.text = text
+        self.seq = seq
+        self.timestamp = timestamp
+
+    def __iter__(self):
+        yield self.role
+        yield self.text
+
+    def __repr__(self) -> str:
+        return f"MessageRecord({self.role!r}, {self.text!r}, seq={self.seq})"
+
+    def to_llm(self) -> dict:
+        """The chat API message for this record (unknown roles are sent as system messages)."""
+        return {"role": self.LLM_ROLES.get(self.role, "system"), "content": self.text}
+
+    def approx_size(self) -> int:
+        return 100 + len(self.role) + len(self.text)
+
+    def render(self) -> str:
+        return f"{self.role.upper()}: {self.text}"
+
+    def to_dict(self) -> dict:
+        return {"seq": self.seq, "role": self.role, "text": self.text, "timestamp": self.timestamp}
+
+
+class StageState:
+    """
+    A user's persisted conversation stage plus what the re-evaluation policy needs to decide
+    whether it is stale: turns since it was computed and the topic terms of the conversation at
+    that point.
+    """
+
+    def __init__(self, stage: str = "", turns_since_eval: int = 0, topic: str = ""):
+        self.stage = stage
+        self.turns_since_eval = turns_since_eval
+        self.topic = topic
+
+    def copy(self) -> "StageState":
+        return StageState(self.stage, self.turns_since_eval, self.topic)
+
+
+class ConversationSnapshot:
+    """
+    An in-memory copy of one user's rolling memory (latest summary + unsummarized messages),
+    loaded once at the start of a turn and kept current as the turn writes new messages.
+    Lets every step of a turn share the same view instead of re-querying SQLite.
+    Also carries the user's persisted StageState, the seconds the turn has spent per phase
+    ("db", "llm") so callers can report where a turn's time went, and its LLM usage.
+    """
+
+    def __init__(self, user_id: str, summary: str = "", messages=None, summary_seq: int = 0,
+                 stage_state: StageState = None):
+        self.user_id = user_id
+        self.summary = summary
+        self.messages = list(messages or [])  # [MessageRecord, ...] oldest first
+        self.summary_seq = summary_seq
+        self.stage_state = stage_state or StageState()
+        self.timings = {}  # phase -> seconds; per turn, so never copied
+        self.usage = {"llm_calls": 0, "cache_hits": 0, "errors": 0, "degraded": 0, "cancelled": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                      "cost": 0.0}  # per turn, so never copied
+        self.recalled = []  # long-term memory hits for this turn's reply; per turn, so never copied
+
+    def is_empty(self) -> bool:
+        return not self.summary and not self.messages
+
+    def append(self, message: MessageRecord):
+        self.messages.append(message)
+
+    @property
+    def cursor(self) -> int:
+        """seq of the newest message (or of the last summarized one); 0 for a new conversation."""
+        return self.messages[-1].seq if self.messages else self.summary_seq
+
+    def messages_since(self, seq: int) -> List[MessageRecord]:
+        """Messages added after the message with the given seq (a cursor handed out earlier)."""
+        return [message for message in self.messages if message.seq > seq]
+
+    def add_time(self, phase: str, seconds: float):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def add_usage(self, result: dict, cache_hit: bool = False):
+        """
+        Add one call_llm-style result (or a response-cache hit) to the turn's usage; failed calls
+        ("error"), canned circuit-breaker replies ("degraded") and calls abandoned mid-flight
+        ("cancelled", with estimated prompt tokens) are counted as such.
+        """
+        self.usage["cache_hits" if cache_hit else "llm_calls"] += 1
+        for flag, counter in (("error", "errors"), ("degraded", "degraded"), ("cancelled", "cancelled")):
+            if result.get(flag):
+                self.usage[counter] += 1
+        for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+            self.usage[field] += result.get(field) or 0
+
+    @contextmanager
+    def timed(self, phase: str):
+        """Add the wall time of the with-block to timings[phase]."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - started)
+
+    def copy(self) -> "ConversationSnapshot":
+        return ConversationSnapshot(self.user_id, self.summary, self.messages, self.summary_seq,
+                                    self.stage_state.copy())
+
+    def approx_size(self) -> int:
+        """Rough in-memory footprint in bytes, used for the cache's memory budget."""
+        return 200 + len(self.summary) + sum(message.approx_size() for message in self.messages)
+
+    def render(self) -> str:
+        """
+        Render as "ROLE: text" lines, for places that need text (the stage prompt, the memory
+        returned by /interact); LLM requests are built from the records instead.
+        """
+        lines = []
+        if self.summary:
+            lines.append(f"SUMMARY: {self.summary}")
+        for message in self.messages:
+            lines.append(message.render())
+        return "\n".join(lines) if lines else "No memory found for this user."
+
+
+class ConversationCache:
+    """
+    A thread-safe, size-limited LRU cache of ConversationSnapshots keyed by user_id.
+    Entries are evicted when the cache exceeds max_users or max_bytes (least recently used first)
+    or when they have not been accessed for ttl_seconds. Writers keep cached entries current
+    (write-through). A snapshot read from disk is only cached if no write, invalidation or clear()
+    happened while it was being read: writes are counted per user only while a load of that user
+    is in flight, and clear() bumps a global epoch, so no per-user state outlives the loads.
+    """
+
+    def __init__(self, max_users: int = DEFAULT_CACHE_MAX_USERS, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # user_id -> [snapshot, size, last_access]
+        self._loads = {}  # user_id -> [loads in flight, writes since the first of them started]
+        self._epoch = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0 and self.max_bytes > 0
+
+    def _drop(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self, now: float):
+        # Oldest access is at the front, so expired entries are always a prefix.
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            over_budget = len(self._entries) > self.max_users or self._bytes > self.max_bytes
+            expired = now - entry[2] > self.ttl_seconds
+            if not (over_budget or expired):
+                break
+            self._drop(user_id)
+            self.evictions += 1
+
+    def get(self, user_id: str):
+        """Return a private copy of the cached snapshot, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or now - entry[2] > self.ttl_seconds:
+                if entry is not None:
+                    self._drop(user_id)
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            entry[2] = now
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0].copy()
+
+    def begin_load(self, user_id: str):
+        """
+        Register a load of user_id from disk; returns the token to pass to finish_load, which must
+        be called once the load ends (also when it fails).
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            load = self._loads.setdefault(user_id, [0, 0])
+            load[0] += 1
+            return self._epoch, load[1]
+
+    def finish_load(self, user_id: str, token, snapshot: Optional[ConversationSnapshot] = None):
+        """End a load; caches its snapshot unless the user was written to (or clear() ran) meanwhile."""
+        if token is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            load = self._loads[user_id]
+            fresh = token == (self._epoch, load[1])
+            load[0] -= 1
+            if load[0] == 0:
+                del self._loads[user_id]
+            if snapshot is None or not fresh:
+                return
+            self._drop(user_id)
+            size = snapshot.approx_size()
+            self._entries[user_id] = [snapshot.copy(), size, now]
+            self._bytes += size
+            self._evict(now)
+
+    def _written(self, user_id: str):
+        load = self._loads.get(user_id)
+        if load is not None:
+            load[1] += 1
+
+    def append(self, user_id: str, message: MessageRecord):
+        """Write-through for a newly stored message."""
+        with self._lock:
+            self._written(user_id)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            entry[0].append(message)
+            added = message.approx_size()
+            entry[1] += added
+            self._bytes += added
+            self._evict(time.monotonic())
+
+    def set_stage_state(self, user_id: str, state: StageState):
+        """Write-through for a saved stage."""
+        with self._lock:
+            self._written(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[0].stage_state = state.copy()
+
+    def apply_summary(self, user_id: str, summary: str, summary_seq: int, previous_summary_seq: int):
+        """
+        Write-through for an applied summarization: the cached snapshot takes the new summary and
+        drops the messages it folded in (seq <= summary_seq), so hot users stay cached. Dropped
+        instead if the cached summary isn't the one the summarization extended.
+        """
+        with self._lock:
+            self._written(user_id)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            snapshot = entry[0]
+            if snapshot.summary_seq != previous_summary_seq:
+                self._drop(user_id)
+                return
+            snapshot.summary = summary
+            snapshot.summary_seq = summary_seq
+            snapshot.messages = [message for message in snapshot.messages if message.seq > summary_seq]
+            size = snapshot.approx_size()
+            self._bytes += size - entry[1]
+            entry[1] = size
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._written(user_id)
+            self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1  # loads that started before now won't cache what they read
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "users": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+def _message_row(user_id: str, role: str, text: str, timestamp: int, seq: int) -> dict:
+    return {"type": "message", "user_id": user_id, "role": role, "text": text, "timestamp": timestamp, "seq": seq}
+
+
+def _summary_row(user_id: str, text: str, timestamp: int, seq: int) -> dict:
+    return {"type": "summary", "user_id": user_id, "text": text, "timestamp": timestamp, "seq": seq}
+
 
 class SQLiteMemory:
     """
@@ -18,171 +613,397 @@ class SQLiteMemory:
       - role (TEXT): 'user' or 'agent'
       - text (TEXT)
       - timestamp (INTEGER)
-    Also supports a summaries table to roll older messages.
+      - seq (INTEGER): per-user monotonic sequence number, used for ordering
+    Also supports a summaries table to roll older messages; a summary's seq is the seq of
+    the newest message folded into it.
+    All access goes through a pool of persistent WAL-mode connections (see SQLiteConnectionPool),
+    and active users' rolling memory is served from a write-through LRU cache (see ConversationCache).
     """
 
-    def __init__(self, db_path="memory.db"):
+    def __init__(self, db_path="memory.db", pool_size: int = DEFAULT_POOL_SIZE, wal: bool = True,
+                 synchronous: str = DEFAULT_SYNCHRONOUS, cache_size: int = DEFAULT_CACHE_SIZE,
+                 mmap_size: int = DEFAULT_MMAP_SIZE, cache_max_users: int = DEFAULT_CACHE_MAX_USERS,
+                 cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, cache_ttl: float = DEFAULT_CACHE_TTL_SECONDS,
+                 summarize_fn: SummarizeFn = extractive_summary, **worker_kwargs):
         """
         :param db_path: Path to the SQLite database file.
+        :param pool_size: Maximum number of pooled connections.
+        :param wal: Use write-ahead logging so readers and writers don't block each other.
+        :param synchronous: PRAGMA synchronous level (NORMAL is durable enough under WAL).
+        :param cache_size: PRAGMA cache_size (negative values are KiB).
+        :param mmap_size: PRAGMA mmap_size in bytes (0 disables memory-mapped I/O).
+        :param cache_max_users: Maximum users held in the conversation cache (0 disables it).
+        :param cache_max_bytes: Approximate memory budget for the conversation cache.
+        :param cache_ttl: Seconds an idle user stays cached.
+        :param summarize_fn: Summarizer used by the background SummarizationWorker
+            (the agent passes an LLM-backed one; the default is model-free).
+        :param worker_kwargs: Extra SummarizationWorker options (batch_size, batch_window).
         """
         self.db_path = db_path
+        self.pool = SQLiteConnectionPool(
+            db_path, pool_size=pool_size, wal=wal, synchronous=synchronous,
+            cache_size=cache_size, mmap_size=mmap_size,
+        )
+        self.cache = ConversationCache(cache_max_users, cache_max_bytes, cache_ttl)
+        self.summarizer = SummarizationWorker(self, summarize_fn, **worker_kwargs)
+        # Called with the applied SummarizationJobs after their messages were deleted, so what they
+        # removed can be kept elsewhere (e.g. LongTermMemory.archive_jobs); None keeps nothing.
+        self.archive_fn = None
         self._initialize_db()
 
+    def close(self):
+        """Stop background summarization and close all pooled connections (e.g. before deleting the file)."""
+        self.summarizer.stop()
+        self.cache.clear()
+        self.pool.close()
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def reset(self):
+        """
+        Delete every conversation (messages, summaries, stages, archived vectors and cached
+        responses) in one transaction. Unlike removing the database file this is safe while other
+        processes have it open.
+        """
+        with self.pool.transaction() as conn:
+            for statement in SQL_RESET:
+                conn.execute(statement)
+        self.cache.clear()
+
+    def try_acquire_turn_lease(self, user_id: str, owner: str, ttl_seconds: float) -> bool:
+        """Take the user's cross-process turn lease for ttl_seconds; False if someone else holds it."""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.execute(SQL_ACQUIRE_LEASE, (user_id, owner, now + ttl_seconds, now))
+            return cursor.rowcount > 0
+
+    def release_turn_lease(self, user_id: str, owner: str):
+        with self.pool.connection() as conn:
+            conn.execute(SQL_RELEASE_LEASE, (user_id, owner))
+
     def _initialize_db(self):
-        """Create the necessary tables if they don't exist."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        # Table for individual messages
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                msg_id TEXT PRIMARY KEY,
-                user_id TEXT,
-                role TEXT,
-                text TEXT,
-                timestamp INTEGER
+        """Create the necessary tables if they don't exist, migrating older databases in place."""
+        with self.pool.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            has_messages = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+            ).fetchone()
+            if has_messages and version < 2:
+                self._migrate_v1_to_v2(conn)
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def _migrate_v1_to_v2(conn: sqlite3.Connection):
+        """
+        Add the seq columns to a v1 database and backfill them.
+        Existing messages are numbered per user in (timestamp, insertion) order; legacy summaries
+        get seq 0 so they always sort before the remaining messages.
+        Runs inside the caller's transaction, so a failed migration leaves the v1 file untouched.
+        """
+        logging.warning("Migrating SQLite memory schema to v2 (per-user seq ordering)...")
+        message_cols = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "seq" not in message_cols:
+            conn.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+        summary_cols = {row[1] for row in conn.execute("PRAGMA table_info(summaries)")}
+        if summary_cols and "seq" not in summary_cols:
+            conn.execute("ALTER TABLE summaries ADD COLUMN seq INTEGER")
+        conn.execute("""
+            UPDATE messages SET seq = (
+                SELECT numbered.n FROM (
+                    SELECT rowid AS rid,
+                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp, rowid) AS n
+                    FROM messages
+                ) AS numbered
+                WHERE numbered.rid = messages.rowid
             )
         """)
-
-        # Table for summaries
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS summaries (
-                summary_id TEXT PRIMARY KEY,
-                user_id TEXT,
-                text TEXT,
-                timestamp INTEGER
+        if summary_cols:
+            conn.execute("UPDATE summaries SET seq = 0 WHERE seq IS NULL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_seq (
+                user_id TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL
             )
         """)
+        conn.execute("""
+            INSERT OR REPLACE INTO user_seq (user_id, last_seq)
+            SELECT user_id, MAX(seq) FROM messages GROUP BY user_id
+        """)
 
-        conn.commit()
-        conn.close()
+    def _next_seq(self, conn: sqlite3.Connection, user_id: str) -> int:
+        """Allocate the next sequence number for a user (caller must hold a write transaction)."""
+        conn.execute(SQL_NEXT_SEQ, (user_id,))
+        return conn.execute(SQL_CURRENT_SEQ, (user_id,)).fetchone()[0]
 
-    def store_message(self, user_id: str, text: str, role: str = "user"):
+    def _insert_message(self, user_id: str, text: str, role: str):
+        """Insert a message; returns (its MessageRecord, the user's resulting unsummarized message count)."""
+        msg_id = str(uuid.uuid4())
+        timestamp = int(time.time())
+
+        with self.pool.transaction() as conn:
+            seq = self._next_seq(conn, user_id)
+            conn.execute(SQL_INSERT_MESSAGE, (msg_id, user_id, seq, role, text, timestamp))
+            count = conn.execute(SQL_COUNT_MESSAGES, (user_id,)).fetchone()[0]
+        message = MessageRecord(role, text, seq, timestamp)
+        self.cache.append(user_id, message)
+        return message, count
+
+    def store_message(self, user_id: str, text: str, role: str = "user") -> MessageRecord:
         """
         Insert a new message into the database. After insertion,
         check if the number of messages has reached MEMORY_LIMIT,
-        and if so, trigger summarization.
+        and if so, queue the user for background summarization.
+        Returns the stored message's record.
         """
-        msg_id = str(uuid.uuid4())
-        timestamp = int(time.time())
+        message, count = self._insert_message(user_id, text, role)
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO messages (msg_id, user_id, role, text, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        """, (msg_id, user_id, role, text, timestamp))
-
-        c.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,))
-        count = c.fetchone()[0]
-        conn.commit()
-        conn.close()
+        # Trigger summarization if we have enough messages (returns immediately)
+        if count >= MEMORY_LIMIT:
+            self.summarizer.request(user_id)
+        return message
 
-        # Trigger summarization if we have enough messages
+    async def astore_message(self, user_id: str, text: str, role: str = "user") -> MessageRecord:
+        """
+        Async variant of store_message: the write runs in a worker thread so the event loop
+        keeps serving other requests while SQLite does I/O.
+        """
+        message, count = await asyncio.to_thread(self._insert_message, user_id, text, role)
         if count >= MEMORY_LIMIT:
-            asyncio.create_task(self.manage_summarization(user_id))
+            self.summarizer.request(user_id)
+        return message
 
     async def manage_summarization(self, user_id: str):
         """
-        Summarize older messages for a user:
+        Summarize older messages for a user right away:
          - Keep the last (MEMORY_LIMIT - 1) messages.
          - Summarize the older messages (optionally include existing summary).
          - Delete the summarized messages and store the new summary.
+        Normal traffic goes through the background SummarizationWorker instead; this runs the
+        same steps in a worker thread and waits for them.
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        await asyncio.to_thread(self.summarizer.process, [user_id])
 
-        c.execute("""
-            SELECT msg_id, role, text, timestamp
-            FROM messages
-            WHERE user_id = ?
-            ORDER BY timestamp ASC
-        """, (user_id,))
-        rows = c.fetchall()
-        total_messages = len(rows)
+    def import_rows(self, rows) -> set:
+        """
+        Bulk-insert one batch of rows in a single transaction. Each row is
+        ("message", user_id, role, text, timestamp) or ("summary", user_id, None, text, timestamp).
+        Rows get fresh seq values after the user's existing ones, in the order given, so a summary
+        covers everything before it: as in apply_summaries, the user's older summaries and the
+        messages before it are deleted in the same transaction. Summarization is not triggered
+        (see queue_summarization). Returns the set of user_ids written.
+        """
+        counts = {}
+        for row in rows:
+            counts[row[1]] = counts.get(row[1], 0) + 1
+        messages, summaries = [], []
+        covered = {}  # user_id -> seq of the user's last summary in this batch
+        with self.pool.transaction() as conn:
+            next_seq = {}
+            for user_id, count in counts.items():
+                conn.execute(SQL_ADVANCE_SEQ, (user_id, count))
+                next_seq[user_id] = conn.execute(SQL_CURRENT_SEQ, (user_id,)).fetchone()[0] - count + 1
+            for kind, user_id, role, text, timestamp in rows:
+                seq = next_seq[user_id]
+                next_seq[user_id] = seq + 1
+                if kind == "summary":
+                    summaries.append((str(uuid.uuid4()), user_id, seq, text, timestamp))
+                    covered[user_id] = seq
+                else:
+                    messages.append((str(uuid.uuid4()), user_id, seq, role, text, timestamp))
+            conn.executemany(SQL_INSERT_MESSAGE, messages)
+            conn.executemany(SQL_INSERT_SUMMARY, summaries)
+            for user_id, seq in covered.items():
+                conn.execute(SQL_DELETE_SUMMARIES_BEFORE, (user_id, seq))
+                conn.execute(SQL_DELETE_MESSAGES_UPTO, (user_id, seq))
+        for user_id in counts:
+            self.cache.invalidate(user_id)
+        return set(counts)
+
+    def queue_summarization(self, user_ids) -> int:
+        """Queue the given users that are at or over MEMORY_LIMIT for background summarization."""
+        queued = 0
+        with self.pool.connection() as conn:
+            for user_id in user_ids:
+                if conn.execute(SQL_COUNT_MESSAGES, (user_id,)).fetchone()[0] >= MEMORY_LIMIT:
+                    self.summarizer.request(user_id)
+                    queued += 1
+        return queued
 
+    def export_rows(self, user_ids=None):
+        """
+        Yield users' latest summary and stored messages as dicts, user by user, oldest first
+        (all users when user_ids is None). Rows are streamed from ordered index scans inside one
+        read transaction, so memory use stays constant and the export is a consistent snapshot
+        while writers carry on (WAL).
+        """
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                if user_ids is not None:
+                    for user_id in user_ids:
+                        row = conn.execute(SQL_SELECT_LATEST_SUMMARY, (user_id,)).fetchone()
+                        if row:
+                            yield _summary_row(user_id, row[1], row[2], row[3])
+                        for _, role, text, timestamp, seq in conn.execute(SQL_SELECT_MESSAGES, (user_id,)):
+                            yield _message_row(user_id, role, text, timestamp, seq)
+                    return
+                # Merge the two user-ordered scans so each user's summary comes before their messages.
+                summaries = conn.execute(SQL_EXPORT_SUMMARIES)
+                summary = summaries.fetchone()
+                for user_id, role, text, timestamp, seq in conn.execute(SQL_EXPORT_MESSAGES):
+                    while summary is not None and summary[0] <= user_id:
+                        yield _summary_row(*summary)
+                        summary = summaries.fetchone()
+                    yield _message_row(user_id, role, text, timestamp, seq)
+                while summary is not None:
+                    yield _summary_row(*summary)
+                    summary = summaries.fetchone()
+            finally:
+                conn.commit()
+
+    def plan_summarization(self, user_id: str):
+        """
+        Read what a summarization of this user would fold in.
+        Returns a SummarizationJob, or None if the user is below MEMORY_LIMIT.
+        """
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            rows = conn.execute(SQL_SELECT_MESSAGES, (user_id,)).fetchall()
+            existing_summary = conn.execute(SQL_SELECT_LATEST_SUMMARY, (user_id,)).fetchone()
+            conn.commit()
+
+        total_messages = len(rows)
         if total_messages < MEMORY_LIMIT:
-            conn.close()
-            return  # Not enough messages
+            return None  # Not enough messages
 
         # Keep the last (MEMORY_LIMIT - 1) messages; summarize the rest.
         keep_count = MEMORY_LIMIT - 1
         to_summarize = rows[: total_messages - keep_count]
+        return SummarizationJob(
+            user_id,
+            existing_summary[1] if existing_summary else "",
+            existing_summary[3] if existing_summary else 0,
+            [MessageRecord(role, text, seq, timestamp) for _, role, text, timestamp, seq in to_summarize],
+            to_summarize[-1][4],
+        )
 
-        # Fetch existing summary (if any)
-        c.execute("""
-            SELECT summary_id, text, timestamp 
-            FROM summaries 
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-        """, (user_id,))
-        existing_summary = c.fetchone()
-        existing_summary_text = existing_summary[1] if existing_summary else ""
-
-        # Build text for summarization; include role labels.
-        conversation_texts = []
-        if existing_summary_text:
-            conversation_texts.append(f"SUMMARY: {existing_summary_text}")
-        for row in to_summarize:
-            _, role, text, _ = row
-            conversation_texts.append(f"{role.upper()}: {text}")
-
-        # For demonstration, create a "fake" summary.
-        new_summary_text = "FAKE SUMMARY: " + " | ".join(conversation_texts[:3]) + "..."
-
-        new_summary_id = str(uuid.uuid4())
+    def apply_summaries(self, jobs: List[SummarizationJob]) -> int:
+        """
+        Store the summaries of a batch of jobs in one transaction, replacing each user's old summary
+        and deleting the messages it now covers. A job is skipped if the user's summary changed
+        since it was planned (e.g. a concurrent summarization) or its messages are gone (a reset).
+        Returns how many were applied.
+        """
+        applied = []
         new_timestamp = int(time.time())
-
         try:
-            c.execute("BEGIN")
-            # Remove any old summary for this user
-            c.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
-            # Insert the new summary
-            c.execute("""
-                INSERT INTO summaries (summary_id, user_id, text, timestamp)
-                VALUES (?, ?, ?, ?)
-            """, (new_summary_id, user_id, new_summary_text, new_timestamp))
-            # Delete the messages that were summarized
-            to_summarize_ids = tuple(row[0] for row in to_summarize)
-            placeholders = ",".join("?" * len(to_summarize_ids))
-            c.execute(f"DELETE FROM messages WHERE msg_id IN ({placeholders})", to_summarize_ids)
-            conn.commit()
+            with self.pool.transaction() as conn:
+                for job in jobs:
+                    current = conn.execute(SQL_SELECT_LATEST_SUMMARY, (job.user_id,)).fetchone()
+                    if (current[3] if current else 0) != job.existing_summary_seq:
+                        continue
+                    if conn.execute(SQL_MESSAGE_EXISTS, (job.user_id, job.last_seq)).fetchone() is None:
+                        continue
+                    # Remove any old summary for this user
+                    conn.execute(SQL_DELETE_SUMMARIES, (job.user_id,))
+                    # Insert the new summary
+                    conn.execute(SQL_INSERT_SUMMARY, (
+                        str(uuid.uuid4()), job.user_id, job.last_seq, job.summary, new_timestamp
+                    ))
+                    # Delete the messages that were summarized (an index range scan on (user_id, seq))
+                    conn.execute(SQL_DELETE_MESSAGES_UPTO, (job.user_id, job.last_seq))
+                    applied.append(job)
         except Exception as e:
-            conn.rollback()
             logging.error(f"Error during summarization: {e}")
+            return 0
+        for job in applied:
+            self.cache.apply_summary(job.user_id, job.summary, job.last_seq, job.existing_summary_seq)
+        if self.archive_fn is not None and applied:
+            try:
+                self.archive_fn(applied)
+            except Exception as e:
+                logging.error(f"Error archiving summarized messages: {e}")
+        return len(applied)
+
+    def load_snapshot(self, user_id: str) -> ConversationSnapshot:
+        """
+        Read the latest summary and remaining messages for a user in a single read transaction,
+        or serve them from the conversation cache when the user is hot.
+        """
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        return self._read_snapshot(user_id)
+
+    def _read_snapshot(self, user_id: str) -> ConversationSnapshot:
+        token = self.cache.begin_load(user_id)
+        snapshot = None
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN")
+                row = conn.execute(SQL_SELECT_LATEST_SUMMARY, (user_id,)).fetchone()
+                messages = conn.execute(SQL_SELECT_MESSAGES, (user_id,)).fetchall()
+                stage_row = conn.execute(SQL_SELECT_STAGE, (user_id,)).fetchone()
+                conn.commit()
+            summary_text = row[1] if row else ""
+            summary_seq = row[3] if row else 0
+            stage_state = StageState(*stage_row) if stage_row else StageState()
+            snapshot = ConversationSnapshot(
+                user_id, summary_text,
+                [MessageRecord(role, text, seq, timestamp) for _, role, text, timestamp, seq in messages],
+                summary_seq, stage_state
+            )
         finally:
-            conn.close()
+            self.cache.finish_load(user_id, token, snapshot)
+        return snapshot
+
+    async def aload_snapshot(self, user_id: str) -> ConversationSnapshot:
+        """Async variant of load_snapshot; cache hits return immediately, misses read in a worker thread."""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self._read_snapshot, user_id)
+
+    def save_stage_state(self, user_id: str, state: StageState):
+        """Persist a user's stage (and re-evaluation bookkeeping)."""
+        with self.pool.connection() as conn:
+            conn.execute(SQL_UPSERT_STAGE, (
+                user_id, state.stage, state.turns_since_eval, state.topic, int(time.time())
+            ))
+        self.cache.set_stage_state(user_id, state)
+
+    async def asave_stage_state(self, user_id: str, state: StageState):
+        await asyncio.to_thread(self.save_stage_state, user_id, state)
+
+    def get_stage(self, user_id: str) -> str:
+        """The user's last persisted stage, or "" if none has been determined yet."""
+        return self.load_snapshot(user_id).stage_state.stage
 
     def retrieve_memory(self, user_id: str) -> str:
         """
         Retrieve the current rolling memory for a user:
-        Returns the latest summary (if exists) plus any remaining messages.
-        """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        c.execute("""
-            SELECT text FROM summaries
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-        """, (user_id,))
-        row = c.fetchone()
-        summary_text = row[0] if row else ""
-
-        c.execute("""
-            SELECT role, text, timestamp
-            FROM messages
-            WHERE user_id = ?
-            ORDER BY timestamp ASC
-        """, (user_id,))
-        messages = c.fetchall()
-        conn.close()
+        Returns the latest summary (if exists) plus any remaining messages, rendered as text.
+        Use load_snapshot for the summary and typed MessageRecords.
+        """
+        return self.load_snapshot(user_id).render()
 
-        lines = []
-        if summary_text:
-            lines.append(f"SUMMARY: {summary_text}")
-        for role, text, _ in messages:
-            lines.append(f"{role.upper()}: {text}")
-        return "\n".join(lines) if lines else "No memory found for this user."
+    def history_page(self, user_id: str, before: int = None, limit: int = DEFAULT_HISTORY_PAGE_SIZE):
+        """
+        One page of a user's stored messages, newest first, found by keyset pagination on
+        (user_id, seq): the cost of a page does not depend on how deep into the history it is.
+        Returns (records oldest first, cursor for the next older page or None at the end).
+        Messages already folded into the summary are no longer stored and are not returned.
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL_SELECT_MESSAGES_BEFORE, (
+                user_id, before if before is not None else 2 ** 63 - 1, limit + 1
+            )).fetchall()
+        more = len(rows) > limit
+        records = [MessageRecord(role, text, seq, timestamp) for _, role, text, timestamp, seq in rows[:limit]]
+        records.reverse()
+        return records, (records[0].seq if more else None)
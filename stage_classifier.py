@@ -0,0 +1,179 @@
+import re
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List, Sequence, Tuple
+
+# Conversation stages the agent knows how to handle
+STAGES = ["Exploration", "Alignment", "Ownership", "Leadership"]
+
+# Cue words/phrases per stage. Phrases are matched as token bigrams.
+STAGE_KEYWORDS = {
+    "Exploration": [
+        "why", "what", "how", "understand", "explore", "confused", "unsure", "wonder", "curious",
+        "feel", "feeling", "problem", "situation", "happening", "figure", "learn", "question",
+        "idea", "meaning", "stuck", "lost", "think", "thinking", "not sure", "make sense",
+    ],
+    "Alignment": [
+        "agree", "disagree", "conflict", "perspective", "perspectives", "compromise", "both",
+        "sides", "balance", "align", "alignment", "common", "ground", "misunderstanding", "tension",
+        "argument", "partner", "team", "colleague", "boss", "reconcile", "expectations", "they want",
+        "middle", "mediate", "different views", "on the same page",
+    ],
+    "Ownership": [
+        "responsible", "responsibility", "accountable", "accountability", "commit", "commitment",
+        "decide", "decision", "deadline", "task", "my fault", "own", "ownership", "promise",
+        "deliver", "mistake", "i will", "i should", "plan", "action", "next step", "take charge",
+        "follow through", "criteria",
+    ],
+    "Leadership": [
+        "lead", "leader", "leading", "leadership", "manage", "manager", "managing", "guide",
+        "delegate", "vision", "motivate", "inspire", "mentor", "organize", "facilitate", "direct",
+        "strategy", "my team", "reports", "empower", "coach", "influence", "rally",
+    ],
+}
+
+_TOKEN_RE = re.compile(r"[a-z']+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens plus adjacent-word bigrams (so phrases like "i will" can match)."""
+    words = _TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class StageClassifier(ABC):
+    """
+    Interface for conversation-stage classifiers.
+    classify() receives the rolling window as (role, text) pairs, oldest first, and returns
+    (stage, confidence) with confidence in [0, 1].
+    """
+
+    @abstractmethod
+    def classify(self, messages: Sequence[Tuple[str, str]]) -> Tuple[str, float]:
+        ...
+
+
+class KeywordStageClassifier(StageClassifier):
+    """
+    A CPU-only TF-IDF-style keyword scorer.
+    Each cue term carries an IDF weight, log(1 + stages / stages_containing_term), so cues shared
+    between stages count for less. Term frequencies from the recent window are weighted by role
+    (the user's words matter more than the agent's) and by recency, summed into a score per
+    stage, and normalized. Confidence is the winning stage's share of the total score, damped
+    when there is little evidence at all.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = None, window: int = 6, user_weight: float = 1.0,
+                 agent_weight: float = 0.25, recency_decay: float = 0.8, min_evidence: float = 2.0):
+        """
+        :param keywords: Stage -> cue terms (defaults to STAGE_KEYWORDS).
+        :param window: Number of most recent messages to score.
+        :param user_weight: Weight of terms in user messages.
+        :param agent_weight: Weight of terms in agent messages.
+        :param recency_decay: Multiplier applied per message going back in time.
+        :param min_evidence: Total score below which confidence is scaled down proportionally.
+        """
+        keywords = keywords or STAGE_KEYWORDS
+        self.stages = list(keywords)
+        self.window = window
+        self.user_weight = user_weight
+        self.agent_weight = agent_weight
+        self.recency_decay = recency_decay
+        self.min_evidence = min_evidence
+
+        # term -> [(stage index, idf weight), ...], built once
+        owners: Dict[str, List[int]] = {}
+        for idx, stage in enumerate(self.stages):
+            for term in keywords[stage]:
+                owners.setdefault(term.lower(), []).append(idx)
+        n = len(self.stages)
+        self._term_weights = {
+            term: [(idx, math.log(1 + n / len(idxs))) for idx in idxs]
+            for term, idxs in owners.items()
+        }
+
+    def scores(self, messages: Sequence[Tuple[str, str]]) -> List[float]:
+        totals = [0.0] * len(self.stages)
+        weight = 1.0
+        for role, text in reversed(list(messages)[-self.window:]):
+            role_weight = self.user_weight if role == "user" else self.agent_weight
+            w = weight * role_weight
+            for token in tokenize(text):
+                for idx, idf in self._term_weights.get(token, ()):
+                    totals[idx] += w * idf
+            weight *= self.recency_decay
+        return totals
+
+    def classify(self, messages: Sequence[Tuple[str, str]]) -> Tuple[str, float]:
+        totals = self.scores(messages)
+        total = sum(totals)
+        if total <= 0:
+            return self.stages[0], 0.0
+        best = max(range(len(totals)), key=totals.__getitem__)
+        confidence = (totals[best] / total) * min(1.0, total / self.min_evidence)
+        return self.stages[best], confidence
+
+
+# Words ignored when extracting a conversation's topic terms
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can
+could did do does doing don't for from had has have having he her here him his how i i'm if in
+into is it it's its just me more most my no not now of on once only or other our out over own so
+some such than that the their them then there these they this to too up very was we were what
+when where which while who why will with would you your yes ok okay really thing things get got
+""".split())
+
+
+def topic_terms(text: str, limit: int = 20) -> List[str]:
+    """The most frequent non-stopword terms in text, most frequent first."""
+    counts: Dict[str, int] = {}
+    for word in _TOKEN_RE.findall(text.lower()):
+        if len(word) > 2 and word not in STOPWORDS:
+            counts[word] = counts.get(word, 0) + 1
+    return sorted(counts, key=lambda w: (-counts[w], w))[:limit]
+
+
+class StageReevaluationPolicy:
+    """
+    Decides whether a user's persisted stage must be recomputed on this turn.
+    Re-evaluates when there is no stage yet, every `every_n_turns` turns, when the new user
+    message is large, or when it shares too few topic terms with the conversation the stage was
+    computed on (the stored topic is only replaced on re-evaluation, so this catches any topic
+    change since then). Summarization alone is not a reason: with a small memory limit it runs
+    on almost every turn without the conversation moving on. Otherwise the stored stage is
+    reused and determine_conversation_stage does no classification work at all.
+    """
+
+    def __init__(self, every_n_turns: int = 4, large_message_chars: int = 400,
+                 topic_overlap_threshold: float = 0.1, min_topic_terms: int = 4):
+        """
+        :param every_n_turns: Force a re-evaluation after this many reused turns.
+        :param large_message_chars: User messages at least this long always trigger a re-evaluation.
+        :param topic_overlap_threshold: Minimum share of the new message's topic terms that must
+            already be in the stored topic; below it the message counts as a topic change.
+        :param min_topic_terms: Messages with fewer topic terms than this never count as a topic change.
+        """
+        self.every_n_turns = every_n_turns
+        self.large_message_chars = large_message_chars
+        self.topic_overlap_threshold = topic_overlap_threshold
+        self.min_topic_terms = min_topic_terms
+
+    def reason_to_reevaluate(self, state, user_input: str) -> str:
+        """
+        :param state: The user's StageState.
+        :param user_input: The newest user message.
+        :return: Why the stage must be recomputed, or "" if the stored stage can be reused.
+        """
+        if not state.stage:
+            return "no_stage"
+        if state.turns_since_eval + 1 >= self.every_n_turns:
+            return "every_n_turns"
+        if len(user_input) >= self.large_message_chars:
+            return "large_message"
+        new_terms = topic_terms(user_input)
+        if len(new_terms) >= self.min_topic_terms:
+            known = set(state.topic.split())
+            overlap = sum(1 for term in new_terms if term in known) / len(new_terms)
+            if overlap < self.topic_overlap_threshold:
+                return "topic_change"
+        return ""
@@ -0,0 +1,148 @@
+"""
+Evaluation harness for the local stage classifier.
+
+Compares KeywordStageClassifier against stage labels produced by the LLM and reports accuracy,
+how often the local answer would be used at a given confidence threshold, and latency.
+
+Dataset format (JSONL), one conversation window per line:
+    {"messages": [["user", "..."], ["agent", "..."], ...], "stage": "Alignment"}
+"stage" is the LLM label. Lines without it can be labelled on the fly with --label-with-llm
+(which calls the same prompt PartnerableAgent uses) and saved with --save-labels.
+Without a dataset, a small built-in sample is used as a smoke test.
+
+Usage:
+    python stage_classifier_eval.py conversations.jsonl --threshold 0.6
+    python stage_classifier_eval.py unlabelled.jsonl --label-with-llm --save-labels labelled.jsonl
+"""
+import sys
+import json
+import time
+import argparse
+from typing import List, Dict, Any
+
+from stage_classifier import STAGES, KeywordStageClassifier
+
+SAMPLE = [
+    {"messages": [["user", "I'm not sure why I keep feeling stuck at work, I want to understand what is happening."]],
+     "stage": "Exploration"},
+    {"messages": [["user", "What does it even mean to be a good partner? I'm curious how you think about it."]],
+     "stage": "Exploration"},
+    {"messages": [["user", "My colleague and I disagree on the roadmap and we need a compromise both sides accept."]],
+     "stage": "Alignment"},
+    {"messages": [["user", "There's tension between my boss's expectations and what the team wants. How do we find common ground?"]],
+     "stage": "Alignment"},
+    {"messages": [["user", "I made a mistake on the deadline. It's my responsibility, and I will commit to a plan to deliver."]],
+     "stage": "Ownership"},
+    {"messages": [["user", "I need to decide and take charge of this task. What is the next step so I stay accountable?"]],
+     "stage": "Ownership"},
+    {"messages": [["user", "I'm leading a new team and want to motivate them and delegate better as a manager."]],
+     "stage": "Leadership"},
+    {"messages": [["user", "How do I inspire my team and set a vision so my reports feel empowered?"]],
+     "stage": "Leadership"},
+]
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rows.append(json.loads(line))
+    return rows
+
+
+def _messages(row: Dict[str, Any]):
+    # Accept both [role, text] pairs and {"role": ..., "text"/"content": ...} objects
+    out = []
+    for m in row["messages"]:
+        if isinstance(m, dict):
+            out.append((m["role"], m.get("text", m.get("content", ""))))
+        else:
+            out.append((m[0], m[1]))
+    return out
+
+
+def label_with_llm(rows: List[Dict[str, Any]]) -> List[float]:
+    """Fill in missing "stage" labels using the agent's LLM stage prompt. Returns per-call latencies."""
+    from partnerable_agent_with_memory import PartnerableAgent, call_llm
+    from sqlite_memory_manager import ConversationSnapshot, MessageRecord
+
+    latencies = []
+    for row in rows:
+        if row.get("stage"):
+            continue
+        records = [MessageRecord(role, text) for role, text in _messages(row)]
+        text = ConversationSnapshot("eval", "", records).render()
+        start = time.perf_counter()
+        response = call_llm(PartnerableAgent._stage_messages(text), model="gpt-4o")
+        latencies.append(time.perf_counter() - start)
+        label = (response["response_text"] or "").strip()
+        row["stage"] = label if label in STAGES else "Exploration"
+    return latencies
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(rows: List[Dict[str, Any]], classifier, threshold: float) -> Dict[str, Any]:
+    confusion = {gold: {pred: 0 for pred in STAGES} for gold in STAGES}
+    latencies = []
+    correct = confident = confident_correct = 0
+    for row in rows:
+        messages = _messages(row)
+        start = time.perf_counter()
+        stage, confidence = classifier.classify(messages)
+        latencies.append(time.perf_counter() - start)
+        gold = row["stage"]
+        confusion.setdefault(gold, {pred: 0 for pred in STAGES})[stage] += 1
+        correct += stage == gold
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += stage == gold
+    n = len(rows) or 1
+    return {
+        "examples": len(rows),
+        "accuracy": correct / n,
+        "threshold": threshold,
+        "local_coverage": confident / n,  # share of turns that would skip the LLM
+        "accuracy_when_confident": confident_correct / confident if confident else 0.0,
+        "local_latency_ms_p50": _percentile(latencies, 50) * 1000,
+        "local_latency_ms_p95": _percentile(latencies, 95) * 1000,
+        "confusion": confusion,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the local stage classifier against LLM labels.")
+    parser.add_argument("dataset", nargs="?", help="JSONL dataset (defaults to a built-in sample)")
+    parser.add_argument("--threshold", type=float, default=0.6, help="Confidence needed to skip the LLM")
+    parser.add_argument("--label-with-llm", action="store_true", help="Label rows missing 'stage' via the LLM")
+    parser.add_argument("--save-labels", help="Write the labelled dataset to this JSONL path")
+    args = parser.parse_args(argv)
+
+    rows = load_dataset(args.dataset) if args.dataset else [dict(r) for r in SAMPLE]
+    llm_latencies = []
+    if args.label_with_llm:
+        llm_latencies = label_with_llm(rows)
+    missing = sum(1 for r in rows if not r.get("stage"))
+    if missing:
+        sys.exit(f"{missing} rows have no 'stage' label; rerun with --label-with-llm.")
+    if args.save_labels:
+        with open(args.save_labels, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+    report = evaluate(rows, KeywordStageClassifier(), args.threshold)
+    if llm_latencies:
+        report["llm_latency_ms_p50"] = _percentile(llm_latencies, 50) * 1000
+        report["llm_latency_ms_p95"] = _percentile(llm_latencies, 95) * 1000
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
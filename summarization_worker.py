@@ -0,0 +1,171 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import metrics
+
+# Defaults for the background summarization worker
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_BATCH_WINDOW_SECONDS = 0.5
+EXTRACTIVE_SUMMARY_CHARS = 1500
+
+# summarize_fn(existing_summary, [(role, text), ...]) -> new summary text, or None to skip
+SummarizeFn = Callable[[str, Sequence[Tuple[str, str]]], Optional[str]]
+
+
+class SummarizationJob:
+    """
+    One user's pending summarization, planned from a read of their messages:
+    the messages to fold into the summary, the summary they extend, and the seq values used
+    to check that nothing changed underneath before the result is applied.
+    """
+
+    def __init__(self, user_id: str, existing_summary: str, existing_summary_seq: int,
+                 messages: List[Tuple[str, str]], last_seq: int):
+        self.user_id = user_id
+        self.existing_summary = existing_summary
+        self.existing_summary_seq = existing_summary_seq
+        self.messages = messages
+        self.last_seq = last_seq
+        self.summary: Optional[str] = None
+
+
+def extractive_summary(existing_summary: str, messages: Sequence[Tuple[str, str]]) -> str:
+    """
+    Model-free fallback summarizer: the previous summary followed by the folded messages,
+    truncated from the front so the most recent material is kept.
+    """
+    parts = [existing_summary] if existing_summary else []
+    parts.extend(f"{role.upper()}: {text}" for role, text in messages)
+    text = " | ".join(parts)
+    if len(text) > EXTRACTIVE_SUMMARY_CHARS:
+        text = "..." + text[-EXTRACTIVE_SUMMARY_CHARS:]
+    return text
+
+
+class SummarizationWorker:
+    """
+    A background thread that summarizes users' older messages off the request path.
+    request() only records the user id and returns immediately, so it is safe to call from
+    any thread with or without a running event loop. Requests for a user already waiting in the
+    queue are deduplicated. The worker collects pending users for up to batch_window seconds,
+    plans up to batch_size of them, summarizes them in parallel and applies all results in one
+    write transaction.
+    """
+
+    def __init__(self, memory, summarize_fn: SummarizeFn = extractive_summary,
+                 batch_size: int = DEFAULT_BATCH_SIZE, batch_window: float = DEFAULT_BATCH_WINDOW_SECONDS):
+        """
+        :param memory: The SQLiteMemory to summarize (provides plan_summarization/apply_summaries).
+        :param summarize_fn: Produces the new summary text; e.g. an LLM call on a cheaper model.
+        :param batch_size: Maximum users summarized per batch.
+        :param batch_window: Seconds to wait for more requests before starting a batch.
+        """
+        self.memory = memory
+        self.summarize_fn = summarize_fn
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self._pending = OrderedDict()  # user_id -> None, used as an ordered set
+        self._cond = threading.Condition()
+        self._busy = False
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max_workers=self.batch_size, thread_name_prefix="summarize")
+        self.stats = {"requested": 0, "deduplicated": 0, "batches": 0, "summarized": 0,
+                      "skipped": 0, "failed": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="summarization-worker", daemon=True)
+            self._thread.start()
+
+    def request(self, user_id: str):
+        """Queue a user for summarization. Never blocks on summarization work."""
+        with self._cond:
+            if self._stopped:
+                return
+            self.stats["requested"] += 1
+            if user_id in self._pending:
+                self.stats["deduplicated"] += 1
+                return
+            self._pending[user_id] = None
+            self._ensure_started()
+            self._cond.notify()
+
+    def _next_batch(self) -> Optional[List[str]]:
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+        # Give concurrent requests a moment to pile up so they share a batch.
+        if self.batch_window > 0:
+            time.sleep(self.batch_window)
+        with self._cond:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[0])
+            self._busy = True
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self.process(batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logging.error(f"Error during summarization batch: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _summarize_job(self, job: SummarizationJob) -> SummarizationJob:
+        try:
+            with metrics.phase_timer("summarization"):
+                job.summary = self.summarize_fn(job.existing_summary, job.messages)
+        except Exception as e:
+            logging.error(f"Error summarizing conversation for {job.user_id}: {e}")
+            metrics.registry.inc(metrics.ERRORS, source="summarization")
+            job.summary = None
+        return job
+
+    def process(self, user_ids: Sequence[str]):
+        """Plan, summarize and apply one batch synchronously (the worker thread's unit of work)."""
+        jobs = [job for job in (self.memory.plan_summarization(u) for u in user_ids) if job is not None]
+        self.stats["batches"] += 1
+        if not jobs:
+            return
+        jobs = list(self._executor.map(self._summarize_job, jobs))
+        done = [job for job in jobs if job.summary]
+        self.stats["failed"] += len(jobs) - len(done)
+        applied = self.memory.apply_summaries(done) if done else 0
+        self.stats["summarized"] += applied
+        self.stats["skipped"] += len(done) - applied
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Wait until the queue is empty and no batch is running. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        """Stop the worker thread; queued users that haven't started are dropped."""
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,39 @@
+from context_builder import RECALL_HEADER, ContextBuilder
+from sqlite_memory_manager import MessageRecord
+
+
+def _messages(count, words=20):
+    return [MessageRecord("user" if i % 2 == 0 else "agent", " ".join([f"word{i}"] * words), seq=i + 1)
+            for i in range(count)]
+
+
+def test_everything_fits_in_priority_layout():
+    builder = ContextBuilder(budget=10000)
+    messages, report = builder.build("system", "summary", _messages(3), recalled=["[2024-01-01] USER: old"])
+    assert [m["role"] for m in messages] == ["system", "system", "system", "user", "assistant", "user"]
+    assert messages[2]["content"].startswith(RECALL_HEADER)
+    assert report["messages_dropped"] == 0 and report["recalled_included"] == 1
+
+
+def test_recall_never_pushes_out_recent_messages():
+    history = _messages(4)
+    builder = ContextBuilder(budget=10000)
+    _, without_recall = builder.build("system", "", history)
+    # Room for exactly the system prompt and the four messages
+    builder.budget = without_recall["prompt_tokens"]
+    snippets = [" ".join(["recalled"] * 30)] * 3
+    messages, report = builder.build("system", "", history, recalled=snippets)
+    assert report["messages_included"] == 4 and report["recalled_included"] == 0
+    assert len(messages) == 5
+    # With room for one snippet, recall fills what is left after the messages
+    builder.budget += builder._tokens(f"{RECALL_HEADER}\n- {snippets[0]}")
+    _, report = builder.build("system", "", history, recalled=snippets)
+    assert report["messages_included"] == 4 and report["recalled_included"] == 1
+    assert report["prompt_tokens"] <= builder.budget
+
+
+def test_latest_message_always_included():
+    builder = ContextBuilder(budget=1)
+    messages, report = builder.build("system", "summary", _messages(3))
+    assert report["messages_included"] == 1 and report["summary_included"] == 0
+    assert messages[-1]["content"].startswith("word2")
@@ -0,0 +1,60 @@
+import io
+import json
+import asyncio
+
+import pytest
+
+from conversation_io import JSONLImporter, aimport_jsonl, aiter_lines, export_jsonl, import_jsonl
+from sqlite_memory_manager import SQLiteMemory
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = SQLiteMemory(db_path=str(tmp_path / "memory.db"))
+    yield memory
+    memory.close()
+
+
+SOURCE = [
+    {"type": "summary", "user_id": "alice", "text": "Alice is planning a move.", "timestamp": 1700000000},
+    {"type": "message", "user_id": "alice", "role": "user", "text": "Where should I start?", "timestamp": 1700000001},
+    {"type": "message", "user_id": "alice", "role": "assistant", "text": "With a list.", "timestamp": 1700000002},
+    {"user_id": "bob", "messages": [["user", "hi"], {"role": "agent", "text": "hello", "timestamp": 1700000003}]},
+]
+
+
+def _strip_seq(rows):
+    return [{key: value for key, value in row.items() if key != "seq"} for row in rows]
+
+
+def test_export_import_round_trip(memory, tmp_path):
+    importer = import_jsonl(memory, [json.dumps(obj) for obj in SOURCE], batch_size=2)
+    assert importer.report()["rows"] == 5 and importer.report()["errors"] == 0
+    exported = [json.loads(line) for line in export_jsonl(memory)]
+    assert [row["user_id"] for row in exported] == ["alice", "alice", "alice", "bob", "bob"]
+    assert exported[0]["type"] == "summary" and exported[2]["role"] == "agent"
+
+    copy = SQLiteMemory(db_path=str(tmp_path / "copy.db"))
+    try:
+        import_jsonl(copy, io.StringIO("".join(export_jsonl(memory))))
+        assert _strip_seq(json.loads(line) for line in export_jsonl(copy)) == _strip_seq(exported)
+    finally:
+        copy.close()
+
+
+def test_invalid_lines_are_counted_not_raised(memory):
+    async def body():
+        yield b'{"user_id": "alice", "role": "user", "text": "ok"}\n{"user_id": "alice", "role": "'
+        yield b'user", "text": "caf\xe9"}\nnot json\n{"user_id": "alice", "role": "robot", "text": "x"}'
+
+    importer = asyncio.run(aimport_jsonl(memory, aiter_lines(body())))
+    report = importer.report()
+    assert report["rows"] == 1 and report["errors"] == 3
+    assert report["error_samples"][0].startswith("line 2:")
+
+
+def test_feed_batches_rows(memory):
+    importer = JSONLImporter(memory, batch_size=2)
+    assert importer.feed(json.dumps(SOURCE[1])) is None
+    batch = importer.feed(json.dumps(SOURCE[2]))
+    assert [row[2] for row in batch] == ["user", "agent"]
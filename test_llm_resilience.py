@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import metrics
+from llm_resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, get_resilient_caller
+
+
+def _open_breaker(reset_seconds: float = 0.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=reset_seconds)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def _raise(error):
+    def fn(timeout):
+        raise error
+    return fn
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is True
+    assert breaker.state == "open"
+    assert breaker.acquire() is None
+
+
+def test_breaker_admits_one_probe_when_half_open():
+    breaker = _open_breaker()
+    assert breaker.acquire() == "probe"
+    assert breaker.state == "half_open"
+    assert breaker.acquire() is None
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.acquire() == "call"
+
+
+def test_failed_probe_reopens_breaker():
+    caller = ResilientCaller(max_retries=0, breaker=_open_breaker())
+    with pytest.raises(TimeoutError):
+        caller.call(_raise(TimeoutError()))
+    assert caller.breaker.state == "open"
+    caller.breaker.reset_seconds = 60
+    with pytest.raises(CircuitOpenError):
+        caller.call(lambda timeout: "ok")
+
+
+def _status_error(status_code: int) -> openai.APIStatusError:
+    response = SimpleNamespace(status_code=status_code, request=None, headers={})
+    return openai.APIStatusError("upstream said no", response=response, body=None)
+
+
+def test_client_error_probe_closes_breaker():
+    caller = ResilientCaller(max_retries=0, breaker=_open_breaker())
+    # A 4xx (bad request, auth) means the upstream answered
+    with pytest.raises(openai.APIStatusError):
+        caller.call(_raise(_status_error(400)))
+    assert caller.breaker.state == "closed"
+    assert caller.call(lambda timeout: "ok") == "ok"
+
+
+def test_local_error_leaves_breaker_alone():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    caller = ResilientCaller(max_retries=0, breaker=breaker)
+    with pytest.raises(KeyError):
+        caller.call(_raise(KeyError("response_text")))
+    assert breaker._failures == 1  # neither reset by a "success" nor counted as an upstream failure
+    caller = ResilientCaller(max_retries=0, breaker=_open_breaker())
+    with pytest.raises(TypeError):
+        caller.call(_raise(TypeError("parser bug")))
+    # The probe slot is freed, but the breaker does not close on a bug in our own code
+    assert caller.breaker.state == "half_open"
+    assert caller.call(lambda timeout: "ok") == "ok"
+    assert caller.breaker.state == "closed"
+
+
+def test_interrupted_probe_releases_half_open_slot():
+    caller = ResilientCaller(max_retries=0, breaker=_open_breaker())
+    with pytest.raises(KeyboardInterrupt):
+        caller.call(_raise(KeyboardInterrupt()))
+    assert caller.breaker.state == "half_open"
+    assert caller.call(lambda timeout: "ok") == "ok"
+    assert caller.breaker.state == "closed"
+
+
+def test_cancelled_async_probe_releases_half_open_slot():
+    caller = ResilientCaller(max_retries=0, breaker=_open_breaker())
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hang(timeout):
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.create_task(caller.acall(hang))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def ok(timeout):
+            return "ok"
+        return await caller.acall(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert caller.breaker.state == "closed"
+
+
+def test_stream_opens_use_their_own_latency_window():
+    caller = ResilientCaller(max_retries=0)
+
+    async def ok(timeout):
+        return "ok"
+
+    async def scenario():
+        await caller.acall(ok, stream=True)
+        await caller.acall(ok)
+
+    asyncio.run(scenario())
+    assert len(caller._stream_latencies) == 1 and len(caller._latencies) == 1
+    assert "stream_open_p50" in caller.stats()
+
+
+def test_resilience_counters_are_exported():
+    caller = get_resilient_caller("test-export-model")
+    caller._count("retries", 2)
+    caller._count("circuit_trips")
+    rendered = metrics.registry.render()
+    assert 'partnerable_llm_resilience_events_total{event="retries",model="test-export-model"} 2' in rendered
+    assert 'partnerable_llm_resilience_events_total{event="circuit_trips",model="test-export-model"} 1' in rendered
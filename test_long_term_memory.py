@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from long_term_memory import HashingEmbedder, LongTermMemory
+from sqlite_memory_manager import SQLiteMemory
+
+
+@pytest.fixture
+def recall(tmp_path):
+    memory = SQLiteMemory(db_path=str(tmp_path / "memory.db"))
+    yield LongTermMemory(memory.pool, HashingEmbedder(), top_k=2, min_score=0.1)
+    memory.close()
+
+
+def _archive(recall, user_id, texts, first_seq=1):
+    recall.archive(user_id, [("message", "user", first_seq + i, text, 1700000000) for i, text in enumerate(texts)])
+
+
+def test_recall_finds_archived_message(recall):
+    _archive(recall, "alice", ["My dog Biscuit chewed the budget report", "We talked about the weather",
+                               "The board meeting moved to Friday"])
+    _archive(recall, "bob", ["Biscuit is also the name of my dog"])
+    hits = recall.recall("alice", "what did Biscuit chew?")
+    assert hits[0].text == "My dog Biscuit chewed the budget report"
+    assert "Biscuit is also the name of my dog" not in [hit.text for hit in hits]
+    assert recall.recall("carol", "Biscuit") == []
+
+
+def test_cached_matrix_is_topped_up_with_new_vectors(recall):
+    _archive(recall, "alice", ["first topic about gardening"])
+    recall.recall("alice", "gardening")
+    _archive(recall, "alice", ["second topic about sailing boats"], first_seq=2)
+    assert recall.recall("alice", "sailing boats")[0].text == "second topic about sailing boats"
+    assert recall.stats["full_loads"] == 1 and recall.stats["incremental_loads"] == 1
+
+
+def test_clear_forgets_vectors(recall):
+    _archive(recall, "alice", ["something to remember"])
+    recall.recall("alice", "remember")
+    recall.clear()
+    assert recall.recall("alice", "something to remember") == []
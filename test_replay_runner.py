@@ -0,0 +1,63 @@
+import json
+import asyncio
+
+from replay_runner import RateLimiter, ReplayRunner, parse_conversation
+from sqlite_memory_manager import ConversationSnapshot
+
+
+class FakeAgent:
+    """Answers every turn; inputs containing "fail" come back the way acall_llm reports a failure."""
+
+    def __init__(self):
+        self.summary_usage = {"llm_calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                              "cached_tokens": 0, "cost": 0.0}
+
+    async def arun_turn(self, user_id, user_input, use_cache=True):
+        turn = ConversationSnapshot(user_id)
+        if "fail" in user_input:
+            turn.add_usage({"response_text": None, "error": "timed out"})
+            return "I'm sorry, I have no response.", turn
+        turn.add_usage({"response_text": "ok", "prompt_tokens": 10, "completion_tokens": 5, "cost": 0.01})
+        # A summarization call made in the background during the turn
+        self.summary_usage["llm_calls"] += 1
+        self.summary_usage["prompt_tokens"] += 100
+        self.summary_usage["cost"] += 0.001
+        return "ok", turn
+
+
+def _run(tmp_path, lines, limiter=None):
+    output, checkpoint = tmp_path / "out.jsonl", tmp_path / "out.checkpoint"
+    runner = ReplayRunner(FakeAgent(), str(output), str(checkpoint), workers=2, limiter=limiter)
+    report = asyncio.run(runner.run(lines))
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    return report, results, checkpoint.read_text().split()
+
+
+def test_parse_conversation_forms():
+    assert parse_conversation('{"id": "a", "turns": ["hi", "there"]}', 1) == ("a", ["hi", "there"])
+    assert parse_conversation('{"messages": [["user", "hi"], ["agent", "yo"]]}', 3) == ("line-3", ["hi"])
+    assert parse_conversation("  ", 4) is None
+
+
+def test_failed_llm_reply_is_not_checkpointed(tmp_path):
+    lines = ['{"id": "good", "turns": ["hello", "again"]}', '{"id": "bad", "turns": ["this will fail", "never"]}']
+    report, results, done = _run(tmp_path, lines)
+    assert done == ["good"]
+    assert report["conversations"] == 1 and report["failed"] == 1
+    bad = [result for result in results if result["conversation_id"] == "bad"]
+    assert len(bad) == 1 and bad[0]["error"] == "LLM call failed"
+
+
+def test_summarizer_usage_is_counted_and_rate_limited(tmp_path):
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=60000)
+    charged = []
+    charge = limiter.charge
+    limiter.charge = lambda requests, tokens: (charged.append((requests, tokens)), charge(requests, tokens))
+    report, _, _ = _run(tmp_path, ['{"id": "c", "turns": ["one", "two", "three"]}'], limiter)
+    assert report["summary_calls"] == 3
+    assert report["llm_calls"] == 6
+    assert report["prompt_tokens"] == 3 * 10 + 3 * 100
+    assert abs(report["cost"] - 3 * 0.011) < 1e-9
+    # Each turn's one request was reserved by wait(); the 3 summary calls are charged on top
+    assert sum(requests for requests, _ in charged) == 3
+    assert sum(tokens for _, tokens in charged) == 3 * 15 + 3 * 100
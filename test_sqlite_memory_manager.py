@@ -0,0 +1,186 @@
+import sqlite3
+
+import pytest
+
+from sqlite_memory_manager import (MEMORY_LIMIT, SCHEMA_VERSION, ConversationCache, ConversationSnapshot, MessageRecord,
+                                  SQLiteConnectionPool, SQLiteMemory)
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = SQLiteMemory(db_path=str(tmp_path / "memory.db"))
+    yield memory
+    memory.close()
+
+
+def _tables(db_path):
+    with sqlite3.connect(db_path) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return version, tables
+
+
+def test_pool_reuses_connections_and_rolls_back_failed_transactions(tmp_path):
+    pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), pool_size=2)
+    try:
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            first = conn
+        with pool.connection() as conn:
+            assert conn is first
+        with pytest.raises(RuntimeError):
+            with pool.transaction() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+                raise RuntimeError("boom")
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    finally:
+        pool.close()
+
+
+def test_reopening_database_keeps_data(tmp_path):
+    db_path = str(tmp_path / "memory.db")
+    memory = SQLiteMemory(db_path=db_path)
+    memory.store_message("alice", "hello")
+    memory.close()
+    memory = SQLiteMemory(db_path=db_path)
+    try:
+        assert memory.retrieve_memory("alice") == "USER: hello"
+    finally:
+        memory.close()
+
+
+def test_v1_database_is_migrated_to_current_schema(tmp_path):
+    db_path = str(tmp_path / "v1.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE messages (msg_id TEXT PRIMARY KEY, user_id TEXT, role TEXT, text TEXT, "
+                     "timestamp INTEGER)")
+        conn.execute("CREATE TABLE summaries (summary_id TEXT PRIMARY KEY, user_id TEXT, text TEXT, timestamp INTEGER)")
+        conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", [
+            ("m3", "alice", "user", "third", 300), ("m1", "alice", "user", "first", 100),
+            ("m2", "alice", "agent", "second", 200), ("b1", "bob", "user", "hello", 150),
+        ])
+        conn.execute("INSERT INTO summaries VALUES ('s1', 'alice', 'Earlier talk.', 50)")
+    memory = SQLiteMemory(db_path=db_path)
+    try:
+        assert memory.retrieve_memory("alice") == "SUMMARY: Earlier talk.\nUSER: first\nAGENT: second\nUSER: third"
+        memory.store_message("bob", "again")
+    finally:
+        memory.close()
+    version, tables = _tables(db_path)
+    assert version == SCHEMA_VERSION
+    assert {"user_seq", "user_stage", "turn_leases"} <= tables
+    with sqlite3.connect(db_path) as conn:
+        seqs = conn.execute("SELECT user_id, seq, text FROM messages ORDER BY user_id, seq").fetchall()
+    # New messages continue each user's backfilled sequence
+    assert seqs == [("alice", 1, "first"), ("alice", 2, "second"), ("alice", 3, "third"),
+                    ("bob", 1, "hello"), ("bob", 2, "again")]
+
+
+def test_message_record_round_trip_keeps_multiline_text(memory):
+    text = "First line\nAGENT: not a new message\n\nlast line"
+    stored = memory.store_message("alice", text, role="user")
+    record = memory.load_snapshot("alice").messages[0]
+    assert (record.role, record.text, record.seq) == ("user", text, stored.seq)
+    role, unpacked_text = record
+    assert (role, unpacked_text) == ("user", text)
+    assert record.to_llm() == {"role": "user", "content": text}
+    assert MessageRecord("agent", "hi").to_llm() == {"role": "assistant", "content": "hi"}
+    assert MessageRecord("tool", "x").to_llm()["role"] == "system"
+    assert record.to_dict() == {"seq": stored.seq, "role": "user", "text": text, "timestamp": stored.timestamp}
+
+
+def _store_messages(memory, user_id, count):
+    """Store messages without queueing summarization."""
+    for i in range(count):
+        memory._insert_message(user_id, f"message {i + 1}", "user" if i % 2 == 0 else "agent")
+
+
+def test_history_page_walks_back_with_keyset_cursor(memory):
+    _store_messages(memory, "alice", 7)
+    _store_messages(memory, "bob", 3)
+    pages, before = [], None
+    while True:
+        records, before = memory.history_page("alice", before=before, limit=3)
+        pages.append([record.seq for record in records])
+        if before is None:
+            break
+    assert pages == [[5, 6, 7], [2, 3, 4], [1]]
+
+
+def test_history_page_exact_multiple_ends_without_cursor(memory):
+    _store_messages(memory, "alice", 4)
+    records, before = memory.history_page("alice", limit=2)
+    assert [record.text for record in records] == ["message 3", "message 4"] and before == 3
+    records, before = memory.history_page("alice", before=before, limit=2)
+    assert [record.seq for record in records] == [1, 2] and before is None
+    assert memory.history_page("nobody") == ([], None)
+
+
+def test_imported_summary_replaces_earlier_messages(memory):
+    _store_messages(memory, "alice", 3)
+    memory.import_rows([("summary", "alice", None, "Alice talked about her garden.", 1700000100),
+                        ("message", "alice", "user", "Back again", 1700000200)])
+    snapshot = memory.load_snapshot("alice")
+    assert snapshot.summary == "Alice talked about her garden."
+    assert [message.text for message in snapshot.messages] == ["Back again"]
+    assert snapshot.summary_seq == 4 and snapshot.messages[0].seq == 5
+
+
+def test_v4_database_gains_later_tables(tmp_path):
+    db_path = str(tmp_path / "v4.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE turn_leases (user_id TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        conn.execute("PRAGMA user_version = 4")
+    SQLiteMemory(db_path=db_path).close()
+    version, tables = _tables(db_path)
+    assert version == SCHEMA_VERSION
+    assert {"response_cache", "memory_vectors"} <= tables
+
+
+def test_summarization_updates_cached_snapshot_in_place(memory):
+    assert memory.load_snapshot("alice").is_empty()  # cached from here on
+    for i in range(MEMORY_LIMIT):
+        memory.store_message("alice", f"message {i + 1}", role="user" if i % 2 == 0 else "agent")
+    assert memory.summarizer.flush()
+    hits = memory.cache.hits
+    snapshot = memory.load_snapshot("alice")
+    assert memory.cache.hits == hits + 1
+    assert snapshot.summary and snapshot.summary_seq == 1
+    assert [message.seq for message in snapshot.messages] == [2, 3, 4, 5]
+    memory.cache.clear()
+    from_disk = memory.load_snapshot("alice")
+    assert (from_disk.summary, from_disk.summary_seq) == (snapshot.summary, snapshot.summary_seq)
+    assert [message.text for message in from_disk.messages] == [message.text for message in snapshot.messages]
+
+
+def test_cache_skips_snapshots_made_stale_during_the_load():
+    cache = ConversationCache()
+    token = cache.begin_load("alice")
+    cache.append("alice", MessageRecord("user", "written meanwhile", seq=1))
+    cache.finish_load("alice", token, ConversationSnapshot("alice"))
+    assert cache.get("alice") is None
+    token = cache.begin_load("alice")
+    cache.clear()
+    cache.finish_load("alice", token, ConversationSnapshot("alice"))
+    assert cache.get("alice") is None
+    token = cache.begin_load("alice")
+    cache.finish_load("alice", token, ConversationSnapshot("alice"))
+    assert cache.get("alice") is not None
+    # Writes to users without a load in flight leave no per-user state behind
+    cache.append("bob", MessageRecord("user", "hi", seq=1))
+    assert cache._loads == {}
+
+
+def test_reset_empties_every_conversation_table(memory):
+    memory.store_message("alice", "hello")
+    with memory.pool.connection() as conn:
+        conn.execute("INSERT INTO response_cache VALUES ('key', 'gpt-4o', 'hi', 1, 1, 0)")
+        conn.execute("INSERT INTO memory_vectors (user_id, embedder, kind, seq, text, timestamp, vector) "
+                     "VALUES ('alice', 'hashing', 'message', 1, 'hello', 0, x'00')")
+    memory.reset()
+    with memory.pool.connection() as conn:
+        for table in ("messages", "summaries", "user_stage", "memory_vectors", "response_cache"):
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0, table
+    assert memory.load_snapshot("alice").is_empty()
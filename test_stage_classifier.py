@@ -0,0 +1,39 @@
+import pytest
+
+from sqlite_memory_manager import StageState
+from stage_classifier import KeywordStageClassifier, StageClassifier, StageReevaluationPolicy, topic_terms
+
+
+def _state(topic_text: str, turns_since_eval: int = 0) -> StageState:
+    return StageState("Exploration", turns_since_eval, " ".join(topic_terms(topic_text)))
+
+
+GARDEN = "I want to plan my vegetable garden, which vegetables grow in shade and how to water the garden"
+
+
+def test_reuses_stage_on_same_topic_even_after_summarization():
+    policy = StageReevaluationPolicy()
+    # Summaries folded in since the stage was computed are no reason to re-evaluate on their own
+    state = _state(GARDEN)
+    assert policy.reason_to_reevaluate(state, "Should the garden vegetables get water every morning?") == ""
+
+
+def test_topic_change_since_last_evaluation_triggers():
+    policy = StageReevaluationPolicy()
+    state = _state(GARDEN, turns_since_eval=1)
+    message = "My job interview next week worries me, which questions will the panel ask"
+    assert policy.reason_to_reevaluate(state, message) == "topic_change"
+
+
+def test_other_triggers():
+    policy = StageReevaluationPolicy(every_n_turns=4, large_message_chars=50)
+    assert policy.reason_to_reevaluate(StageState(), "hello") == "no_stage"
+    assert policy.reason_to_reevaluate(_state(GARDEN, turns_since_eval=3), "garden") == "every_n_turns"
+    assert policy.reason_to_reevaluate(_state(GARDEN), "garden " * 10) == "large_message"
+
+
+def test_stage_classifier_is_abstract():
+    with pytest.raises(TypeError):
+        StageClassifier()
+    stage, confidence = KeywordStageClassifier().classify([("user", "I need to decide and take responsibility")])
+    assert stage == "Ownership" and 0 <= confidence <= 1
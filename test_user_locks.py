@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from sqlite_memory_manager import SQLiteMemory
+from user_locks import SQLiteTurnLease, UserLocks
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = SQLiteMemory(db_path=str(tmp_path / "memory.db"))
+    yield memory
+    memory.close()
+
+
+async def _turn(locks, user_id, log, name, seconds=0.01):
+    async with locks.hold(user_id):
+        log.append(("start", name))
+        await asyncio.sleep(seconds)
+        log.append(("end", name))
+
+
+def test_same_user_turns_run_one_at_a_time_in_order():
+    locks = UserLocks()
+    log = []
+
+    async def scenario():
+        await asyncio.gather(*(_turn(locks, "alice", log, i) for i in range(3)))
+
+    asyncio.run(scenario())
+    assert log == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert locks.stats["queued"] == 2 and locks.stats["max_queue"] == 2
+    assert locks.active_users() == 0
+
+
+def test_different_users_run_in_parallel():
+    locks = UserLocks()
+    log = []
+
+    async def scenario():
+        await asyncio.gather(_turn(locks, "alice", log, "a"), _turn(locks, "bob", log, "b"))
+
+    asyncio.run(scenario())
+    assert log[:2] == [("start", "a"), ("start", "b")]
+
+
+def test_lock_is_released_when_a_turn_fails():
+    locks = UserLocks()
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with locks.hold("alice"):
+                raise ValueError("turn failed")
+        async with locks.hold("alice"):
+            return locks.active_users()
+
+    assert asyncio.run(scenario()) == 1
+    assert locks.active_users() == 0
+
+
+def test_turn_lease_is_exclusive_until_released_or_expired(memory):
+    assert memory.try_acquire_turn_lease("alice", "worker-1", ttl_seconds=60)
+    assert not memory.try_acquire_turn_lease("alice", "worker-2", ttl_seconds=60)
+    assert memory.try_acquire_turn_lease("bob", "worker-2", ttl_seconds=60)
+    memory.release_turn_lease("alice", "worker-2")  # not the owner: no effect
+    assert not memory.try_acquire_turn_lease("alice", "worker-2", ttl_seconds=60)
+    memory.release_turn_lease("alice", "worker-1")
+    assert memory.try_acquire_turn_lease("alice", "worker-2", ttl_seconds=-1)  # already expired
+    assert memory.try_acquire_turn_lease("alice", "worker-3", ttl_seconds=60)
+
+
+def test_lease_serializes_turns_across_workers(memory, tmp_path):
+    # Two "workers": separate memories, locks and lease owners on the same database file
+    other = SQLiteMemory(db_path=str(tmp_path / "memory.db"))
+    workers = [UserLocks(lease=SQLiteTurnLease(memory)), UserLocks(lease=SQLiteTurnLease(other))]
+    log = []
+
+    async def scenario():
+        await asyncio.gather(*(_turn(workers[i % 2], "alice", log, i, seconds=0.05) for i in range(4)))
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        other.close()
+    starts_and_ends = [event for event, _ in log]
+    assert starts_and_ends == ["start", "end"] * 4
+    assert sum(worker.lease.waits for worker in workers) > 0
@@ -0,0 +1,91 @@
+import os
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+# Cross-process turn leases (see SQLiteTurnLease)
+DEFAULT_LEASE_TTL_SECONDS = 300.0   # longer than any turn; only matters if a worker dies mid-turn
+LEASE_POLL_SECONDS = 0.01
+LEASE_MAX_POLL_SECONDS = 0.25
+
+
+class SQLiteTurnLease:
+    """
+    Per-user lease kept in the shared SQLite database (turn_leases table), so a user's turns are
+    serialized across worker processes too. Waiters poll with exponential backoff; a lease left
+    behind by a crashed worker expires after ttl_seconds.
+    """
+
+    def __init__(self, memory, ttl_seconds: float = DEFAULT_LEASE_TTL_SECONDS):
+        """
+        :param memory: SQLiteMemory whose database is shared by the workers.
+        :param ttl_seconds: How long a lease is valid without being released.
+        """
+        self.memory = memory
+        self.ttl_seconds = ttl_seconds
+        # One owner per process is enough: UserLocks already serializes a user's turns in-process.
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.waits = 0
+
+    async def acquire(self, user_id: str):
+        delay = LEASE_POLL_SECONDS
+        while not await asyncio.to_thread(self.memory.try_acquire_turn_lease, user_id, self.owner, self.ttl_seconds):
+            self.waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LEASE_MAX_POLL_SECONDS)
+
+    async def release(self, user_id: str):
+        await asyncio.to_thread(self.memory.release_turn_lease, user_id, self.owner)
+
+
+class UserLocks:
+    """
+    One asyncio.Lock per user, created on demand and dropped once nobody holds or waits for it.
+    Holding a user's lock for a whole turn makes that user's turns run one at a time, in arrival
+    order (asyncio.Lock wakes waiters first-in first-out), while different users run in parallel.
+    Must be used from a single event loop. With a lease (e.g. SQLiteTurnLease) the holder of the
+    local lock also takes the user's cross-process lease, for deployments with several workers.
+    """
+
+    def __init__(self, lease=None):
+        """
+        :param lease: Optional cross-process lease with async acquire(user_id) / release(user_id).
+        """
+        self.lease = lease
+        self._locks = {}  # user_id -> [lock, holders + waiters]
+        self.stats = {"turns": 0, "queued": 0, "max_queue": 0}
+
+    @asynccontextmanager
+    async def hold(self, user_id: str):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[1] > 1:
+            self.stats["queued"] += 1
+            self.stats["max_queue"] = max(self.stats["max_queue"], entry[1] - 1)
+        try:
+            async with entry[0]:
+                self.stats["turns"] += 1
+                if self.lease is None:
+                    yield
+                else:
+                    await self.lease.acquire(user_id)
+                    try:
+                        yield
+                    finally:
+                        await self.lease.release(user_id)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    def active_users(self) -> int:
+        return len(self._locks)
+
+    def snapshot(self) -> Dict[str, int]:
+        stats = {**self.stats, "active_users": self.active_users()}
+        if self.lease is not None:
+            stats["lease_waits"] = self.lease.waits
+        return stats